@@ -1,17 +1,89 @@
-from node import Node
-import math
+from node import Node, ABOVE, branch
 import numpy as np
 import parse
 import copy
-import unit_tests
-
-def ID3(input_examples: list[dict], default):
+import columnar
+import compiled
+import dataset
+from profiling import NO_STATS
+from collections import Counter
+
+# The growth limits under which ID3 grows the full tree
+GROW_FULLY = dict(max_depth=None, min_samples_split=2, min_samples_leaf=1, min_info_gain=0.0,
+                  max_leaf_nodes=None, growth='depth')
+
+def ID3(input_examples: list[dict], default, engine: str = 'columnar', numeric=(), bins=None,
+        max_depth=None, min_samples_split=2, min_samples_leaf=1, min_info_gain=0.0,
+        max_leaf_nodes=None, growth='depth', max_features=None, seed=None, stats=None,
+        missing='category'):
     '''
     Takes in an array of examples, and returns a tree (an instance of Node) 
     trained on the examples. Each example is a dictionary of attribute:value pairs,
     and the target class variable is a special attribute with the name "Class".
     Any missing attributes are denoted with a value of "?"
+
+    engine="columnar" (the default) encodes the examples once into an integer
+    matrix and trains on index arrays; input_examples may also be an
+    EncodedDataset.  engine="dict" is the original dictionary implementation.
+    Both engines build the same tree.
+
+    The attributes listed in numeric (and any the EncodedDataset already has as
+    numeric) get binary splits at a threshold instead of a child per value;
+    bins optionally cuts them into that many quantile buckets first.  See
+    dataset.as_numeric.  Only the columnar engine handles numeric attributes.
+
+    max_depth, min_samples_split, min_samples_leaf, min_info_gain and
+    max_leaf_nodes stop growth early, and growth="best" expands the split with
+    the highest gain first instead of going depth first; see columnar.build.
+    growth="level" grows the same tree as the default a level at a time,
+    without recursion (see columnar.build_levels).  sharded.py grows that tree
+    with worker processes from row shards on disk, for data too large for one.
+    The defaults grow the full tree.  Only the columnar engine takes limits.
+
+    max_features makes each node split on the best of a random max_features of
+    its attributes, drawn from a NumPy generator seeded with seed.
+
+    missing="weighted" handles missing values "?" as C4.5 does instead of as a
+    value of their own: training sends a row missing the split attribute down
+    every branch with a fraction of its weight, and evaluate and test combine
+    the branches' class distributions for such an example.  See columnar.build.
+    Only the columnar engine weighs missing values.
+
+    stats, a profiling.TrainingStats, records where the time goes: phase
+    encode, then columnar.build's phases; or, in the dict engine, the phases
+    gains (find_best_split), partition (get_da), copy (copying the examples)
+    and ID3 (the recursion).  Both count nodes, leaves, splits,
+    splits_evaluated and rows_scanned.
     '''
+    if stats is None:
+        stats = NO_STATS
+    limits = dict(max_depth=max_depth, min_samples_split=min_samples_split,
+                  min_samples_leaf=min_samples_leaf, min_info_gain=min_info_gain,
+                  max_leaf_nodes=max_leaf_nodes, growth=growth)
+    if max_features is not None:
+        limits.update(max_features=max_features, rng=seed)
+    if engine == 'columnar':
+        if isinstance(input_examples, dataset.EncodedDataset):
+            data = input_examples
+            if numeric:
+                with stats.phase('encode'):
+                    data = dataset.as_numeric(data, numeric, bins)
+            return columnar.train(data, default, stats=stats, missing=missing, **limits)
+        if not input_examples:
+            leaf = Node()
+            leaf.add_label(default)
+            return leaf
+        with stats.phase('encode'):
+            data = dataset.encode(input_examples, numeric, bins)
+        return columnar.train(data, default, stats=stats, missing=missing, **limits)
+    if engine != 'dict':
+        raise ValueError(f"unknown engine: {engine!r}")
+    if numeric:
+        raise ValueError("the dict engine only handles categorical attributes")
+    if limits != GROW_FULLY:
+        raise ValueError("the dict engine does not take growth limits")
+    if missing != 'category':
+        raise ValueError("the dict engine only treats missing values as a category")
 #---------------------------HELPER FUNCTIONS SECTION---------------------------------
     def h(prob: float) -> float:
         '''
@@ -34,15 +106,11 @@ def ID3(input_examples: list[dict], default):
                 d_a.append(e)
         return d_a
 
-    def info_gain(examples: list[dict], attribute: str) -> float:
+    def parent_entropy(examples: list[dict]) -> float:
         '''
-        Helper function, computes info gain. 
+        Helper function, computes the entropy of the class values.
         '''
         examples_count = len(examples)
-        if examples_count == 0:
-            return 0
-
-        # Calculate entropy of the parent node
         class_values_count = {}
         for e in examples:
             value = e['Class']
@@ -52,6 +120,20 @@ def ID3(input_examples: list[dict], default):
         for count in class_values_count.values():
             prob = count / examples_count
             h_parent += h(prob)
+        return h_parent
+
+    def info_gain(examples: list[dict], attribute: str, h_parent: float = None) -> float:
+        '''
+        Helper function, computes info gain. 
+        h_parent is the entropy of the examples, if already known.
+        '''
+        examples_count = len(examples)
+        if examples_count == 0:
+            return 0
+
+        # Calculate entropy of the parent node
+        if h_parent is None:
+            h_parent = parent_entropy(examples)
 
         # Calculate entropy of the children nodes
         
@@ -59,7 +141,7 @@ def ID3(input_examples: list[dict], default):
         for e in examples:
             attribute_value = e[attribute]
             class_value = e['Class']
-            if attribute_value not in attributes_split_by_class.values():
+            if attribute_value not in attributes_split_by_class:
                 attributes_split_by_class[attribute_value] = {}
             attributes_split_by_class[attribute_value][class_value] = attributes_split_by_class[attribute_value].get(class_value, 0) + 1
 
@@ -76,18 +158,18 @@ def ID3(input_examples: list[dict], default):
         return gain
 
     def find_best_split(examples: list[dict], attributes: list[str]) -> str:
-        max_gain = info_gain(examples, attributes[0])
-        a_star = attributes[0]          #initialize the variable with the first 
-        for a in attributes:
-            gain = info_gain(examples, a)
-            if gain > max_gain:
-                max_gain = gain
-                a_star = a
-        return a_star
+        # The parent entropy is shared by every attribute, so compute it once
+        stats.count('splits_evaluated', len(attributes))
+        stats.count('rows_scanned', len(examples) * len(attributes))
+        h_parent = parent_entropy(examples)
+        gains = [info_gain(examples, a, h_parent) for a in attributes]
+        return attributes[columnar.first_best(gains)]
 
 #---------------------------END OF HELPER FUNCTIONS SECTION---------------------------------
 
+    stats.count('nodes')
     if not input_examples:
+        stats.count('leaves')
         leaf = Node()
         leaf.add_label(default)
         return leaf
@@ -95,6 +177,7 @@ def ID3(input_examples: list[dict], default):
     # If all examples have the same class label, return a leaf node with that label
     class_values = [e['Class'] for e in input_examples]
     if len(set(class_values)) == 1:
+        stats.count('leaves')
         leaf = Node()
         leaf.add_label(class_values[0])
         return leaf
@@ -102,123 +185,255 @@ def ID3(input_examples: list[dict], default):
     # If no attributes left to split on, return a leaf node with the most common class label
     attributes: list[str] = [attr for attr in input_examples[0].keys() if attr != 'Class']
     if not attributes:
+        stats.count('leaves')
         leaf = Node()
-        most_common_class_value = max(set(class_values), key=class_values.count)
+        most_common_class_value = Counter(class_values).most_common(1)[0][0]
         leaf.add_label(most_common_class_value)
         return leaf
 
     # Find the best attribute to split on
-    a_star = find_best_split(input_examples, attributes)
+    with stats.phase('gains'):
+        a_star = find_best_split(input_examples, attributes)
+    stats.count('splits')
     root = Node()
     root.add_decision_label(a_star)
+    # The label is the prediction for values the node has no child for
+    root.add_label(Counter(class_values).most_common(1)[0][0])
 
     # For each value of the best attribute, create a subtree
-    a_star_values = set(e[a_star] for e in input_examples)
+    a_star_values = dict.fromkeys(e[a_star] for e in input_examples)
     for value in a_star_values:
-        d_a = get_da(a_star, value, input_examples)
+        with stats.phase('partition'):
+            d_a = get_da(a_star, value, input_examples)
         if not d_a:
             child = Node()
-            most_common_class_value = max(set(class_values), key=class_values.count)
+            most_common_class_value = Counter(class_values).most_common(1)[0][0]
             child.add_label(most_common_class_value)
             root.children[value] = child
         else:
-            d_a_copy = []
-            for e in d_a:
-                e_copy = copy.copy(e)
-                del e_copy[a_star]
-                d_a_copy.append(e_copy)
-            child = ID3(d_a_copy, default)
+            with stats.phase('copy'):
+                d_a_copy = []
+                for e in d_a:
+                    e_copy = copy.copy(e)
+                    del e_copy[a_star]
+                    d_a_copy.append(e_copy)
+            with stats.phase('ID3'):
+                child = ID3(d_a_copy, default, engine='dict', stats=stats)
             root.children[value] = child
 
     return root
 
 
-def prune(node, examples):
+def prune(node, examples, stats=None):
   '''
   Takes in a trained tree and a validation set of examples.  Prunes nodes in order
   to improve accuracy on the validation data; the precise pruning strategy is up to you.
-  '''
 
+  Reduced error pruning: visiting nodes bottom-up, a node is turned into a leaf
+  labelled with the majority of its subtree's leaf labels whenever that does not
+  lower validation accuracy.  Each validation example is routed through the tree
+  once, and every decision is made from the class counts of the examples that
+  reach the node, since pruning a node only changes the predictions for those.
+  examples may be a list of example dictionaries or an EncodedDataset.
 
-  root_node = node  # Keep a reference to the root of the tree
+  In a tree grown with missing="weighted", a validation example missing a
+  node's attribute reaches every child with a share of its weight, as it would
+  in prediction, and correct predictions are counted by weight.  A pruned node's
+  distribution becomes all its label's.
 
-  def prune_node(current_node):
-    best_accuracy = test(root_node, examples)
-    def get_majority_label(node):
-      labels = []
-      def collect_labels(current_node):
-          if current_node.decision_label is None:
-              labels.append(current_node.label)
-          else:
-              for child in current_node.children.values():
-                  collect_labels(child)
+  stats, a profiling.TrainingStats, times the phases encode and prune and
+  counts the nodes_visited, the nodes pruned and the rows_routed through them.
+  '''
+  if stats is None:
+    stats = NO_STATS
+  with stats.phase('encode'):
+    data = as_dataset(examples)
+    columns = {a: j for j, a in enumerate(data.attributes)}
+    lookups = [{value: code for code, value in enumerate(t)} for t in data.tables]
+    class_codes = {value: code for code, value in enumerate(data.classes)}
+  numbers = {}
+
+  def number_tables(j):
+    '''
+    Returns the values behind column j's codes as floats, missing ones as NaN,
+    which is never above a threshold.
+    '''
+    if j not in numbers:
+      numbers[j] = np.array([np.nan if v == dataset.MISSING else float(v) for v in data.tables[j]])
+    return numbers[j]
 
-      collect_labels(node)
-      return max(set(labels), key=labels.count)
+  def prune_node(current_node, rows, weights=None):
+    '''
+    Prunes the subtree rooted at current_node given the validation rows that
+    reach it, with their weights if they have been shared out.  Returns the
+    number (or weight) of those rows the subtree now classifies correctly, and
+    the counts of its leaf labels in depth-first order.
+    '''
+    stats.count('nodes_visited')
+    stats.count('rows_routed', len(rows))
+    class_counts = np.bincount(data.y[rows], weights=weights, minlength=data.n_classes)
+    def correct_for(label):
+      code = class_codes.get(label)
+      return 0 if code is None else class_counts[code].item()
 
-    
     if current_node.decision_label is None:
-        return  # This is a leaf node
-
-    # Recursively prune child nodes
-    for child in current_node.children.values():
-        prune_node(child)
-
-    # Attempt to prune this node
-    saved_decision_label = current_node.decision_label
-    saved_children = current_node.children
-
-    # Make this node a leaf node
-    current_node.decision_label = None
-    current_node.label = get_majority_label(current_node)  # Set the label to the majority class of the subtree
-    current_node.children = {}
-
-    # Evaluate accuracy after pruning
-    pruned_accuracy = test(root_node, examples)
-    print("Pruned Accuracy = ", pruned_accuracy, "Best Accuracy = ", best_accuracy)
-    if pruned_accuracy >= best_accuracy:
-        # Keep pruning since accuracy has not decreased
-        best_accuracy = pruned_accuracy
-    else:
-        # Restore the original node since pruning did not improve accuracy
-        current_node.decision_label = saved_decision_label
-        current_node.children = saved_children
- 
-    return 
-  
-  prune_node(root_node)
+      return correct_for(current_node.label), Counter([current_node.label])
+
+    # Route the rows one level down; those with an unseen value stop here
+    j = columns.get(current_node.decision_label)
+    codes = data.matrix[rows, j] if j is not None else None
+    if current_node.threshold is not None and j is not None:
+      above = number_tables(j)[codes] > current_node.threshold
+    # Rows missing the value of a weighted node go to every child
+    shared = np.zeros(len(rows), dtype=bool)
+    if current_node.distribution is not None and j is not None:
+      if current_node.threshold is not None:
+        shared = np.isnan(number_tables(j)[codes])
+      elif dataset.MISSING in lookups[j]:
+        shared = codes == lookups[j][dataset.MISSING]
+      if shared.any():
+        children = current_node.children.values()
+        child_weights = [sum((child.distribution or {}).values()) for child in children]
+        total = sum(child_weights)
+        if weights is None:
+          weights = np.ones(len(rows))
+    stopped = ~shared
+    subtree_correct = 0
+    leaf_labels = Counter()
+    for k, (value, child) in enumerate(current_node.children.items()):
+      if j is None:
+        reaching = np.zeros(len(rows), dtype=bool)
+      elif current_node.threshold is not None:
+        reaching = above if value == ABOVE else ~above
+      else:
+        code = lookups[j].get(value)
+        reaching = codes == code if code is not None else np.zeros(len(rows), dtype=bool)
+      reaching = reaching & ~shared
+      stopped &= ~reaching
+      # Recursively prune child nodes
+      if shared.any():
+        child_rows = reaching | shared
+        share = np.where(shared, child_weights[k] / total if total else 0.0, 1.0)
+        correct, child_labels = prune_node(child, rows[child_rows], (weights * share)[child_rows])
+      else:
+        correct, child_labels = prune_node(child, rows[reaching], None if weights is None else weights[reaching])
+      subtree_correct += correct
+      leaf_labels.update(child_labels)
+    code = class_codes.get(current_node.label)
+    if code is not None:
+      hits = data.y[rows[stopped]] == code
+      subtree_correct += int(np.count_nonzero(hits)) if weights is None else float(weights[stopped][hits].sum())
+
+    # A rejected prune keeps the node's own label: the stopped rows above
+    # were scored against it, and it stays as the node's fallback
+    leaf_label = max(leaf_labels, key=leaf_labels.get)
+    pruned_correct = correct_for(leaf_label)
+    if pruned_correct >= subtree_correct:
+      stats.count('pruned')
+      current_node.label = leaf_label
+      current_node.decision_label = None
+      current_node.threshold = None
+      current_node.children = {}
+      if current_node.distribution is not None:
+        current_node.distribution = {current_node.label: sum(current_node.distribution.values())}
+      return pruned_correct, Counter([current_node.label])
+    return subtree_correct, leaf_labels
+
+  with stats.phase('prune'):
+    prune_node(node, np.arange(len(data), dtype=np.intp))
 
 def test(node, examples):
   '''
   Takes in a trained tree and a test set of examples.  Returns the accuracy (fraction
-  of examples the tree classifies correctly).
+  of examples the tree classifies correctly).  examples may be a list of example
+  dictionaries or an EncodedDataset.
   '''
 
-  correct = 0
   total = len(examples)
-  for example in examples:
-      prediction = evaluate(node, example)
-      if prediction == example['Class']:
-          correct += 1
-  return correct / total if total > 0 else 0
+  if total == 0:
+    return 0
+  tree = compiled.compile_tree(node)
+  predictions = tree.predict_batch(tree.encode(examples))
+  if isinstance(examples, dataset.EncodedDataset):
+    class_codes = {value: code for code, value in enumerate(examples.classes)}
+    as_class = np.array([class_codes.get(label, -1) for label in tree.labels])
+    correct = np.count_nonzero(as_class[predictions] == examples.y)
+  else:
+    correct = sum(1 for prediction, example in zip(predictions, examples)
+                  if tree.labels[prediction] == example['Class'])
+  return correct / total
+
+def as_dataset(examples):
+  '''
+  Returns examples as an EncodedDataset, encoding it if it is a list of example
+  dictionaries.
+  '''
+  if isinstance(examples, dataset.EncodedDataset):
+    return examples
+  if not examples:
+    return dataset.EncodedDataset(np.empty((0, 0), dtype=np.uint8), np.empty(0, dtype=np.uint8), [], [], [])
+  return dataset.encode(examples)
 
 
 def evaluate(node, example):
   '''
   Takes in a tree and one example.  Returns the Class value that the tree
-  assigns to the example.
+  assigns to the example.  Where a tree grown with missing="weighted" combines
+  class distributions, ties go to the label compile_tree numbers first, as in
+  CompiledTree.predict_batch.
   '''
 
   tree = node
-  if tree.decision_label == None:
-    return tree.label
-  else:
-    example_value = example[tree.decision_label]
-    if example_value in tree.children:
-        return evaluate(tree.children[example_value], example)
+  while tree.decision_label != None:
+    if tree.distribution is not None and example[tree.decision_label] == dataset.MISSING:
+      # A tree grown with missing="weighted" follows every branch
+      shares = class_distribution(tree, example)
+      best = max(shares.values())
+      tied = [label for label, p in shares.items() if p >= best - compiled.TIE_TOLERANCE]
+      if len(tied) == 1:
+        return tied[0]
+      codes = {label: code for code, label in enumerate(compiled.compile_tree(node).labels)}
+      return min(tied, key=codes.get)
+    example_value = branch(tree, example[tree.decision_label])
+    if example_value not in tree.children:
+      # Return the current node's label if the child doesn't exist
+      return tree.label
+    tree = tree.children[example_value]
+  return tree.label
+
+def class_distribution(node, example):
+  '''
+  Takes in a tree and one example.  Returns {Class value: probability} as C4.5
+  predicts it: at a node of a tree grown with missing="weighted" whose value
+  the example is missing, the distributions of all the children are combined,
+  each weighted by the share of the training weight that went its way.  A leaf,
+  or a node with no child for the example's value, gives its own distribution,
+  or all the probability to its label if it has none.
+  '''
+  if node.decision_label is not None:
+    value = example[node.decision_label]
+    if node.distribution is not None and value == dataset.MISSING:
+      children = list(node.children.values())
+      weights = [sum((child.distribution or {}).values()) for child in children]
+      total = sum(weights)
+      combined = {}
+      for child, weight in zip(children, weights):
+        if weight > 0:
+          for label, p in class_distribution(child, example).items():
+            combined[label] = combined.get(label, 0.0) + p * weight / total
+      if combined:
+        return combined
     else:
-        # Return the current node's label if the child doesn't exist
-        return tree.label
-
-examples =  parse.parse("cars_train.data")
-t = ID3(examples, 0)
\ No newline at end of file
+      key = branch(node, value)
+      if key in node.children:
+        return class_distribution(node.children[key], example)
+  if not node.distribution:
+    return {node.label: 1.0}
+  total = sum(node.distribution.values())
+  return {label: weight / total for label, weight in node.distribution.items()}
+
+if __name__ == "__main__":
+  examples = parse.load("cars_train.data", cache=True)
+  t = ID3(examples, 0)
+  print("training accuracy: ", test(t, examples))
+  print("test accuracy: ", test(t, parse.load("cars_test.data", cache=True)))
@@ -0,0 +1,479 @@
+'''
+Benchmarks for the decision tree code.
+
+  python benchmark.py imports    time importing each module in a fresh interpreter
+                                 and fail if one is over budget or has side effects
+  python benchmark.py memory     report bytes per node for each tree representation
+  python benchmark.py run        time the training, pruning, prediction and parsing
+                                 hot paths over a range of dataset sizes; see
+                                 --help for the sizes, cases and JSON output
+  python benchmark.py compare BASELINE CURRENT
+                                 flag cases where CURRENT is slower or uses more
+                                 memory than BASELINE (JSON files written by run)
+'''
+import argparse
+import ast
+import csv
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+try:
+  import resource
+except ImportError:
+  # Windows has no getrusage; peak resident memory then reads as 0
+  resource = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Seconds a cold import may take, measured in a fresh interpreter.  numpy alone
+# is most of this; training a tree or importing matplotlib at import time is not.
+IMPORT_BUDGETS = {
+  'ID3': 0.4,
+  'randomForest': 0.4,
+  'learn_curve': 0.4,
+  'incremental': 0.4,
+  'parse': 0.4,
+  'pruning': 0.4,
+  'sharded': 0.4,
+  'tuning': 0.4,
+}
+
+# Modules that must only be imported when they are actually used
+LAZY_MODULES = ['matplotlib']
+
+_IMPORT_PROBE = '''
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(repr((elapsed, sorted(m for m in {lazy!r} if m in sys.modules))))
+'''
+
+
+def import_time(module, repeat=5):
+  '''
+  Imports module in repeat fresh interpreters and returns the fastest import time
+  in seconds, the lazy modules it pulled in, and anything it printed.
+  '''
+  best, pulled, printed = None, [], ''
+  for _ in range(repeat):
+    result = subprocess.run([sys.executable, '-c', _IMPORT_PROBE.format(module=module, lazy=LAZY_MODULES)],
+                            cwd=HERE, capture_output=True, text=True, check=True)
+    *output, last = result.stdout.splitlines()
+    elapsed, pulled = ast.literal_eval(last)
+    printed = '\n'.join(output)
+    best = elapsed if best is None else min(best, elapsed)
+  return best, pulled, printed
+
+
+def check_imports(budgets=IMPORT_BUDGETS, repeat=5):
+  '''
+  Returns a list of failure messages for modules that import too slowly, print
+  while importing, or import a module listed in LAZY_MODULES.
+  '''
+  failures = []
+  for module, budget in budgets.items():
+    elapsed, pulled, printed = import_time(module, repeat)
+    print(f"{module:15s} {elapsed * 1000:8.1f} ms  (budget {budget * 1000:.0f} ms)")
+    if elapsed > budget:
+      failures.append(f"importing {module} took {elapsed:.3f}s, over its {budget}s budget")
+    if printed:
+      failures.append(f"importing {module} printed output")
+    if pulled:
+      failures.append(f"importing {module} imported {', '.join(pulled)}")
+  return failures
+
+
+def synthetic(n_rows, n_attrs, cardinality=4, n_classes=2, noise=0.1, seed=0):
+  '''
+  Returns a random EncodedDataset whose class depends on the first two attributes,
+  with a fraction noise of the labels replaced at random.
+  '''
+  import dataset
+  rng = np.random.default_rng(seed)
+  matrix = np.asfortranarray(rng.integers(1, cardinality + 1, size=(n_rows, n_attrs), dtype=np.uint8))
+  y = (matrix[:, 0].astype(np.intp) * 7 + matrix[:, min(1, n_attrs - 1)]) % n_classes
+  flip = rng.random(n_rows) < noise
+  y[flip] = rng.integers(0, n_classes, size=int(flip.sum()))
+  tables = [[dataset.MISSING] + [f"v{k}" for k in range(cardinality)] for _ in range(n_attrs)]
+  return dataset.EncodedDataset(matrix, y.astype(np.uint8), [f"a{j}" for j in range(n_attrs)],
+                                tables, [f"c{k}" for k in range(n_classes)])
+
+
+class _DictNode:
+  '''
+  node.Node as it was before it had __slots__, for comparison.
+  '''
+  def __init__(self):
+    self.label = None
+    self.children = {}
+    self.decision_label = None
+
+
+def _convert(node, cls):
+  copy = cls()
+  copy.label, copy.decision_label = node.label, node.decision_label
+  copy.children = {value: _convert(child, cls) for value, child in node.children.items()}
+  return copy
+
+
+def _retained(build):
+  '''
+  Returns (result, bytes still allocated by build() once it has returned).
+  '''
+  gc.collect()
+  tracemalloc.start()
+  before = tracemalloc.get_traced_memory()[0]
+  result = build()
+  gc.collect()
+  after = tracemalloc.get_traced_memory()[0]
+  tracemalloc.stop()
+  return result, after - before
+
+
+def node_memory(n_rows=20000, n_attrs=12, cardinality=4):
+  '''
+  Trains a tree on synthetic data and returns the bytes per node it occupies as
+  __dict__ Node objects, as __slots__ Node objects and as a compiled arena.
+  '''
+  import columnar, compiled
+  from node import Node
+  tree = columnar.train(synthetic(n_rows, n_attrs, cardinality), 'c0')
+  arena, arena_bytes = _retained(lambda: compiled.compile_tree(tree))
+  n_nodes = len(arena)
+  report = {'nodes': n_nodes}
+  report['dict_node'] = _retained(lambda: _convert(tree, _DictNode))[1] / n_nodes
+  report['slots_node'] = _retained(lambda: _convert(tree, Node))[1] / n_nodes
+  report['arena'] = arena_bytes / n_nodes
+  return report
+
+
+def write_csv(data, path):
+  '''
+  Writes an EncodedDataset as a CSV data file that parse can read.
+  '''
+  columns = [np.asarray(table, dtype=object)[data.matrix[:, j]] for j, table in enumerate(data.tables)]
+  classes = np.asarray(data.classes, dtype=object)[data.y]
+  with open(path, 'w', newline='') as f:
+    writer = csv.writer(f)
+    writer.writerow(list(data.attributes) + ['Class'])
+    writer.writerows(zip(*columns, classes))
+
+
+def _examples(data, limit):
+  return [data.example(i) for i in range(min(len(data), limit))]
+
+
+# Benchmark cases.  Each takes the number of rows and attributes and returns
+# (run, units): run is timed, and units (usually rows) / seconds is reported
+# as the throughput.  Cases over plain example dictionaries stop at
+# DICT_MAX_ROWS, which is already far more than those code paths are for.
+DICT_MAX_ROWS = 100000
+
+
+def _case_train(rows, attrs):
+  import ID3
+  data = synthetic(rows, attrs)
+  return lambda: ID3.ID3(data, 'c0'), rows
+
+
+def _case_train_level(rows, attrs):
+  import ID3
+  data = synthetic(rows, attrs)
+  return lambda: ID3.ID3(data, 'c0', growth='level'), rows
+
+
+def _case_train_numeric(rows, attrs):
+  import ID3, dataset
+  rng = np.random.default_rng(0)
+  matrix = np.asfortranarray(rng.normal(size=(rows, attrs)).round(2))
+  y = (matrix[:, 0] + matrix[:, min(1, attrs - 1)] > 0).astype(np.uint8)
+  y[rng.random(rows) < 0.1] ^= 1
+  tables = [[dataset.MISSING] + np.unique(matrix[:, j]).tolist() for j in range(attrs)]
+  codes = np.asfortranarray(np.stack([np.searchsorted(t[1:], matrix[:, j]) + 1 for j, t in enumerate(tables)], 1)
+                            .astype(dataset.code_dtype(max(len(t) for t in tables))))
+  data = dataset.EncodedDataset(codes, y, [f"a{j}" for j in range(attrs)], tables, ['c0', 'c1'], [True] * attrs)
+  return lambda: ID3.ID3(data, 'c0', bins=64), rows
+
+
+def _case_train_dict(rows, attrs):
+  import ID3
+  examples = _examples(synthetic(rows, attrs), DICT_MAX_ROWS)
+  return lambda: ID3.ID3(examples, 'c0', engine='dict'), len(examples)
+
+
+def _case_prune(rows, attrs):
+  import ID3, compiled
+  tree = compiled.compile_tree(ID3.ID3(synthetic(rows, attrs), 'c0'))
+  validation = synthetic(max(rows // 4, 1), attrs, seed=1)
+  return lambda: ID3.prune(tree.copy().root(), validation), len(validation)
+
+
+def _case_test(rows, attrs):
+  import ID3
+  tree = ID3.ID3(synthetic(min(rows, DICT_MAX_ROWS), attrs), 'c0')
+  data = synthetic(rows, attrs, seed=1)
+  return lambda: ID3.test(tree, data), rows
+
+
+def _case_evaluate(rows, attrs):
+  import ID3
+  tree = ID3.ID3(synthetic(min(rows, DICT_MAX_ROWS), attrs), 'c0')
+  examples = _examples(synthetic(rows, attrs, seed=1), DICT_MAX_ROWS)
+  return lambda: [ID3.evaluate(tree, e) for e in examples], len(examples)
+
+
+def _case_parse(rows, attrs):
+  import parse
+  path = os.path.join(tempfile.mkdtemp(), 'synthetic.data')
+  rows = min(rows, DICT_MAX_ROWS)
+  write_csv(synthetic(rows, attrs), path)
+  return lambda: parse.parse(path), rows
+
+
+def _case_load(rows, attrs):
+  import parse
+  path = os.path.join(tempfile.mkdtemp(), 'synthetic.data')
+  write_csv(synthetic(rows, attrs), path)
+  return lambda: parse.load(path), rows
+
+
+def _case_forest_train(rows, attrs):
+  import randomForest
+  data = synthetic(rows, attrs)
+  forest = randomForest.randomForest(10, max_feature=max(1, int(attrs ** 0.5)), seed=0)
+  return lambda: forest.train(data, 'c0'), rows * forest.tree_numbers
+
+
+def _case_forest_predict(rows, attrs):
+  import randomForest
+  forest = randomForest.randomForest(10, max_feature=max(1, int(attrs ** 0.5)), seed=0)
+  forest.train(synthetic(min(rows, DICT_MAX_ROWS), attrs), 'c0')
+  forest.compiled_trees()
+  data = synthetic(rows, attrs, seed=1)
+  return lambda: forest.predictAll(data), rows
+
+
+def _case_learning_curve(rows, attrs):
+  import learn_curve, parse
+  data = parse.load(os.path.join(HERE, 'house_votes_84.data'))
+  sizes = list(range(10, 310, 60))
+  return lambda: learn_curve.learning_curve(data, train_sizes=sizes, num_runs=20), len(sizes) * 20
+
+
+def _case_bundled(rows, attrs):
+  import ID3, parse
+  files = ['house_votes_84.data', 'cars_train.data', 'candy.data', 'tennis.data']
+  datasets = [parse.load(os.path.join(HERE, f)) for f in files]
+  def run():
+    for data in datasets:
+      ID3.test(ID3.ID3(data, data.classes[0]), data)
+  return run, sum(len(d) for d in datasets)
+
+
+# name: (setup, whether it scales with the rows and attributes asked for)
+CASES = {
+  'id3_train': (_case_train, True),
+  'id3_train_level': (_case_train_level, True),
+  'id3_train_numeric': (_case_train_numeric, True),
+  'id3_train_dict': (_case_train_dict, True),
+  'prune': (_case_prune, True),
+  'test': (_case_test, True),
+  'evaluate': (_case_evaluate, True),
+  'parse': (_case_parse, True),
+  'parse_load': (_case_load, True),
+  'forest_train': (_case_forest_train, True),
+  'forest_predict': (_case_forest_predict, True),
+  'learning_curve': (_case_learning_curve, False),
+  'bundled': (_case_bundled, False),
+}
+
+# Rows and attributes of the preset scales
+SCALES = {
+  'quick': ([2000, 10000], [20]),
+  'default': ([10000, 100000], [50]),
+  'large': ([100000, 1000000, 10000000], [200]),
+}
+
+
+def _peak_rss():
+  if resource is None:
+    return 0.0
+  # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_case(name, rows, attrs, repeat=1):
+  '''
+  Sets up and times one case in this process.  Returns its result record: the
+  fastest of repeat runs, the throughput in units per second, and the peak
+  resident memory in MB after setup and after the runs (0 where the resource
+  module is missing, as on Windows).
+  '''
+  setup, _ = CASES[name]
+  run, units = setup(rows, attrs)
+  setup_rss = _peak_rss()
+  best = None
+  for _ in range(repeat):
+    gc.collect()
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return {'case': name, 'rows': rows, 'attrs': attrs, 'units': units, 'seconds': best,
+          'throughput': units / best if best > 0 else float('inf'),
+          'setup_rss_mb': setup_rss, 'peak_rss_mb': _peak_rss()}
+
+
+def run_isolated(name, rows, attrs, repeat=1, timeout=None):
+  '''
+  Runs one case in a fresh interpreter, so its peak memory is its own.
+  '''
+  result = subprocess.run([sys.executable, os.path.abspath(__file__), 'case', name, str(rows), str(attrs),
+                           str(repeat)], cwd=HERE, capture_output=True, text=True, timeout=timeout)
+  if result.returncode != 0:
+    return {'case': name, 'rows': rows, 'attrs': attrs, 'error': result.stderr.strip().splitlines()[-1:]}
+  return json.loads(result.stdout.splitlines()[-1])
+
+
+def scaling_exponents(results):
+  '''
+  Fits seconds ~ rows ** k for every case and attribute count timed at several
+  sizes, and returns {"case/attrs": k}.  k near 1 is linear scaling.
+  '''
+  curves = {}
+  for r in results:
+    if 'seconds' in r and r['seconds'] > 0:
+      curves.setdefault(f"{r['case']}/{r['attrs']}", {})[r['units']] = r['seconds']
+  return {key: float(np.polyfit(np.log(list(c)), np.log(list(c.values())), 1)[0])
+          for key, c in curves.items() if len(c) > 1}
+
+
+def run_suite(cases, row_counts, attr_counts, repeat=1, timeout=None):
+  '''
+  Runs every case at every size (cases that do not scale run once) and returns
+  the JSON-serializable report.
+  '''
+  results = []
+  for name in cases:
+    sizes = [(r, a) for a in attr_counts for r in row_counts] if CASES[name][1] \
+      else [(row_counts[0], attr_counts[0])]
+    for rows, attrs in sizes:
+      result = run_isolated(name, rows, attrs, repeat, timeout)
+      results.append(result)
+      if 'error' in result:
+        print(f"{name:18s} {rows:>9d} x {attrs:<4d} ERROR {' '.join(result['error'])}")
+      else:
+        print(f"{name:18s} {result['units']:>9d} x {attrs:<4d} {result['seconds']:9.3f} s "
+              f"{result['throughput']:12.0f} /s  {result['peak_rss_mb']:8.1f} MB peak")
+  return {'meta': {'python': platform.python_version(), 'numpy': np.__version__,
+                   'platform': platform.platform(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+          'results': results, 'scaling': scaling_exponents(results)}
+
+
+def compare(baseline, current, tolerance=0.25, memory_tolerance=0.25):
+  '''
+  Matches the results of two reports by case and size, and returns a list of
+  messages for the ones where current took over (1 + tolerance) times as long,
+  or peaked at over (1 + memory_tolerance) times the memory, as baseline.
+  '''
+  def key(r):
+    return r['case'], r['rows'], r['attrs']
+  before = {key(r): r for r in baseline['results'] if 'seconds' in r}
+  regressions = []
+  for r in current['results']:
+    old = before.get(key(r))
+    if old is None:
+      continue
+    if 'seconds' not in r:
+      regressions.append(f"{r['case']} at {r['rows']} x {r['attrs']} failed: {' '.join(r['error'])}")
+      continue
+    if r['seconds'] > old['seconds'] * (1 + tolerance):
+      regressions.append(f"{r['case']} at {r['rows']} x {r['attrs']}: {r['seconds']:.3f}s, "
+                         f"was {old['seconds']:.3f}s ({r['seconds'] / old['seconds']:.2f}x)")
+    if r['peak_rss_mb'] > old['peak_rss_mb'] * (1 + memory_tolerance):
+      regressions.append(f"{r['case']} at {r['rows']} x {r['attrs']}: peak {r['peak_rss_mb']:.0f} MB, "
+                         f"was {old['peak_rss_mb']:.0f} MB")
+  return regressions
+
+
+def _sizes(text):
+  return [int(float(x)) for x in text.split(',')]
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  commands = parser.add_subparsers(dest='command', required=True)
+  commands.add_parser('imports')
+  commands.add_parser('memory')
+  run = commands.add_parser('run')
+  run.add_argument('--scale', choices=SCALES, default='default', help="preset rows and attributes")
+  run.add_argument('--rows', type=_sizes, help="comma-separated row counts, e.g. 1e5,1e6,1e7")
+  run.add_argument('--attrs', type=_sizes, help="comma-separated attribute counts")
+  run.add_argument('--cases', default=','.join(CASES), help="comma-separated cases")
+  run.add_argument('--repeat', type=int, default=1, help="time the fastest of this many runs")
+  run.add_argument('--timeout', type=float, help="seconds before a case is abandoned")
+  run.add_argument('--output', help="write the JSON report here")
+  run.add_argument('--baseline', help="compare against this JSON report")
+  run.add_argument('--tolerance', type=float, default=0.25)
+  cmp = commands.add_parser('compare')
+  cmp.add_argument('baseline')
+  cmp.add_argument('current')
+  cmp.add_argument('--tolerance', type=float, default=0.25)
+  case = commands.add_parser('case')
+  case.add_argument('name', choices=CASES)
+  case.add_argument('rows', type=int)
+  case.add_argument('attrs', type=int)
+  case.add_argument('repeat', type=int)
+  args = parser.parse_args(argv)
+
+  if args.command == 'imports':
+    failures = check_imports()
+    for failure in failures:
+      print("FAIL:", failure)
+    return 1 if failures else 0
+  if args.command == 'memory':
+    report = node_memory()
+    print(f"{report['nodes']} nodes")
+    for name in ['dict_node', 'slots_node', 'arena']:
+      print(f"{name:12s} {report[name]:8.1f} bytes/node")
+    return 0
+  if args.command == 'case':
+    print(json.dumps(run_case(args.name, args.rows, args.attrs, args.repeat)))
+    return 0
+
+  if args.command == 'run':
+    row_counts, attr_counts = SCALES[args.scale]
+    report = run_suite(args.cases.split(','), args.rows or row_counts, args.attrs or attr_counts,
+                       args.repeat, args.timeout)
+    for key, exponent in report['scaling'].items():
+      print(f"{key:24s} time ~ n^{exponent:.2f}")
+    if args.output:
+      with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+    if not args.baseline:
+      return 0
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+  else:
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+    with open(args.current) as f:
+      report = json.load(f)
+  regressions = compare(baseline, report, args.tolerance)
+  for regression in regressions:
+    print("REGRESSION:", regression)
+  return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
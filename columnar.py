@@ -0,0 +1,850 @@
+from node import Node, AT_MOST, ABOVE
+import heapq
+import itertools
+import numpy as np
+from dataset import code_dtype, MISSING_CODE
+from profiling import NO_STATS
+
+# Gains closer than this are treated as ties, so that both training engines
+# break ties on the first attribute regardless of floating point summation order.
+GAIN_TOLERANCE = 1e-12
+
+# Nodes with fewer rows than this let their children count their own tables;
+# below it, the bookkeeping for table subtraction costs more than the counting.
+SUBTRACTION_MIN_ROWS = 2048
+
+# Nodes with at least this many rows are counted one column at a time
+COLUMN_COUNT_MIN_ROWS = 2048
+
+# Numeric attributes with at most this many codes (binned ones, or ones with few
+# distinct values) are split from their count table histograms.  Wider ones are
+# split by sweeping their rows in value order, sorted once at the root.
+HISTOGRAM_MAX_CODES = 256
+
+# Most rows x attributes x classes cumulative counts the row sweep holds at once
+SWEEP_MAX_CELLS = 1 << 22
+
+# The order number FrontierRows gives a class or child key no row has
+NEVER = np.iinfo(np.int64).max
+
+
+def entropy(counts: np.ndarray) -> np.ndarray:
+    '''
+    Computes the entropy of every row of a 2-D array of class counts.
+    Rows that sum to zero have an entropy of zero.
+    '''
+    totals = counts.sum(axis=-1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = counts / totals
+        terms = np.where(p > 0, -p * np.log2(p), 0.0)
+    return terms.sum(axis=-1)
+
+
+def first_best(gains) -> int:
+    '''
+    Returns the position of the first gain that no later gain beats by more than
+    GAIN_TOLERANCE, scanning left to right like ID3's find_best_split.  NaN
+    gains count as -inf.
+    '''
+    gains = np.where(np.isnan(gains), -np.inf, gains)
+    best = 0
+    for i in range(1, len(gains)):
+        if gains[i] > gains[best] + GAIN_TOLERANCE:
+            best = i
+    return best
+
+
+def majority(y: np.ndarray, n_classes: int, weights: np.ndarray = None) -> int:
+    '''
+    Returns the most common class code in y, by weight if weights are given;
+    ties go to the code seen first.
+    '''
+    counts = np.bincount(y, weights=weights, minlength=n_classes)
+    best = counts.argmax()
+    tied = counts == counts[best]
+    if np.count_nonzero(tied) == 1:
+        return int(best)
+    return int(y[tied[y]][0])
+
+
+def count_table(data, rows: np.ndarray, attrs: list[int], cards: np.ndarray = None,
+                weights: np.ndarray = None) -> np.ndarray:
+    '''
+    Counts the rows by attribute value and class for every attribute in attrs.
+    Returns a (sum of cardinalities) x classes table made of one block of rows
+    per attribute, in the order of attrs.  cards, if given, is
+    data.cardinalities()[attrs].  With weights (one per row), the table sums
+    the weights instead, as floats.
+
+    Small nodes are counted with one bincount over the gathered rows x attrs
+    block.  From COLUMN_COUNT_MIN_ROWS rows up, each block is instead one
+    bincount over a contiguous column, with value and class packed into the
+    narrowest integer type that holds them, which avoids the wide intermediate.
+    '''
+    n_classes = data.n_classes
+    if cards is None:
+        cards = data.cardinalities()[attrs]
+    if len(rows) < COLUMN_COUNT_MIN_ROWS:
+        offsets = np.concatenate(([0], np.cumsum(cards)[:-1])).astype(np.intp)
+        x = data.matrix[np.ix_(rows, attrs)].astype(np.intp) + offsets
+        flat = (x * n_classes + data.y[rows].astype(np.intp)[:, None]).ravel()
+        if weights is not None:
+            weights = np.repeat(weights, len(attrs))
+        return np.bincount(flat, weights, minlength=int(cards.sum()) * n_classes).reshape(-1, n_classes)
+
+    packed = code_dtype(int(cards.max(initial=1)) * n_classes)
+    y = data.y[rows].astype(packed)
+    table = np.empty((int(cards.sum()), n_classes), dtype=np.intp if weights is None else np.float64)
+    start = 0
+    for a, card in zip(attrs, cards):
+        codes = data.matrix[:, a].take(rows).astype(packed)
+        codes *= n_classes
+        codes += y
+        table[start:start + card] = np.bincount(codes, weights, minlength=card * n_classes).reshape(card, n_classes)
+        start += card
+    return table
+
+
+def info_gains(table: np.ndarray, cards: np.ndarray) -> np.ndarray:
+    '''
+    Computes the information gain of every attribute from a count table laid out
+    as by count_table, whose blocks have the given cardinalities.  The parent
+    entropy is computed once, from the class totals of the first block.
+    '''
+    offsets = np.concatenate(([0], np.cumsum(cards)[:-1])).astype(np.intp)
+    class_counts = table[:cards[0]].sum(axis=0)
+    h_parent = entropy(class_counts[None, :])[0]
+    weighted = table.sum(axis=1) / class_counts.sum() * entropy(table)
+    h_children = np.add.reduceat(weighted, offsets)
+    return h_parent - h_children
+
+
+def known_values(table: np.ndarray, cards: np.ndarray):
+    '''
+    Splits a count table laid out as by count_table into the table of the known
+    values, in which each block's missing-value row is zeroed, and the fraction
+    of the weight that is known in each block.
+    '''
+    starts = np.concatenate(([0], np.cumsum(cards)[:-1])).astype(np.intp)
+    total = table[:cards[0]].sum()
+    known = table.astype(np.float64)
+    known[starts + MISSING_CODE] = 0
+    return known, 1 - table[starts + MISSING_CODE].sum(axis=1) / total
+
+
+def missing_gains(table: np.ndarray, cards: np.ndarray) -> np.ndarray:
+    '''
+    Computes the information gain of every attribute of a count table laid out
+    as by count_table the way C4.5 does with missing values: the gain among the
+    rows whose value is known, times the fraction of the weight they carry.
+    Attributes with no known values get -inf.
+    '''
+    starts = np.concatenate(([0], np.cumsum(cards)[:-1])).astype(np.intp)
+    known, fraction = known_values(table, cards)
+    class_counts = np.add.reduceat(known, starts, axis=0)
+    weight = class_counts.sum(axis=1)
+    block = np.repeat(np.arange(len(cards)), cards)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weighted = np.nan_to_num(known.sum(axis=1) / weight[block]) * entropy(known)
+    gains = fraction * (entropy(class_counts) - np.add.reduceat(weighted, starts))
+    return np.where(weight > 0, gains, -np.inf)
+
+
+def _xlogx(x: np.ndarray) -> np.ndarray:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(x > 0, x * np.log2(x), 0.0)
+
+
+def _class_sum(counts: np.ndarray) -> np.ndarray:
+    # Adding the few class columns one by one is several times faster than
+    # reducing over a short last axis
+    total = counts[..., 0]
+    for c in range(1, counts.shape[-1]):
+        total = total + counts[..., c]
+    return total
+
+
+def threshold_gains(left: np.ndarray, totals: np.ndarray, min_leaf: int = 1) -> np.ndarray:
+    '''
+    Computes the information gain of binary cuts.  left[..., k, :] holds the
+    class counts of the rows at or below the k-th cut, and totals (which
+    broadcasts against left) those of all rows.  Cuts that leave either side
+    with fewer than min_leaf rows get a gain of -inf.
+
+    Uses n * H = n log n - sum of c log c over the class counts c, so each side
+    costs one pass over its counts.
+    '''
+    n = _class_sum(totals)
+    n_left = _class_sum(left)
+    n_right = n - n_left
+    h_children = (_xlogx(n_left) + _xlogx(n_right) - _class_sum(_xlogx(left))
+                  - _class_sum(_xlogx(totals - left))) / n
+    gains = entropy(totals) - h_children
+    return np.where((n_left >= min_leaf) & (n_right >= min_leaf), gains, -np.inf)
+
+
+def _first_cuts(gains: np.ndarray, codes: np.ndarray, segment: np.ndarray, n_segments: int):
+    '''
+    Takes the gains of candidate cuts, their codes and the segment (attribute)
+    each belongs to, segments in ascending order.  Returns per segment the gain
+    and code of its lowest cut within GAIN_TOLERANCE of its best, or -inf and -1
+    where no cut gains more than GAIN_TOLERANCE.
+    '''
+    best = np.full(n_segments, -np.inf)
+    np.maximum.at(best, segment, gains)
+    near = (gains > GAIN_TOLERANCE) & (gains >= best[segment] - GAIN_TOLERANCE)
+    hits = np.flatnonzero(near)
+    segments, first = np.unique(segment[hits], return_index=True)
+    out_gains = np.full(n_segments, -np.inf)
+    out_codes = np.full(n_segments, -1, dtype=np.intp)
+    out_gains[segments] = gains[hits[first]]
+    out_codes[segments] = codes[hits[first]]
+    return out_gains, out_codes
+
+
+def histogram_cuts(table: np.ndarray, cards: np.ndarray, numeric: np.ndarray, min_leaf: int = 1):
+    '''
+    Finds the best threshold of every numeric attribute of a count table laid
+    out as by count_table (numeric[k] tells which blocks are numeric), in one
+    cumulative sweep down the table.  Within a block codes are in value order,
+    and a cut at code c sends codes 0 (missing) to c one way; only codes that
+    occur are cut at, and only where each side keeps min_leaf rows.  Returns
+    (gains, codes) per block, as _first_cuts does; categorical blocks get -inf
+    and -1.
+    '''
+    starts = np.concatenate(([0], np.cumsum(cards)[:-1])).astype(np.intp)
+    block = np.repeat(np.arange(len(cards)), cards)
+    codes = np.arange(len(table)) - starts[block]
+    cumulative = np.cumsum(table, axis=0)
+    base = np.zeros((len(cards), table.shape[1]), dtype=cumulative.dtype)
+    base[1:] = cumulative[starts[1:] - 1]
+    left = cumulative - base[block]
+    totals = cumulative[starts + cards - 1] - base
+    candidates = np.flatnonzero(numeric[block] & (codes > 0) & table.any(axis=1))
+    gains = threshold_gains(left[candidates], totals[block[candidates]], min_leaf)
+    return _first_cuts(gains, codes[candidates], block[candidates], len(cards))
+
+
+def sorted_cuts(data, columns: list[int], orders: np.ndarray, min_leaf: int = 1):
+    '''
+    Like histogram_cuts, but sweeps the rows themselves, for attributes with too
+    many codes for a histogram per node: orders[i] lists the node's rows in
+    ascending order of column columns[i].  Attributes are swept together, at
+    most SWEEP_MAX_CELLS rows x attributes x classes at a time.
+    '''
+    n_attrs, n = orders.shape
+    step = max(1, SWEEP_MAX_CELLS // (n * data.n_classes))
+    gains = np.empty(n_attrs)
+    codes = np.empty(n_attrs, dtype=np.intp)
+    for start in range(0, n_attrs, step):
+        part = orders[start:start + step]
+        sorted_codes = data.matrix[part, np.asarray(columns[start:start + step])[:, None]]
+        left = np.cumsum(data.y[part][..., None] == np.arange(data.n_classes), axis=1, dtype=np.intp)
+        # A cut can follow any row whose successor has a larger code
+        ends = (sorted_codes[:, :-1] != sorted_codes[:, 1:]) & (sorted_codes[:, :-1] > 0)
+        cut_gains = threshold_gains(left[:, :-1], left[:, -1:], min_leaf)
+        segment, position = np.nonzero(ends)
+        gains[start:start + step], codes[start:start + step] = _first_cuts(
+            cut_gains[segment, position], sorted_codes[segment, position], segment, len(part))
+    return gains, codes
+
+
+def partition(column: np.ndarray, rows: np.ndarray):
+    '''
+    Splits rows by their code in column.  Yields (code, child_rows) in order of
+    first appearance; each child keeps the rows in their original order.
+    '''
+    order = np.argsort(column, kind='stable')
+    codes, starts, counts = np.unique(column[order], return_index=True, return_counts=True)
+    first_seen = order[starts]
+    for k in np.argsort(first_seen):
+        yield int(codes[k]), rows[order[starts[k]:starts[k] + counts[k]]]
+
+
+def build(data, rows: np.ndarray, attrs: list[int], default, table=None, max_depth=None,
+          min_samples_split=2, min_samples_leaf=1, min_info_gain=0.0, max_leaf_nodes=None,
+          growth='depth', max_features=None, rng=None, stats=None, missing='category') -> Node:
+    '''
+    Grows an ID3 tree over the given rows of an EncodedDataset, using only the
+    attribute columns listed in attrs.  Mirrors ID3.ID3 node for node on
+    categorical attributes.  Every node is labelled with the majority class of
+    its rows, which decision nodes predict for values they have no child for.
+
+    Numeric attributes get a binary split at their best threshold and stay
+    available below it.  A numeric attribute only splits if that gains more than
+    GAIN_TOLERANCE; a node where nothing can split becomes a majority leaf.  The
+    rows of a wide numeric attribute (see HISTOGRAM_MAX_CODES) are sorted once,
+    at the top, and each child takes its rows' subsequence of the order, so no
+    node sorts again.
+
+    With missing="category" (the default) a missing value "?" is a value like
+    any other, and goes AT_MOST a numeric threshold.  With missing="weighted"
+    missing values are handled as in C4.5: every row carries a weight, starting
+    at 1, and the count tables sum weights.  An attribute's gain is that among
+    the rows where it is known, times the fraction of the weight they carry
+    (see missing_gains).  A row missing the split attribute goes down every
+    branch, its weight shared in proportion to the known weight of each, and
+    every node records the class weights that reach it as its distribution.
+    Weighted trees count every node's table afresh, and sweep numeric
+    attributes from histograms however many codes they have.
+
+    Growth stops early, with a majority leaf, at nodes max_depth deep (the root
+    is depth 0), at nodes with fewer than min_samples_split rows (or weight),
+    and where the best split gains less than min_info_gain.  Attributes that
+    would leave a child with fewer than min_samples_leaf rows are not split on.
+    Once the tree has max_leaf_nodes leaves, a split that would add more is not
+    made.  With growth="depth" nodes are expanded depth first, in order; with
+    growth="best" the pending split with the highest gain is always expanded
+    next, so a max_leaf_nodes budget goes to the splits that gain most.
+    Without limits both orders build the same tree.  growth="level" builds it
+    with build_levels, a whole level of nodes at a time.
+
+    With max_features, each node only considers a random max_features of its
+    remaining attributes (all of them if fewer remain), drawn from the NumPy
+    Generator rng, or one seeded from rng if it is not a Generator.  Nodes draw
+    in the order they are expanded, so the tree depends only on the generator's
+    state.  Count tables are then counted per node for the drawn attributes.
+
+    table, if given, is count_table(data, rows, attrs), less any wide numeric
+    attributes.  A node hands its children their tables.  When the other
+    children have fewer rows in total than the largest one, the largest child's
+    table is the parent's minus its siblings', so its rows are never re-scanned;
+    children that will be leaves get no table unless it is needed for that
+    subtraction.  Nodes with fewer than SUBTRACTION_MIN_ROWS rows leave their
+    children to count for themselves.
+
+    stats, a profiling.TrainingStats, times the phases presort, count, gains
+    and partition, and counts nodes, leaves, splits, splits_evaluated (the
+    attributes scored) and rows_scanned (rows x attributes read for counts and
+    sweeps).
+    '''
+    if growth not in ('depth', 'best', 'level'):
+        raise ValueError(f"unknown growth order: {growth!r}")
+    if missing not in ('category', 'weighted'):
+        raise ValueError(f"unknown missing value handling: {missing!r}")
+    if growth == 'level':
+        if max_leaf_nodes is not None or max_features is not None or missing != 'category':
+            raise ValueError("level-wise growth does not take max_leaf_nodes, max_features or weighted missing values")
+        return build_levels(data, rows, attrs, default, max_depth, min_samples_split, min_samples_leaf,
+                            min_info_gain, stats)
+    if stats is None:
+        stats = NO_STATS
+    if max_features is not None and not isinstance(rng, np.random.Generator):
+        rng = np.random.default_rng(rng)
+    weighted = missing == 'weighted'
+    all_cards = data.cardinalities()
+    numeric = np.array(data.numeric, dtype=bool)
+    presorted = numeric & (all_cards > HISTOGRAM_MAX_CODES) & (not weighted)
+    # Wide numeric attributes are never used up, so every node sweeps the same
+    # ones; orders[i] lists a node's rows in ascending order of wide[i]
+    wide = [a for a in attrs if presorted[a]]
+    wide_index = {a: i for i, a in enumerate(wide)}
+    # child number of each row during a split, for dividing the orders
+    side = np.zeros(len(data), dtype=np.intp) if wide else None
+
+    def describe(node, rows, weights):
+        '''
+        Labels node with the majority class of its rows, and gives a weighted
+        tree's node its class distribution.
+        '''
+        node.add_label(data.classes[majority(data.y[rows], data.n_classes, weights)])
+        if weights is not None:
+            counts = np.bincount(data.y[rows], weights=weights, minlength=data.n_classes)
+            node.distribution = {data.classes[c]: float(counts[c]) for c in np.flatnonzero(counts)}
+
+    def make_leaf(node, rows, weights):
+        stats.count('leaves')
+        if len(rows) == 0:
+            node.add_label(default)
+        else:
+            describe(node, rows, weights)
+        return node
+
+    def plan(rows, weights, attrs, table, orders, depth):
+        '''
+        Chooses the split of the node holding rows (with weights, in a weighted
+        tree).  Returns None if the node is a leaf, else (gain, attribute,
+        threshold, remaining attributes, children) where children lists
+        (value, rows, weights, table, orders) for each child.
+        '''
+        stats.count('nodes')
+        if len(rows) == 0:
+            return None
+        y = data.y[rows]
+        size = len(rows) if weights is None else weights.sum()
+        if (y == y[0]).all() or not attrs or size < min_samples_split \
+                or (max_depth is not None and depth >= max_depth):
+            return None
+
+        candidates = attrs
+        if max_features is not None and max_features < len(attrs):
+            drawn = np.sort(rng.choice(len(attrs), size=max_features, replace=False))
+            candidates = [attrs[i] for i in drawn]
+            # the table passed down covers every remaining attribute
+            table = None
+        stats.count('splits_evaluated', len(candidates))
+        counted = [a for a in candidates if not presorted[a]]
+        cards = all_cards[counted]
+        in_table = np.flatnonzero(~presorted[candidates])
+        gains = np.full(len(candidates), -np.inf)
+        cuts = np.full(len(candidates), -1, dtype=np.intp)
+        if counted and table is None:
+            with stats.phase('count'):
+                table = count_table(data, rows, counted, cards, weights)
+            stats.count('rows_scanned', len(rows) * len(counted))
+        with stats.phase('gains'):
+            gains, cuts = score(rows, candidates, counted, cards, in_table, table, orders, gains, cuts)
+        best = first_best(gains)
+        if not gains[best] > -np.inf or not gains[best] >= min_info_gain - GAIN_TOLERANCE:
+            return None
+        with stats.phase('partition'):
+            return divide(rows, weights, attrs, candidates, counted, cards, table, orders, gains, cuts, best)
+
+    def score(rows, candidates, counted, cards, in_table, table, orders, gains, cuts):
+        '''
+        Fills in the gain and cut of every candidate attribute of plan.
+        '''
+        if counted:
+            if weighted:
+                gains[in_table] = missing_gains(table, cards)
+                known, fraction = known_values(table, cards)
+            else:
+                gains[in_table] = info_gains(table, cards)
+                known = table
+            counted_numeric = numeric[counted]
+            if min_samples_leaf > 1:
+                values = known.sum(axis=1)
+                small = (values > 0) & (values < min_samples_leaf)
+                starts = np.concatenate(([0], np.cumsum(cards)[:-1])).astype(np.intp)
+                gains[in_table[(np.add.reduceat(small, starts) > 0) & ~counted_numeric]] = -np.inf
+            if counted_numeric.any():
+                numeric_gains, numeric_cuts = histogram_cuts(known, cards, counted_numeric, min_samples_leaf)
+                if weighted:
+                    # An attribute missing at every row cannot split: 0 * -inf would be NaN
+                    known_any = fraction > 0
+                    numeric_gains[known_any] *= fraction[known_any]
+                    numeric_gains[~known_any] = -np.inf
+                gains[in_table[counted_numeric]] = numeric_gains[counted_numeric]
+                cuts[in_table[counted_numeric]] = numeric_cuts[counted_numeric]
+        wide_positions = np.flatnonzero(presorted[candidates])
+        if len(wide_positions):
+            swept = [candidates[i] for i in wide_positions]
+            swept_orders = orders if len(swept) == len(wide) else orders[[wide_index[a] for a in swept]]
+            gains[wide_positions], cuts[wide_positions] = sorted_cuts(data, swept, swept_orders, min_samples_leaf)
+            stats.count('rows_scanned', len(rows) * len(swept))
+        return gains, cuts
+
+    def share_missing(rows, weights, column, children):
+        '''
+        Takes the (value, positions) of the children of a weighted split, where
+        positions index the rows whose value is known, and returns each child's
+        (value, rows, weights) with the rows missing the value added at their
+        share of the weight.  Children keep the rows in their original order.
+        '''
+        absent = np.flatnonzero(column == MISSING_CODE)
+        known_weight = weights.sum() - weights[absent].sum()
+        shared = []
+        for value, positions in children:
+            # With no known weight the missing rows are shared out evenly
+            share = weights[positions].sum() / known_weight if known_weight > 0 else 1 / len(children)
+            merged = np.concatenate((positions, absent))
+            order = np.argsort(merged, kind='stable')
+            child_weights = np.concatenate((weights[positions], weights[absent] * share))
+            shared.append((value, rows[merged[order]], child_weights[order]))
+        return shared
+
+    def divide(rows, weights, attrs, candidates, counted, cards, table, orders, gains, cuts, best):
+        '''
+        Divides the rows of plan's chosen split among the children, with their
+        weights, count tables and orders.
+        '''
+        a_star = candidates[best]
+        column = data.matrix[rows, a_star]
+        if numeric[a_star]:
+            threshold = data.tables[a_star][cuts[best]]
+            at_most = column <= cuts[best]
+            remaining = attrs
+        else:
+            threshold = None
+            values = data.tables[a_star]
+            remaining = [a for a in attrs if a != a_star]
+        if weights is None and numeric[a_star]:
+            children = [(AT_MOST, rows[at_most], None), (ABOVE, rows[~at_most], None)]
+        elif weights is None:
+            children = [(values[code], child_rows, None) for code, child_rows in partition(column, rows)]
+        elif numeric[a_star]:
+            known = column != MISSING_CODE
+            children = share_missing(rows, weights, column, [(AT_MOST, np.flatnonzero(known & at_most)),
+                                                             (ABOVE, np.flatnonzero(~at_most))])
+        else:
+            known = np.flatnonzero(column != MISSING_CODE)
+            children = share_missing(rows, weights, column, [
+                (values[code], positions) for code, positions in partition(column[known], known)])
+
+        tables = [None] * len(children)
+        remaining_counted = [a for a in remaining if not presorted[a]]
+        if remaining_counted and len(rows) >= SUBTRACTION_MIN_ROWS and candidates is attrs and not weighted:
+            remaining_cards = all_cards[remaining_counted]
+            splits = [not (data.y[r] == data.y[r[0]]).all() for _, r, _ in children]
+            sizes = [len(r) for _, r, _ in children]
+            largest = max(range(len(children)), key=sizes.__getitem__)
+            subtract = splits[largest] and sum(sizes) - sizes[largest] < sizes[largest]
+            for k, (_, child_rows, _) in enumerate(children):
+                if k != largest and (splits[k] or subtract):
+                    with stats.phase('count'):
+                        tables[k] = count_table(data, child_rows, remaining_counted, remaining_cards)
+                    stats.count('rows_scanned', len(child_rows) * len(remaining_counted))
+            if subtract:
+                if numeric[a_star]:
+                    tables[largest] = table.copy()
+                else:
+                    k = counted.index(a_star)
+                    start = int(cards[:k].sum())
+                    tables[largest] = np.delete(table, slice(start, start + int(cards[k])), axis=0)
+                for k in range(len(children)):
+                    if k != largest:
+                        tables[largest] -= tables[k]
+
+        child_orders = [None] * len(children)
+        if wide:
+            for k, (_, child_rows, _) in enumerate(children):
+                side[child_rows] = k
+            sides = side[orders]
+            for k, (_, child_rows, _) in enumerate(children):
+                child_orders[k] = orders[sides == k].reshape(len(wide), len(child_rows))
+
+        return gains[best], a_star, threshold, remaining, [
+            (value, child_rows, child_weights, child_table, child_order)
+            for (value, child_rows, child_weights), child_table, child_order in zip(children, tables, child_orders)]
+
+    def apply(node, rows, weights, split):
+        '''
+        Turns node into the decision node of split and returns its new children
+        with the (rows, weights, table, orders) each is to be grown from.
+        '''
+        _, a_star, threshold, _, children = split
+        stats.count('splits')
+        describe(node, rows, weights)
+        node.add_decision_label(data.attributes[a_star])
+        node.threshold = threshold
+        grown = []
+        for value, child_rows, child_weights, child_table, child_order in children:
+            child = node.children[value] = Node()
+            grown.append((child, child_rows, child_weights, child_table, child_order))
+        return grown
+
+    with stats.phase('presort'):
+        orders = np.array([rows[np.argsort(data.matrix[:, a].take(rows), kind='stable')] for a in wide],
+                          dtype=np.intp).reshape(len(wide), len(rows))
+    weights = np.ones(len(rows)) if weighted else None
+    root = Node()
+    leaves = 1
+
+    if growth == 'depth':
+        def grow(node, rows, weights, attrs, table, orders, depth):
+            nonlocal leaves
+            split = plan(rows, weights, attrs, table, orders, depth)
+            if split is None or (max_leaf_nodes is not None and leaves + len(split[4]) - 1 > max_leaf_nodes):
+                return make_leaf(node, rows, weights)
+            leaves += len(split[4]) - 1
+            for child, child_rows, child_weights, child_table, child_order in apply(node, rows, weights, split):
+                grow(child, child_rows, child_weights, split[3], child_table, child_order, depth + 1)
+            return node
+
+        return grow(root, rows, weights, list(attrs), table, orders, 0)
+
+    # Best first: pending splits wait in a heap, highest gain (then oldest) first
+    pending = []
+    tiebreak = itertools.count()
+
+    def push(node, rows, weights, attrs, table, orders, depth):
+        split = plan(rows, weights, attrs, table, orders, depth)
+        if split is None:
+            make_leaf(node, rows, weights)
+        else:
+            heapq.heappush(pending, (-split[0], next(tiebreak), node, rows, weights, split, depth))
+
+    push(root, rows, weights, list(attrs), table, orders, 0)
+    while pending:
+        _, _, node, rows, weights, split, depth = heapq.heappop(pending)
+        if max_leaf_nodes is not None and leaves + len(split[4]) - 1 > max_leaf_nodes:
+            make_leaf(node, rows, weights)
+            continue
+        leaves += len(split[4]) - 1
+        for child, child_rows, child_weights, child_table, child_order in apply(node, rows, weights, split):
+            push(child, child_rows, child_weights, split[3], child_table, child_order, depth + 1)
+    return root
+
+
+def _level_gains(table: np.ndarray, is_numeric: bool, min_leaf: int):
+    '''
+    Takes the counts of one attribute at a group of nodes, laid out nodes x
+    codes x classes, and returns the attribute's gain at each node and, if it
+    is numeric, the code of its cut (-1 where there is none), computed as
+    info_gains and histogram_cuts compute them.
+    '''
+    if is_numeric:
+        left = np.cumsum(table, axis=1)
+        table[:, MISSING_CODE] = 0
+        nodes, codes = np.nonzero(table.any(axis=2))
+        gains = threshold_gains(left[nodes, codes], left[nodes, -1], min_leaf)
+        return _first_cuts(gains, codes, nodes, len(table))
+    class_counts = table.sum(axis=1)
+    values = table.sum(axis=2)
+    weighted = values / class_counts.sum(axis=1, keepdims=True) * entropy(table)
+    gains = entropy(class_counts) - weighted.sum(axis=1)
+    if min_leaf > 1:
+        gains[((values > 0) & (values < min_leaf)).any(axis=1)] = -np.inf
+    return gains, np.full(len(gains), -1)
+
+
+class FrontierRows:
+    '''
+    The rows of a level-wise build (see grow_levels), each tagged with the
+    frontier node it has reached and kept grouped by node.  Rows are numbered
+    in the order that breaks ties and orders children: by their position in
+    rows, or, if start is given, by start + their row number, which is how
+    sharded.py numbers each shard's rows after those of the shards before it.
+    n_classes defaults to data's.
+    '''
+    def __init__(self, data, rows: np.ndarray, start: int = None, n_classes: int = None):
+        self.data = data
+        self.rows = np.asarray(rows)
+        self.start = start
+        # order numbers, unless they follow from the row numbers
+        self.order = np.arange(len(self.rows), dtype=np.int64) if start is None else None
+        self.node_of = np.zeros(len(self.rows), dtype=np.intp)
+        self.n_classes = data.n_classes if n_classes is None else n_classes
+        self._moving = None
+
+    def _order(self, keep=slice(None)) -> np.ndarray:
+        if self.order is None:
+            return self.start + self.rows[keep].astype(np.int64)
+        return self.order[keep]
+
+    def classes(self, n_nodes: int):
+        '''
+        Returns the class counts of every frontier node, nodes x classes, and
+        the first order number among its rows of each class (NEVER if none).
+        '''
+        y = self.data.y[self.rows].astype(np.intp)
+        counts = np.bincount(self.node_of * self.n_classes + y, minlength=n_nodes * self.n_classes)
+        first = np.full((n_nodes, self.n_classes), NEVER, dtype=np.int64)
+        np.minimum.at(first, (self.node_of, y), self._order())
+        return counts.reshape(n_nodes, self.n_classes), first
+
+    def count(self, position: np.ndarray, start: int, stop: int, columns, cards, sparse=False):
+        '''
+        Counts the rows of the open frontier nodes whose position (-1 for the
+        other nodes) is start to stop - 1.  Returns a nodes x codes x classes
+        table holding one block of cards[k] codes for each of columns, in order.
+
+        With sparse, returns only the counts that are not zero instead: the
+        table's shape, their flat positions in it and the counts.  When the
+        rows are fewer than the table's cells they are counted without ever
+        making the table.
+        '''
+        n_classes = self.n_classes
+        cards = np.asarray(cards, dtype=np.intp)
+        shape = (stop - start, int(cards.sum()), n_classes)
+        nodes = np.flatnonzero((position >= start) & (position < stop))
+        lo, hi = np.searchsorted(self.node_of, [nodes[0], nodes[-1] + 1])
+        group = position[self.node_of[lo:hi]]
+        keep = group >= 0
+        rows, group = self.rows[lo:hi][keep], group[keep] - start
+        y = self.data.y[rows].astype(np.intp)
+        offsets = np.concatenate(([0], np.cumsum(cards)[:-1]))
+        if sparse and len(rows) * len(columns) < shape[0] * shape[1] * n_classes:
+            keys = np.concatenate([(group * shape[1] + offset + self.data.matrix[:, column].take(rows)) * n_classes + y
+                                   for column, offset in zip(columns, offsets)])
+            cells, counts = np.unique(keys, return_counts=True)
+            return shape, cells, counts
+        table = np.empty(shape, dtype=np.intp)
+        for column, card, offset in zip(columns, cards, offsets):
+            keys = (group * card + self.data.matrix[:, column].take(rows)) * n_classes + y
+            table[:, offset:offset + card] = np.bincount(keys, minlength=shape[0] * card * n_classes) \
+                .reshape(shape[0], card, n_classes)
+        if sparse:
+            flat = table.reshape(-1)
+            cells = np.flatnonzero(flat)
+            return shape, cells, flat[cells]
+        return table
+
+    def pairs(self, column_of: np.ndarray, cut_of: np.ndarray, width: int):
+        '''
+        Takes the column each frontier node splits on (-1 for leaves) and its
+        numeric cut (-1 for categorical splits).  Returns the distinct
+        node * width + child key of the rows that move on, where the key is a
+        code or 0/1 for AT_MOST/ABOVE, and the first order number of each.
+        '''
+        moving = column_of[self.node_of] >= 0
+        node = self.node_of[moving]
+        codes = self.data.matrix[self.rows[moving], column_of[node]].astype(np.intp)
+        cut = cut_of[node]
+        pairs, inverse = np.unique(node * width + np.where(cut >= 0, codes > cut, codes), return_inverse=True)
+        first = np.full(len(pairs), NEVER, dtype=np.int64)
+        np.minimum.at(first, inverse.ravel(), self._order(moving))
+        self._moving = (moving, pairs, inverse.ravel())
+        return pairs, first
+
+    def assign(self, pairs: np.ndarray, children: np.ndarray):
+        '''
+        Moves the rows of the last call to pairs to their children: children[i]
+        is the new frontier node of pairs[i], which lists every pair returned.
+        '''
+        moving, local, inverse = self._moving
+        self._moving = None
+        node_of = children[np.searchsorted(pairs, local)][inverse]
+        regroup = np.argsort(node_of, kind='stable')
+        self.rows = self.rows[moving][regroup]
+        if self.order is not None:
+            self.order = self.order[moving][regroup]
+        self.node_of = node_of[regroup]
+
+
+def build_levels(data, rows: np.ndarray, attrs: list[int], default, max_depth=None, min_samples_split=2,
+                 min_samples_leaf=1, min_info_gain=0.0, stats=None) -> Node:
+    '''
+    Grows the tree that build grows depth first, node for node, but one level
+    at a time and without recursion; see grow_levels.
+    '''
+    return grow_levels(FrontierRows(data, rows), data, attrs, default, max_depth, min_samples_split,
+                       min_samples_leaf, min_info_gain, stats)
+
+
+def grow_levels(source, data, attrs: list[int], default, max_depth=None, min_samples_split=2,
+                min_samples_leaf=1, min_info_gain=0.0, stats=None) -> Node:
+    '''
+    Grows a tree one level at a time from the rows source holds, which answers
+    as a FrontierRows does: data only supplies the attributes, tables, classes
+    and numeric flags.  Each attribute is counted for the whole frontier (every
+    node of the current depth) with one bincount keyed by (node, value, class);
+    numeric attributes are cut from those histograms, however many codes they
+    have, in groups of nodes of at most SWEEP_MAX_CELLS counts.  Rows then move
+    to their children by one vectorized update of their node numbers.
+
+    Takes the growth limits that a node decides on alone: max_depth,
+    min_samples_split, min_samples_leaf and min_info_gain.  stats is used as in
+    build.
+    '''
+    if stats is None:
+        stats = NO_STATS
+    root = Node()
+    attrs = list(attrs)
+    n_classes = data.n_classes
+    cards = data.cardinalities()[attrs]
+    attr_numeric = np.array(data.numeric, dtype=bool)[attrs]
+    # widest child key: a code, or 0/1 for AT_MOST/ABOVE
+    width = int(cards.max(initial=2)) + 1
+    frontier = [root]
+    # used[f, k]: the categorical attrs[k] has been split on above frontier node f
+    used = np.zeros((1, len(attrs)), dtype=bool)
+    depth = 0
+    while frontier:
+        n_nodes = len(frontier)
+        stats.count('nodes', n_nodes)
+        class_counts, first = source.classes(n_nodes)
+        sizes = class_counts.sum(axis=1)
+        if depth == 0 and sizes[0] == 0:
+            stats.count('leaves')
+            root.add_label(default)
+            return root
+        # Majority labels; ties go to the class whose first row comes first
+        tied = class_counts == class_counts.max(axis=1, keepdims=True)
+        labels = np.where(tied, first, NEVER).argmin(axis=1)
+        for node, label in zip(frontier, labels):
+            node.add_label(data.classes[label])
+
+        open_nodes = np.flatnonzero((np.count_nonzero(class_counts, axis=1) > 1) & (sizes >= min_samples_split)
+                                    & (~used).any(axis=1) & (max_depth is None or depth < max_depth))
+        gains = np.full((len(open_nodes), len(attrs)), -np.inf)
+        cuts = np.full((len(open_nodes), len(attrs)), -1, dtype=np.intp)
+        if len(open_nodes):
+            position = np.full(n_nodes, -1, dtype=np.intp)
+            position[open_nodes] = np.arange(len(open_nodes))
+            unused = ~used[open_nodes]
+            counted = np.flatnonzero(unused.any(axis=0))
+            stats.count('splits_evaluated', int(unused.sum()))
+            stats.count('rows_scanned', int(sizes[open_nodes].sum()) * len(counted))
+            blocks = np.concatenate(([0], np.cumsum(cards[counted])))
+            step = max(1, SWEEP_MAX_CELLS // (int(blocks[-1]) * n_classes))
+            for start in range(0, len(open_nodes), step):
+                stop = min(start + step, len(open_nodes))
+                with stats.phase('count'):
+                    table = source.count(position, start, stop, [attrs[k] for k in counted], cards[counted])
+                with stats.phase('gains'):
+                    for i, k in enumerate(counted):
+                        gains[start:stop, k], cuts[start:stop, k] = _level_gains(
+                            table[:, blocks[i]:blocks[i + 1]], attr_numeric[k], min_samples_leaf)
+            gains[used[open_nodes]] = -np.inf
+
+        # first_best along every open node's row
+        best = np.zeros(len(open_nodes), dtype=np.intp)
+        best_gain = gains[:, 0].copy()
+        for k in range(1, len(attrs)):
+            better = gains[:, k] > best_gain + GAIN_TOLERANCE
+            best[better] = k
+            best_gain[better] = gains[better, k]
+        splits = (best_gain > -np.inf) & (best_gain >= min_info_gain - GAIN_TOLERANCE)
+        split_nodes, split_attr = open_nodes[splits], best[splits]
+        stats.count('leaves', n_nodes - len(split_nodes))
+        stats.count('splits', len(split_nodes))
+        if not len(split_nodes):
+            break
+
+        with stats.phase('partition'):
+            attr_of = np.full(n_nodes, -1, dtype=np.intp)
+            attr_of[split_nodes] = split_attr
+            cut_of = np.full(n_nodes, -1, dtype=np.intp)
+            cut_of[split_nodes] = cuts[splits, split_attr]
+            for f, k, cut in zip(split_nodes, split_attr, cut_of[split_nodes]):
+                frontier[f].add_decision_label(data.attributes[attrs[k]])
+                if attr_numeric[k]:
+                    frontier[f].threshold = data.tables[attrs[k]][cut]
+            column_of = np.where(attr_of >= 0, np.asarray(attrs)[attr_of], -1)
+            pairs, first_seen = source.pairs(column_of, cut_of, width)
+            parents = pairs // width
+            keys = pairs % width
+            # Children in the order build makes them: AT_MOST before ABOVE, or
+            # values in order of first appearance
+            numeric_parent = attr_numeric[attr_of[parents]]
+            order = np.lexsort((np.where(numeric_parent, keys, first_seen), parents))
+            rank = np.empty(len(pairs), dtype=np.intp)
+            rank[order] = np.arange(len(pairs))
+            children = []
+            for u in order:
+                f, k = parents[u], attr_of[parents[u]]
+                value = (ABOVE if keys[u] else AT_MOST) if numeric_parent[u] else data.tables[attrs[k]][keys[u]]
+                child = frontier[f].children[value] = Node()
+                children.append(child)
+            used = used[parents[order]]
+            categorical = ~numeric_parent[order]
+            used[np.flatnonzero(categorical), attr_of[parents[order]][categorical]] = True
+            source.assign(pairs, rank)
+        frontier = children
+        depth += 1
+    return root
+
+
+def root_table(data, rows: np.ndarray) -> np.ndarray:
+    '''
+    Returns the count table of rows that build takes as its table when growing
+    a tree from them over every attribute: one block per attribute except the
+    wide numeric ones, which build sweeps instead.  Trees with different limits
+    grown from the same rows can all be handed one such table.  Trees grown
+    with missing="weighted" count their own.
+    '''
+    attrs = np.arange(len(data.attributes))
+    wide = np.array(data.numeric, dtype=bool) & (data.cardinalities() > HISTOGRAM_MAX_CODES)
+    counted = attrs[~wide].tolist()
+    return count_table(data, rows, counted) if counted else None
+
+
+def train(data, default, stats=None, **limits) -> Node:
+    '''
+    Takes in an EncodedDataset and returns a tree trained on all of its rows.
+    limits are any of build's growth limits; stats is timed as phase build.
+    '''
+    rows = np.arange(len(data), dtype=np.intp)
+    with (stats or NO_STATS).phase('build'):
+        return build(data, rows, list(range(len(data.attributes))), default, stats=stats, **limits)
@@ -0,0 +1,540 @@
+import numpy as np
+import storage
+from dataset import EncodedDataset, MISSING, code_dtype
+from node import AT_MOST, ABOVE
+
+# dtype of the node arrays; four bytes per entry is plenty for any tree
+INDEX = np.int32
+
+# Label probabilities closer than this are ties, which go to the first label
+# code, so that rounding in how the shares are summed cannot decide them
+TIE_TOLERANCE = 1e-12
+
+
+class CompiledTree:
+    '''
+    A trained Node tree flattened into arrays, for batch prediction.
+
+    Nodes are numbered breadth first, with the root as node 0.  feature[i] is the
+    column index of node i's decision attribute, or -1 for a leaf.  For an
+    internal node, child[offset[i] + code] is the node reached when that column
+    holds code, or -1 if the node has no child for that value; offset[i] is -1
+    for a node compiled as a leaf.  label[i] indexes labels, and is what the
+    tree predicts when an example stops at node i.
+
+    A node that splits a numeric column has cut[i] >= 0 (it is -1 elsewhere)
+    and two child slots: codes up to cut[i] go to child[offset[i]], the rest to
+    child[offset[i] + 1].  The table of a numeric column (numeric[j]) lists "?"
+    and then the thresholds in ascending order, and a number is encoded as 1 +
+    the count of thresholds below it, so its code is at most cut[i] exactly when
+    it is at most tables[j][cut[i]].  Missing values are code 0.
+
+    The arrays double as a compact arena for a tree: root() returns a TreeNode
+    view with the Node API, and copy() clones the whole tree with a few array
+    copies.
+
+    attributes and tables give the column layout and the value behind every
+    code.  Values that a table does not list are encoded as len(table), which
+    never has a child.
+
+    A tree grown with missing="weighted" (see columnar.build) also has dist,
+    whose row i holds the training weight of each label at node i.  An example
+    missing the value of a node's column then takes every branch, as
+    ID3.class_distribution describes; dist is None for other trees.
+    '''
+    def __init__(self, feature, offset, child, label, attributes, tables, labels, cut=None, numeric=None,
+                 dist=None):
+        self.feature = feature
+        self.offset = offset
+        self.child = child
+        self.label = label
+        self.attributes = attributes
+        self.tables = tables
+        self.labels = labels
+        self.cut = cut if cut is not None else np.full(len(feature), -1, dtype=INDEX)
+        self.numeric = list(numeric) if numeric is not None else [False] * len(attributes)
+        self.dist = dist
+
+    def __len__(self):
+        return len(self.feature)
+
+    def root(self):
+        '''
+        Returns a TreeNode view of the root node.
+        '''
+        return TreeNode(self, 0)
+
+    def copy(self):
+        '''
+        Returns an independent clone of the tree.  The value tables are shared,
+        as nothing changes them after compilation.
+        '''
+        return CompiledTree(self.feature.copy(), self.offset.copy(), self.child.copy(),
+                            self.label.copy(), self.attributes, self.tables, list(self.labels),
+                            self.cut.copy(), self.numeric, None if self.dist is None else self.dist.copy())
+
+    def intern(self, label) -> int:
+        '''
+        Returns the code of label, adding it to labels if it is new.
+        '''
+        try:
+            return self.labels.index(label)
+        except ValueError:
+            self.labels.append(label)
+            if self.dist is not None:
+                self.dist = np.pad(self.dist, ((0, 0), (0, 1)))
+            return len(self.labels) - 1
+
+    def encode(self, examples) -> np.ndarray:
+        '''
+        Encodes example dictionaries, or re-codes an EncodedDataset, into a code
+        matrix laid out for this tree.
+        '''
+        matrix = np.empty((len(examples), len(self.attributes)),
+                          dtype=code_dtype(max((len(t) + 1 for t in self.tables), default=1)),
+                          order='F')
+        if isinstance(examples, EncodedDataset):
+            source = {a: j for j, a in enumerate(examples.attributes)}
+        for j, (attribute, table) in enumerate(zip(self.attributes, self.tables)):
+            if self.numeric[j]:
+                # Absent attributes count as missing, which numeric splits handle
+                thresholds = np.array(table[1:], dtype=float)
+                def code_of(value):
+                    return 0 if value is None or value == MISSING \
+                        else int(np.searchsorted(thresholds, float(value))) + 1
+                unseen = 0
+            else:
+                lookup = {value: code for code, value in enumerate(table)}
+                unseen = len(table)
+                def code_of(value):
+                    return lookup.get(value, unseen)
+            if not isinstance(examples, EncodedDataset):
+                matrix[:, j] = np.fromiter((code_of(e.get(attribute)) for e in examples),
+                                           dtype=matrix.dtype, count=len(examples))
+            elif attribute not in source:
+                matrix[:, j] = unseen
+            else:
+                k = source[attribute]
+                recode = np.array([code_of(value) for value in examples.tables[k]], dtype=matrix.dtype)
+                matrix[:, j] = recode[examples.matrix[:, k]]
+        return matrix
+
+    def missing_codes(self) -> np.ndarray:
+        '''
+        Returns the code of a missing value "?" in each column, or -1 for a
+        column whose table does not list it.
+        '''
+        return np.array([t.index(MISSING) if MISSING in t else -1 for t in self.tables], dtype=np.intp)
+
+    def predict_batch(self, matrix: np.ndarray) -> np.ndarray:
+        '''
+        Takes in a code matrix and returns the label code (an index into labels)
+        predicted for every row.  All rows descend one level per iteration.  In
+        a tree with dist, rows that meet a node whose value they are missing
+        stop there, and are given the most probable label of predict_proba;
+        ties (within TIE_TOLERANCE) go to the first label.
+        '''
+        node = np.zeros(matrix.shape[0], dtype=INDEX)
+        active = np.arange(matrix.shape[0], dtype=np.intp)
+        numeric = (self.cut >= 0).any()
+        if self.dist is not None:
+            missing = self.missing_codes()
+            forked = np.zeros(matrix.shape[0], dtype=bool)
+        while active.size:
+            current = node[active]
+            feature = self.feature[current]
+            internal = feature >= 0
+            active, current, feature = active[internal], current[internal], feature[internal]
+            slot = matrix[active, feature]
+            if self.dist is not None:
+                fork = slot == missing[feature]
+                forked[active[fork]] = True
+                active, current, feature, slot = active[~fork], current[~fork], feature[~fork], slot[~fork]
+            if numeric:
+                cut = self.cut[current]
+                slot = np.where(cut >= 0, slot > cut, slot)
+            nxt = self.child[self.offset[current] + slot]
+            moved = nxt >= 0
+            active = active[moved]
+            node[active] = nxt[moved]
+        labels = self.label[node]
+        if self.dist is not None and forked.any():
+            rows = np.flatnonzero(forked)
+            proba = self._combine(matrix, rows, node[rows])
+            labels[rows] = (proba >= proba.max(axis=1, keepdims=True) - TIE_TOLERANCE).argmax(axis=1)
+        return labels
+
+    def predict_proba(self, matrix: np.ndarray) -> np.ndarray:
+        '''
+        Takes in a code matrix and returns the probability of every label (the
+        columns follow labels) for every row: the distribution of the leaf a row
+        reaches, or in a tree with dist, the combination of the leaves its
+        missing values lead to.  A tree without dist gives its prediction all
+        the probability.
+        '''
+        if self.dist is None:
+            proba = np.zeros((matrix.shape[0], len(self.labels)))
+            proba[np.arange(matrix.shape[0]), self.predict_batch(matrix)] = 1.0
+            return proba
+        return self._combine(matrix, np.arange(matrix.shape[0]), np.zeros(matrix.shape[0], dtype=INDEX))
+
+    def _combine(self, matrix, rows, start):
+        '''
+        Returns the label probabilities of the given rows of matrix, each starting
+        from its node in start, with a weighted tree's missing values shared
+        among all branches.
+        '''
+        weight = self.dist.sum(axis=1)
+        # Nodes with no weight of their own predict their label
+        dist = np.zeros((len(self), len(self.labels)))
+        dist[:, :self.dist.shape[1]] = self.dist
+        empty = weight == 0
+        dist[np.flatnonzero(empty), self.label[empty]] = 1.0
+        dist /= dist.sum(axis=1, keepdims=True)
+
+        # Children of every node, as a CSR list with each child's share
+        width = np.where(self.cut >= 0, 2, [len(self.tables[j]) + 1 if j >= 0 else 0 for j in self.feature])
+        width[self.offset < 0] = 0
+        kids_start = np.zeros(len(self) + 1, dtype=np.intp)
+        slots = [self.child[o:o + w] for o, w in zip(self.offset, width)]
+        kids = [s[s >= 0] for s in slots]
+        kids_start[1:] = np.cumsum([len(k) for k in kids])
+        kids = np.concatenate(kids).astype(np.intp) if len(kids) else np.zeros(0, dtype=np.intp)
+        owner = np.repeat(np.arange(len(self)), np.diff(kids_start))
+        totals = np.bincount(owner, weights=weight[kids], minlength=len(self))
+        share = np.divide(weight[kids], totals[owner], out=np.zeros(len(kids)), where=totals[owner] > 0)
+
+        missing = self.missing_codes()
+        numeric = (self.cut >= 0).any()
+        proba = np.zeros((len(rows), len(self.labels)))
+        # (index into rows, node, weight) of every path still descending
+        index, node, mass = np.arange(len(rows)), start.astype(np.intp), np.ones(len(rows))
+        while index.size:
+            feature = self.feature[node]
+            stop = feature < 0
+            slot = np.zeros(len(node), dtype=np.intp)
+            fork = np.zeros(len(node), dtype=bool)
+            internal = ~stop
+            slot[internal] = matrix[rows[index[internal]], feature[internal]]
+            fork[internal] = (slot[internal] == missing[feature[internal]]) \
+                & (totals[node[internal]] > 0)
+            step = internal & ~fork
+            if numeric:
+                cut = self.cut[node[step]]
+                slot[step] = np.where(cut >= 0, slot[step] > cut, slot[step])
+            nxt = np.full(len(node), -1, dtype=np.intp)
+            nxt[step] = self.child[self.offset[node[step]] + slot[step]]
+            stop |= step & (nxt < 0)
+            np.add.at(proba, index[stop], mass[stop, None] * dist[node[stop]])
+
+            counts = np.diff(kids_start)[node[fork]]
+            first = np.repeat(kids_start[node[fork]] - np.cumsum(counts) + counts, counts)
+            branch = first + np.arange(counts.sum())
+            moved = step & (nxt >= 0)
+            index = np.concatenate((index[moved], np.repeat(index[fork], counts)))
+            mass = np.concatenate((mass[moved], np.repeat(mass[fork], counts) * share[branch]))
+            node = np.concatenate((nxt[moved], kids[branch]))
+        return proba
+
+    def predict(self, examples: list[dict]) -> list:
+        '''
+        Returns the Class value the tree assigns to each example, like ID3.evaluate.
+        '''
+        codes = self.predict_batch(self.encode(examples))
+        return [self.labels[c] for c in codes]
+
+
+def compile_tree(node, attributes=None, tables=None, labels=None, numeric=None) -> CompiledTree:
+    '''
+    Takes in a trained tree and returns a CompiledTree.  attributes, tables,
+    labels and numeric optionally fix the column layout and code assignments
+    (for example an EncodedDataset's attributes, tables, classes and numeric),
+    so several trees can share one encoded matrix; they are copied and extended
+    with anything the tree uses that they do not list.  The thresholds a tree
+    uses are merged into the tables of numeric columns in ascending order.
+    Every table lists "?" first, so a missing value is code 0 in each column.
+    '''
+    if isinstance(node, TreeNode) and node.index == 0 and attributes is None \
+            and tables is None and labels is None and numeric is None:
+        return node.tree
+    attributes = list(attributes or [])
+    tables = [list(t) for t in tables] if tables is not None else [[] for _ in attributes]
+    labels = list(labels or [])
+    numeric = list(numeric) if numeric is not None else [False] * len(attributes)
+    columns = {a: j for j, a in enumerate(attributes)}
+    lookups = [{value: code for code, value in enumerate(t)} for t in tables]
+    label_codes = {value: code for code, value in enumerate(labels)}
+
+    # First pass: number the nodes breadth first and extend the layout
+    order = [node]
+    thresholds = {}
+    weighted = False
+    for current in order:
+        for label in [current.label] + list(current.distribution or ()):
+            if label not in label_codes:
+                label_codes[label] = len(labels)
+                labels.append(label)
+        weighted = weighted or current.distribution is not None
+        if current.decision_label is None:
+            continue
+        split_numeric = current.threshold is not None
+        if current.decision_label not in columns:
+            columns[current.decision_label] = len(attributes)
+            attributes.append(current.decision_label)
+            tables.append([MISSING])
+            lookups.append({MISSING: 0})
+            numeric.append(split_numeric)
+        j = columns[current.decision_label]
+        if numeric[j] != split_numeric:
+            raise ValueError(f"attribute {current.decision_label!r} is split both as numeric and as categorical")
+        if split_numeric:
+            thresholds.setdefault(j, set()).add(current.threshold)
+        else:
+            for value in current.children:
+                if value not in lookups[j]:
+                    lookups[j][value] = len(tables[j])
+                    tables[j].append(value)
+        order.extend(current.children.values())
+    for j, used in thresholds.items():
+        tables[j] = [MISSING] + sorted(set(tables[j][1:]) | used)
+        lookups[j] = {value: code for code, value in enumerate(tables[j])}
+
+    # Second pass: fill the arrays, giving each internal node a child slot per
+    # code, or two for a numeric split
+    ids = {id(n): i for i, n in enumerate(order)}
+    feature = np.full(len(order), -1, dtype=INDEX)
+    offset = np.full(len(order), -1, dtype=INDEX)
+    cut = np.full(len(order), -1, dtype=INDEX)
+    label = np.array([label_codes[n.label] for n in order], dtype=INDEX)
+    dist = None
+    if weighted:
+        dist = np.zeros((len(order), len(labels)))
+        for i, current in enumerate(order):
+            for value, weight in (current.distribution or {}).items():
+                dist[i, label_codes[value]] = weight
+    slots = []
+    for i, current in enumerate(order):
+        if current.decision_label is None:
+            continue
+        j = columns[current.decision_label]
+        feature[i] = j
+        offset[i] = len(slots)
+        if current.threshold is not None:
+            cut[i] = lookups[j][current.threshold]
+            slots.extend(ids[id(current.children[key])] if key in current.children else -1
+                         for key in (AT_MOST, ABOVE))
+            continue
+        row = [-1] * (len(tables[j]) + 1)
+        for value, c in current.children.items():
+            row[lookups[j][value]] = ids[id(c)]
+        slots.extend(row)
+    child = np.array(slots, dtype=INDEX)
+    return CompiledTree(feature, offset, child, label, attributes, tables, labels, cut, numeric, dist)
+
+
+class TreeNode:
+    '''
+    A view of node index of a CompiledTree with the same API as node.Node:
+    label, decision_label, threshold and children can be read, and written the
+    way ID3.prune does, which updates the tree's arrays in place; so can
+    distribution, in a tree that has them.  children is built on each access,
+    mapping values to TreeNode views in the original order.
+    '''
+    __slots__ = ('tree', 'index')
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    @property
+    def label(self):
+        return self.tree.labels[self.tree.label[self.index]]
+
+    @label.setter
+    def label(self, label):
+        self.tree.label[self.index] = self.tree.intern(label)
+
+    @property
+    def decision_label(self):
+        j = self.tree.feature[self.index]
+        return None if j < 0 else self.tree.attributes[j]
+
+    @decision_label.setter
+    def decision_label(self, attribute):
+        if attribute is None:
+            self.tree.feature[self.index] = -1
+        elif self.tree.offset[self.index] < 0:
+            raise ValueError("a node compiled as a leaf cannot be given a decision attribute")
+        else:
+            self.tree.feature[self.index] = self.tree.attributes.index(attribute)
+
+    @property
+    def threshold(self):
+        tree, i = self.tree, self.index
+        if tree.feature[i] < 0 or tree.cut[i] < 0:
+            return None
+        return tree.tables[tree.feature[i]][tree.cut[i]]
+
+    @threshold.setter
+    def threshold(self, threshold):
+        if threshold is not None:
+            raise ValueError("TreeNode thresholds can only be cleared")
+        self.tree.cut[self.index] = -1
+
+    @property
+    def distribution(self):
+        tree, i = self.tree, self.index
+        if tree.dist is None:
+            return None
+        return {tree.labels[k]: float(tree.dist[i, k]) for k in np.flatnonzero(tree.dist[i])}
+
+    @distribution.setter
+    def distribution(self, distribution):
+        tree, i = self.tree, self.index
+        if tree.dist is None:
+            if distribution is not None:
+                raise ValueError("only a tree compiled with distributions can be given one")
+            return
+        codes = [(tree.intern(label), weight) for label, weight in (distribution or {}).items()]
+        tree.dist[i] = 0
+        for code, weight in codes:
+            tree.dist[i, code] = weight
+
+    @property
+    def children(self):
+        tree, i = self.tree, self.index
+        j = tree.feature[i]
+        if j < 0:
+            return {}
+        if tree.cut[i] >= 0:
+            slots = tree.child[tree.offset[i]:tree.offset[i] + 2]
+            return {key: TreeNode(tree, int(slot)) for key, slot in zip((AT_MOST, ABOVE), slots) if slot >= 0}
+        slots = tree.child[tree.offset[i]:tree.offset[i] + len(tree.tables[j])]
+        # Siblings are numbered consecutively in their original order
+        codes = sorted(np.flatnonzero(slots >= 0), key=lambda code: slots[code])
+        return {tree.tables[j][code]: TreeNode(tree, int(slots[code])) for code in codes}
+
+    @children.setter
+    def children(self, children):
+        if children:
+            raise ValueError("TreeNode children can only be cleared")
+        self.tree.feature[self.index] = -1
+
+    def add_label(self, label):
+        self.label = label
+
+    def add_decision_label(self, label):
+        self.decision_label = label
+
+
+def compile_forest(trees, attributes=None, tables=None, labels=None, numeric=None) -> list[CompiledTree]:
+    '''
+    Compiles several trees onto one shared column layout and label list, so that
+    a single code matrix can be fed to all of them and their label codes agree.
+    '''
+    # The first pass only grows the shared layout; the second lays every tree
+    # out against the final tables, so no code overruns a node's child slots.
+    for tree in trees:
+        c = compile_tree(tree, attributes, tables, labels, numeric)
+        attributes, tables, labels, numeric = c.attributes, c.tables, c.labels, c.numeric
+    return [compile_tree(tree, attributes, tables, labels, numeric) for tree in trees]
+
+
+def vote(votes: np.ndarray, n_labels: int, mask: np.ndarray = None):
+    '''
+    Takes in a T x N matrix of label codes (one row per tree) and returns the
+    per-column majority code and the N x n_labels matrix of vote counts.  Ties
+    go to the tied label that the earliest tree voted for.  If mask (T x N) is
+    given, only the votes where it is True count; a column with none gets code 0
+    and no counts.
+    '''
+    n_trees, n = votes.shape
+    columns = np.broadcast_to(np.arange(n), votes.shape).ravel()
+    trees = np.repeat(np.arange(n_trees), n)
+    votes = votes.ravel()
+    if mask is not None:
+        keep = mask.ravel()
+        columns, trees, votes = columns[keep], trees[keep], votes[keep]
+    counts = np.bincount(columns * n_labels + votes, minlength=n * n_labels).reshape(n, n_labels)
+    first = np.full((n, n_labels), n_trees, dtype=np.intp)
+    np.minimum.at(first, (columns, votes), trees)
+    tied = counts == counts.max(axis=1, keepdims=True)
+    return np.where(tied, first, n_trees + 1).argmin(axis=1), counts
+
+
+# Model files written by save_trees and read back by load_trees
+MODEL_MAGIC = b'ID3MODEL'
+MODEL_VERSION = 3
+
+
+def save_trees(path, trees, info=None):
+    '''
+    Writes a list of trees (Node trees, TreeNode roots or CompiledTrees) to a
+    binary model file, compiled onto one shared layout.  The node arrays of all
+    trees are stored back to back; info is any JSON-serializable dict kept in the
+    header, such as a forest's parameters.  Either all the trees or none of them
+    may have label distributions.
+    '''
+    if not trees:
+        raise ValueError("there are no trees to save")
+    if not all(isinstance(t, CompiledTree) for t in trees) or any(
+            t.attributes != trees[0].attributes or t.tables != trees[0].tables
+            or t.labels != trees[0].labels or t.numeric != trees[0].numeric for t in trees):
+        trees = compile_forest([t.root() if isinstance(t, CompiledTree) else t for t in trees])
+    header = {'version': MODEL_VERSION, 'info': info or {}, 'attributes': trees[0].attributes,
+              'tables': trees[0].tables, 'labels': trees[0].labels, 'numeric': trees[0].numeric}
+    arrays = {'node_start': np.cumsum([0] + [len(t) for t in trees], dtype=np.int64),
+              'slot_start': np.cumsum([0] + [len(t.child) for t in trees], dtype=np.int64)}
+    for name in ['feature', 'offset', 'child', 'label', 'cut']:
+        arrays[name] = np.concatenate([getattr(t, name) for t in trees]).astype(INDEX)
+    weighted = [t.dist is not None for t in trees]
+    if any(weighted):
+        if not all(weighted):
+            raise ValueError("trees with and without distributions cannot be saved together")
+        n_labels = len(trees[0].labels)
+        arrays['dist'] = np.concatenate([np.pad(t.dist, ((0, 0), (0, n_labels - t.dist.shape[1])))
+                                         for t in trees])
+    storage.write(path, MODEL_MAGIC, header, arrays)
+
+
+def load_trees(path):
+    '''
+    Reads a model file written by save_trees.  Returns (trees, info): a list of
+    CompiledTrees whose arrays are read-only memory maps of the file, so loading
+    copies nothing and processes serving the same model share one page-cached
+    copy.  Use CompiledTree.copy() to get a tree that can be modified.
+    '''
+    header = storage.read_header(path, MODEL_MAGIC)
+    if header is None:
+        raise ValueError(f"{path} is not a model file")
+    if header.get('version') != MODEL_VERSION:
+        raise ValueError(f"{path} has model format version {header.get('version')}, "
+                         f"expected {MODEL_VERSION}")
+    _, arrays = storage.read(path, MODEL_MAGIC, header)
+    node_start, slot_start = np.asarray(arrays['node_start']), np.asarray(arrays['slot_start'])
+    trees = []
+    for k in range(len(node_start) - 1):
+        nodes = slice(node_start[k], node_start[k + 1])
+        trees.append(CompiledTree(arrays['feature'][nodes], arrays['offset'][nodes],
+                                  arrays['child'][slot_start[k]:slot_start[k + 1]], arrays['label'][nodes],
+                                  header['attributes'], header['tables'], header['labels'],
+                                  arrays['cut'][nodes], header['numeric'],
+                                  arrays['dist'][nodes] if 'dist' in arrays else None))
+    return trees, header['info']
+
+
+def save_tree(path, tree):
+    '''
+    Writes one tree (a Node tree, TreeNode root or CompiledTree) to a model file.
+    '''
+    save_trees(path, [tree], {'kind': 'tree'})
+
+
+def load_tree(path) -> CompiledTree:
+    '''
+    Reads a model file written by save_tree; see load_trees.
+    '''
+    trees, info = load_trees(path)
+    if info.get('kind') != 'tree':
+        raise ValueError(f"{path} does not hold a single tree")
+    return trees[0]
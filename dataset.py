@@ -0,0 +1,178 @@
+import numpy as np
+import storage
+
+CLASS = 'Class'
+# Missing attribute values are written "?" and always get code 0
+MISSING = '?'
+MISSING_CODE = 0
+
+
+def code_dtype(cardinality):
+  '''
+  Returns the smallest unsigned integer dtype that can hold codes 0..cardinality-1.
+  '''
+  if cardinality <= np.iinfo(np.uint8).max + 1:
+    return np.uint8
+  if cardinality <= np.iinfo(np.uint16).max + 1:
+    return np.uint16
+  return np.uint32
+
+
+class EncodedDataset:
+  '''
+  A dataset encoded once into integer codes.  matrix[i, j] is the code of the
+  value of attributes[j] in row i, and tables[j][code] recovers the raw value.
+  y holds the class codes, and classes[code] recovers the raw class value.
+  Codes are assigned in order of first appearance.
+
+  numeric[j] is True if attributes[j] is numeric (see as_numeric).  Its table
+  then lists "?" followed by ascending numbers, and its codes are ranks: a
+  value's code is 1 + the number of table entries below it, so comparing codes
+  compares values.
+  '''
+  def __init__(self, matrix, y, attributes, tables, classes, numeric=None):
+    self.matrix = matrix
+    self.y = y
+    self.attributes = attributes
+    self.tables = tables
+    self.classes = classes
+    self.numeric = list(numeric) if numeric is not None else [False] * len(attributes)
+
+  def __len__(self):
+    return self.matrix.shape[0]
+
+  def __getitem__(self, rows):
+    return EncodedDataset(self.matrix[rows], self.y[rows], self.attributes, self.tables, self.classes,
+                          self.numeric)
+
+  def labels(self) -> list:
+    '''
+    Returns the raw Class value of every row.
+    '''
+    return [self.classes[c] for c in self.y]
+
+  def example(self, i: int) -> dict:
+    '''
+    Decodes row i back into an example dictionary.
+    '''
+    e = {a: t[c] for a, t, c in zip(self.attributes, self.tables, self.matrix[i])}
+    e[CLASS] = self.classes[self.y[i]]
+    return e
+
+  @property
+  def n_classes(self):
+    return len(self.classes)
+
+  def cardinalities(self):
+    return np.array([len(t) for t in self.tables], dtype=np.intp)
+
+
+def encode(examples: list[dict], numeric=(), bins=None) -> EncodedDataset:
+  '''
+  Takes in an array of example dictionaries and returns an EncodedDataset.
+  The attribute order is the key order of the first example, minus "Class".
+  The attributes listed in numeric are encoded as numbers; see as_numeric.
+  '''
+  attributes = [a for a in examples[0].keys() if a != CLASS]
+  lookups = [{MISSING: MISSING_CODE} for _ in attributes]
+  class_lookup = {}
+  columns = [[] for _ in attributes]
+  y = []
+  for e in examples:
+    for j, a in enumerate(attributes):
+      lookup = lookups[j]
+      value = e[a]
+      code = lookup.get(value)
+      if code is None:
+        code = lookup[value] = len(lookup)
+      columns[j].append(code)
+    code = class_lookup.get(e[CLASS])
+    if code is None:
+      code = class_lookup[e[CLASS]] = len(class_lookup)
+    y.append(code)
+
+  matrix = np.empty((len(examples), len(attributes)),
+                    dtype=code_dtype(max((len(l) for l in lookups), default=1)), order='F')
+  for j, column in enumerate(columns):
+    matrix[:, j] = column
+  data = EncodedDataset(matrix,
+                        np.array(y, dtype=code_dtype(len(class_lookup))),
+                        attributes,
+                        [list(l) for l in lookups],
+                        list(class_lookup))
+  return as_numeric(data, numeric, bins) if numeric else data
+
+
+def as_numeric(data: EncodedDataset, attributes, bins=None) -> EncodedDataset:
+  '''
+  Returns a copy of data in which the listed attributes are numeric: their
+  values are converted with float and sorted once, here, so that codes become
+  ranks and every later threshold test is a comparison of codes.
+
+  With bins, an attribute with more distinct values than that is cut into at
+  most bins quantile buckets instead, weighted by how often each value occurs.
+  Its table then lists the largest value of each bucket, so a threshold on a
+  bucket still reads as a value, and codes fit in one byte for up to 255 bins.
+  '''
+  matrix = np.array(data.matrix, order='F')
+  tables, numeric = list(data.tables), list(data.numeric)
+  for attribute in attributes:
+    j = data.attributes.index(attribute)
+    if numeric[j]:
+      continue
+    counts = np.bincount(data.matrix[:, j], minlength=len(data.tables[j])) if bins else None
+    recode, tables[j] = numeric_recode(data.tables[j], counts, bins)
+    matrix[:, j] = recode[data.matrix[:, j]]
+    numeric[j] = True
+  # Binning can leave every column with fewer codes than the matrix type allows
+  dtype = code_dtype(max((len(t) for t in tables), default=1))
+  if np.dtype(dtype).itemsize < matrix.dtype.itemsize:
+    matrix = matrix.astype(dtype, order='F')
+  return EncodedDataset(matrix, data.y, data.attributes, tables, data.classes, numeric)
+
+
+def numeric_recode(table: list, counts=None, bins=None):
+  '''
+  Returns how as_numeric makes one attribute numeric: an array taking each of
+  its old codes to its new one, and its new table.  counts[code] is how often
+  each old code occurs, which is only needed with bins.
+  '''
+  values = np.array([float(v) for v in table[1:]])
+  edges, inverse = np.unique(values, return_inverse=True)
+  if bins and len(edges) > bins:
+    weight = np.bincount(inverse, weights=counts[1:])
+    cumulative = np.cumsum(weight)
+    cuts = np.searchsorted(cumulative, cumulative[-1] * np.arange(1, bins + 1) / bins)
+    edges = edges[np.unique(np.append(np.minimum(cuts, len(edges) - 1), len(edges) - 1))]
+  recode = np.zeros(len(table), dtype=np.intp)
+  recode[1:] = np.searchsorted(edges, values) + 1
+  return recode, [MISSING] + edges.tolist()
+
+
+# Binary cache files written by save and read back by open_saved
+CACHE_MAGIC = b'ID3DATA\x00'
+CACHE_VERSION = 2
+
+
+def save(data: EncodedDataset, path, key=None):
+  '''
+  Writes an EncodedDataset to a binary file that open_saved can memory-map.
+  key is stored alongside and can be any JSON value identifying the source.
+  '''
+  header = {'version': CACHE_VERSION, 'key': key, 'attributes': data.attributes,
+            'tables': data.tables, 'classes': data.classes, 'numeric': data.numeric}
+  storage.write(path, CACHE_MAGIC, header, {'matrix': data.matrix, 'y': data.y})
+
+
+def open_saved(path, key=None):
+  '''
+  Returns the EncodedDataset saved at path, with its matrix and class codes
+  memory-mapped read-only from the file.  Returns None if there is no usable
+  file: missing, of another format version, or saved under a different key.
+  '''
+  header = storage.read_header(path, CACHE_MAGIC)
+  if header is None or header.get('version') != CACHE_VERSION or header.get('key') != key:
+    return None
+  _, arrays = storage.read(path, CACHE_MAGIC, header)
+  return EncodedDataset(arrays['matrix'], arrays['y'], header['attributes'],
+                        header['tables'], header['classes'], header['numeric'])
@@ -0,0 +1,267 @@
+'''
+Incremental ID3: a tree that absorbs newly labelled examples without being
+retrained from scratch, in the spirit of ID5R.
+
+Every node keeps the count table of the rows that reached it (value x class
+counts for each of its remaining attributes).  An update routes the new rows
+down the tree, adds their counts to the tables along their paths and re-scores
+each node it passes.  Where the best attribute is unchanged the node keeps its
+subtree and the rows move on to its children; where it changes, or a leaf can
+now split, only that subtree is grown again, from the rows that reach it.
+'''
+import numpy as np
+import columnar
+from dataset import CLASS, MISSING, MISSING_CODE, EncodedDataset, code_dtype
+from node import Node
+from profiling import NO_STATS
+
+
+class IncrementalID3:
+    '''
+    An ID3 tree over categorical attributes that is kept up to date as examples
+    arrive.  After any sequence of updates, root is the tree that ID3.ID3
+    (either engine) grows from all the examples seen so far, in arrival order,
+    with the same limits: node for node, labels and child order included.
+
+    The growth limits are those of columnar.build that a node decides on its
+    own: max_depth, min_samples_split, min_samples_leaf and min_info_gain.
+    max_leaf_nodes, best-first growth and max_features depend on the rest of
+    the tree or on a random draw, and are not offered.  Missing values "?" are
+    a value like any other.
+    '''
+    def __init__(self, default, max_depth=None, min_samples_split=2, min_samples_leaf=1, min_info_gain=0.0):
+        self.default = default
+        self.max_depth = max_depth
+        self.min_samples_split = min_samples_split
+        self.min_samples_leaf = min_samples_leaf
+        self.min_info_gain = min_info_gain
+        self.root = Node()
+        self.root.add_label(default)
+        self.attributes = None
+        self._lookups = None
+        self._class_lookup = {}
+        self._matrix = None
+        self._y = np.empty(0, dtype=np.uint8)
+        self._n = 0
+        # node: (count table, the cardinalities it was counted with, class counts)
+        self._counts = {}
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def data(self) -> EncodedDataset:
+        '''
+        Every example seen so far, encoded as dataset.encode would encode them.
+        '''
+        return EncodedDataset(self._matrix[:self._n], self._y[:self._n], self.attributes,
+                              [list(lookup) for lookup in self._lookups], list(self._class_lookup))
+
+    def update(self, examples, stats=None) -> Node:
+        '''
+        Adds examples (a list of example dictionaries, or an EncodedDataset
+        with no numeric attributes) to the tree and returns its root.
+
+        stats, a profiling.TrainingStats, times the phases encode, count and
+        grow, and counts the nodes_updated, the subtrees_grown and the
+        rows_scanned for counts.
+        '''
+        if stats is None:
+            stats = NO_STATS
+        with stats.phase('encode'):
+            new = self._append(examples)
+        if len(new) == 0:
+            return self.root
+        self._update(self.root, self.data, new, list(range(len(self.attributes))), (), 0, stats)
+        return self.root
+
+    def _append(self, examples) -> np.ndarray:
+        '''
+        Encodes examples onto the end of the stored rows, giving new values the
+        next codes in order of first appearance.  Returns the new row numbers.
+        '''
+        if isinstance(examples, EncodedDataset):
+            if any(examples.numeric):
+                raise ValueError("incremental trees only handle categorical attributes")
+            attributes = examples.attributes
+            n = len(examples)
+        else:
+            attributes = [a for a in examples[0].keys() if a != CLASS] if examples else None
+            n = len(examples)
+        if n == 0:
+            return np.empty(0, dtype=np.intp)
+        if self.attributes is None:
+            self.attributes = attributes
+            self._lookups = [{MISSING: MISSING_CODE} for _ in attributes]
+            self._matrix = np.empty((0, len(attributes)), dtype=np.uint8, order='F')
+
+        columns = np.empty((n, len(self.attributes)), dtype=np.intp)
+        if isinstance(examples, EncodedDataset):
+            for j, a in enumerate(self.attributes):
+                k = examples.attributes.index(a)
+                codes = examples.matrix[:, k]
+                recode = np.zeros(len(examples.tables[k]), dtype=np.intp)
+                present, first = np.unique(codes, return_index=True)
+                for code in present[np.argsort(first)]:
+                    recode[code] = self._lookups[j].setdefault(examples.tables[k][code], len(self._lookups[j]))
+                columns[:, j] = recode[codes]
+            class_recode = np.zeros(len(examples.classes), dtype=np.intp)
+            present, first = np.unique(examples.y, return_index=True)
+            for code in present[np.argsort(first)]:
+                class_recode[code] = self._class_lookup.setdefault(examples.classes[code], len(self._class_lookup))
+            y = class_recode[examples.y]
+        else:
+            y = np.empty(n, dtype=np.intp)
+            for i, e in enumerate(examples):
+                for j, a in enumerate(self.attributes):
+                    lookup = self._lookups[j]
+                    code = lookup.get(e[a])
+                    if code is None:
+                        code = lookup[e[a]] = len(lookup)
+                    columns[i, j] = code
+                code = self._class_lookup.get(e[CLASS])
+                if code is None:
+                    code = self._class_lookup[e[CLASS]] = len(self._class_lookup)
+                y[i] = code
+
+        # Grow the stores geometrically, widening the codes when a column outgrows them
+        dtype = code_dtype(max(len(lookup) for lookup in self._lookups))
+        size = self._n + n
+        if size > len(self._matrix) or np.dtype(dtype).itemsize > self._matrix.dtype.itemsize:
+            capacity = max(size, 2 * len(self._matrix))
+            matrix = np.empty((capacity, len(self.attributes)), dtype=max(dtype, self._matrix.dtype,
+                                                                           key=lambda t: np.dtype(t).itemsize),
+                              order='F')
+            matrix[:self._n] = self._matrix[:self._n]
+            self._matrix = matrix
+        class_dtype = code_dtype(len(self._class_lookup))
+        if size > len(self._y) or np.dtype(class_dtype).itemsize > self._y.dtype.itemsize:
+            labels = np.empty(max(size, 2 * len(self._y)), dtype=max(class_dtype, self._y.dtype,
+                                                                      key=lambda t: np.dtype(t).itemsize))
+            labels[:self._n] = self._y[:self._n]
+            self._y = labels
+        self._matrix[self._n:size] = columns
+        self._y[self._n:size] = y
+        self._n = size
+        return np.arange(size - n, size, dtype=np.intp)
+
+    def _reaching(self, data, path) -> np.ndarray:
+        '''
+        Returns the rows that reach the node at the end of path, a sequence of
+        (attribute, code) decisions from the root, in order.
+        '''
+        mask = np.ones(len(data), dtype=bool)
+        for a, code in path:
+            mask &= data.matrix[:, a] == code
+        return np.flatnonzero(mask)
+
+    def _table(self, data, node, attrs, new, path, stats):
+        '''
+        Adds the new rows, which reach node, to its count table and returns the
+        table, laid out as by columnar.count_table, the attributes' current
+        cardinalities and the node's class counts.  A node that has no table
+        yet, because it was grown since the last update reached it, counts all
+        the rows that reach it instead.
+        '''
+        cards = data.cardinalities()[attrs]
+        if node in self._counts:
+            rows = new
+            table, counted_cards, class_counts = self._counts[node]
+            if table.shape[1] < data.n_classes or not np.array_equal(counted_cards, cards):
+                # Values or classes have appeared since the table was counted
+                padded = np.zeros((int(cards.sum()), data.n_classes), dtype=np.intp)
+                starts = np.concatenate(([0], np.cumsum(cards)[:-1])).astype(np.intp)
+                counted_starts = np.concatenate(([0], np.cumsum(counted_cards)[:-1])).astype(np.intp)
+                for start, counted_start, card in zip(starts, counted_starts, counted_cards):
+                    padded[start:start + card, :table.shape[1]] = table[counted_start:counted_start + card]
+                table = padded
+                class_counts = np.pad(class_counts, (0, data.n_classes - len(class_counts)))
+        else:
+            rows = self._reaching(data, path)
+            table = np.zeros((int(cards.sum()), data.n_classes), dtype=np.intp)
+            class_counts = np.zeros(data.n_classes, dtype=np.intp)
+        if attrs:
+            with stats.phase('count'):
+                table += columnar.count_table(data, rows, attrs, cards)
+            stats.count('rows_scanned', len(rows) * len(attrs))
+        class_counts += np.bincount(data.y[rows], minlength=data.n_classes)
+        self._counts[node] = (table, cards, class_counts)
+        return table, cards, class_counts
+
+    def _choose(self, table, cards, attrs, class_counts, depth):
+        '''
+        Returns the position in attrs of the attribute columnar.build splits a
+        node with this count table on, or None if it makes the node a leaf.
+        '''
+        if not attrs or np.count_nonzero(class_counts) <= 1 or class_counts.sum() < self.min_samples_split \
+                or (self.max_depth is not None and depth >= self.max_depth):
+            return None
+        gains = columnar.info_gains(table, cards)
+        if self.min_samples_leaf > 1:
+            values = table.sum(axis=1)
+            small = (values > 0) & (values < self.min_samples_leaf)
+            starts = np.concatenate(([0], np.cumsum(cards)[:-1])).astype(np.intp)
+            gains[np.add.reduceat(small, starts) > 0] = -np.inf
+        best = columnar.first_best(gains)
+        if gains[best] == -np.inf or gains[best] < self.min_info_gain - columnar.GAIN_TOLERANCE:
+            return None
+        return best
+
+    def _label(self, data, node, class_counts, path):
+        # Ties go to the class seen first among the node's rows, as in build
+        best = class_counts.argmax()
+        if np.count_nonzero(class_counts == class_counts[best]) == 1:
+            code = int(best)
+        else:
+            rows = self._reaching(data, path)
+            code = columnar.majority(data.y[rows], data.n_classes)
+        node.add_label(data.classes[code])
+
+    def _forget(self, node):
+        # Drops the count tables of node's subtree
+        self._counts.pop(node, None)
+        for child in node.children.values():
+            self._forget(child)
+
+    def _grow(self, node, data, rows, attrs, depth, table, stats):
+        '''
+        Grows node again from scratch over rows with columnar.build, which
+        starts from node's count table if it is given.  The nodes below count
+        their tables when an update first reaches them.
+        '''
+        stats.count('subtrees_grown')
+        for child in node.children.values():
+            self._forget(child)
+        limits = dict(min_samples_split=self.min_samples_split, min_samples_leaf=self.min_samples_leaf,
+                      min_info_gain=self.min_info_gain,
+                      max_depth=None if self.max_depth is None else self.max_depth - depth)
+        with stats.phase('grow'):
+            grown = columnar.build(data, rows, attrs, self.default, table=table if len(attrs) else None, **limits)
+        node.label, node.decision_label, node.children = grown.label, grown.decision_label, grown.children
+
+    def _update(self, node, data, new, attrs, path, depth, stats):
+        '''
+        Adds the new rows, which reach node, to its subtree.
+        '''
+        stats.count('nodes_updated')
+        table, cards, class_counts = self._table(data, node, attrs, new, path, stats)
+        best = self._choose(table, cards, attrs, class_counts, depth)
+        split_on = None if node.decision_label is None else data.attributes.index(node.decision_label)
+        if best is None and split_on is None:
+            self._label(data, node, class_counts, path)
+            return
+        if best is None or attrs[best] != split_on:
+            # The best split changed: only this subtree is grown again
+            self._grow(node, data, self._reaching(data, path), attrs, depth, table, stats)
+            return
+        self._label(data, node, class_counts, path)
+        remaining = [a for a in attrs if a != split_on]
+        for code, child_rows in columnar.partition(data.matrix[new, split_on], new):
+            value = data.tables[split_on][code]
+            child = node.children.get(value)
+            if child is None:
+                # A value the node has not seen: all its rows are new
+                child = node.children[value] = Node()
+                self._grow(child, data, child_rows, remaining, depth + 1, None, stats)
+            else:
+                self._update(child, data, child_rows, remaining, path + ((split_on, code),), depth + 1, stats)
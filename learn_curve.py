@@ -1,69 +1,196 @@
-import random
-import matplotlib.pyplot as plt
+import compiled
+import json
+import multiprocessing
+import os
 import numpy as np
-from ID3 import *
-from pprint import pprint
+import parse
+from ID3 import ID3, as_dataset, prune, test
 
-def learning_curve(data, train_sizes=list(range(10, 310, 20)), num_runs=100):
+validation_ratio = 0.1  # 10% for validation
+test_ratio = 0.2        # 20% for testing
 
-    accuracies_with_pruning = []
-    accuracies_without_pruning = []
+# The dataset seen by pool workers.  It is set before a fork-based pool starts,
+# so workers inherit it instead of receiving a copy with every task.
+_worker_data = None
 
+def _init_worker(data):
+    global _worker_data
+    _worker_data = data
+
+def _run_worker(args):
+    return args, run_task(_worker_data, *args)
+
+def task_seed(seed, size, run):
+    '''
+    The seed of one (size, run) cell of the grid; it depends on nothing else, so
+    a cell gives the same result in any process and in any order.
+    '''
+    return np.random.SeedSequence([seed, size, run])
+
+def run_task(data, size, run, seed, default):
+    '''
+    Trains one tree on `size` random rows of an EncodedDataset and returns its
+    test accuracy without and with pruning, or None if size leaves too few rows
+    for the validation and test sets.  The split is a seeded permutation of row
+    indices; data itself is never reordered.
+    '''
     total_data_size = len(data)
-    validation_ratio = 0.1  # 10% for validation
-    test_ratio = 0.2        # 20% for testing
+    validation_size = int(validation_ratio * total_data_size)
+    test_size = int(test_ratio * total_data_size)
+    if size + validation_size + test_size > total_data_size:
+        return None
+
+    order = np.random.default_rng(task_seed(seed, size, run)).permutation(total_data_size)
+    train_data = data[order[:size]]
+    validation_data = data[order[size:size + validation_size]]
+    test_data = data[order[size + validation_size:size + validation_size + test_size]]
+
+    # Train tree without pruning; compiling it makes cloning a few array copies
+    tree = compiled.compile_tree(ID3(train_data, default=default))
+    acc_without_pruning = test(tree.root(), test_data)
+
+    # Train tree with pruning
+    pruned_tree = tree.copy().root()
+    prune(pruned_tree, validation_data)
+    return acc_without_pruning, test(pruned_tree, test_data)
 
-    for size in train_sizes:
-        acc_with_pruning = []
-        acc_without_pruning = []
+def _read_checkpoint(path, config):
+    '''
+    Returns {(size, run): result} for the cells already recorded in a checkpoint
+    file, which must have been written for the same config.
 
-        for i in range(num_runs):
-            # Shuffle data
-            random.shuffle(data)
+    A run killed while writing can leave a last line that is cut short.  That
+    line is dropped, and cut off the file so that new cells start on a line of
+    their own; its cell is simply run again.
+    '''
+    done = {}
+    if not path or not os.path.exists(path):
+        return done
+    with open(path, 'rb') as f:
+        content = f.read()
+    # Whatever follows the last newline was cut short
+    kept = content.split(b'\n')[:-1]
+    lines = []
+    for i, line in enumerate(kept):
+        if not line.strip():
+            continue
+        try:
+            lines.append(json.loads(line))
+        except ValueError:
+            if i < len(kept) - 1:
+                raise
+            kept.pop()
+    if lines and lines[0] != config:
+        raise ValueError(f"checkpoint {path} was written for a different learning curve: {lines[0]}")
+    size = sum(len(line) + 1 for line in kept)
+    if size < len(content):
+        with open(path, 'r+b') as f:
+            f.truncate(size)
+    for cell in lines[1:]:
+        done[(cell['size'], cell['run'])] = cell['result'] and tuple(cell['result'])
+    return done
 
-            # Calculate sizes
-            validation_size = int(validation_ratio * total_data_size)
-            test_size = int(test_ratio * total_data_size)
-            train_size = size
+def confidence_interval(accuracies, z=1.96):
+    '''
+    Mean and normal-approximation confidence interval (95% by default) of each row
+    of a sizes x runs matrix, ignoring NaN cells.  Rows with no runs give NaN.
+    '''
+    valid = ~np.isnan(accuracies)
+    counts = valid.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(valid, accuracies, 0).sum(axis=1) / counts
+        deviations = np.where(valid, accuracies - mean[:, None], 0)
+        spread = np.sqrt((deviations ** 2).sum(axis=1) / (counts - 1) / counts)
+    spread = np.where(counts > 1, spread, np.nan)
+    return mean, mean - z * spread, mean + z * spread
 
-            # Ensure we don't exceed the data size
-            if train_size + validation_size + test_size > total_data_size:
-                continue  # Skip this iteration
+def learning_curve(data, train_sizes=list(range(10, 310, 20)), num_runs=100, default='democrat',
+                   seed=0, n_jobs=1, checkpoint=None):
+    '''
+    Measures test accuracy with and without pruning over a grid of training sizes
+    and num_runs random splits per size.  Every (size, run) cell is an independent
+    task seeded from (seed, size, run); with n_jobs > 1 (or None for every core)
+    they run in a process pool.  If checkpoint names a file, each finished cell is
+    appended to it and cells already there are not run again, so an interrupted
+    sweep resumes where it stopped.
 
-            # Split data
-            train_data = data[:train_size]
-            validation_data = data[train_size:train_size + validation_size]
-            test_data = data[train_size + validation_size:train_size + validation_size + test_size]
+    Returns a dict of arrays: train_sizes, the sizes x runs accuracy matrices
+    without_pruning and with_pruning (NaN for skipped cells), and for each of
+    them the mean and 95% confidence bounds per size.
+    '''
+    global _worker_data
+    data = as_dataset(data)
+    train_sizes = list(train_sizes)
+    config = {'train_sizes': train_sizes, 'num_runs': num_runs, 'seed': seed,
+              'default': default, 'rows': len(data)}
+    done = _read_checkpoint(checkpoint, config)
+    tasks = [(size, run, seed, default) for size in train_sizes for run in range(num_runs)
+             if (size, run) not in done]
 
-            # Train tree without pruning
-            tree = ID3(train_data, default='democrat')
-            acc_without_pruning.append(test(tree, test_data))
+    log = None
+    if checkpoint:
+        log = open(checkpoint, 'a')
+        if not done and os.path.getsize(checkpoint) == 0:
+            log.write(json.dumps(config) + '\n')
+    try:
+        def record(task, result):
+            done[task[:2]] = result
+            if log:
+                log.write(json.dumps({'size': task[0], 'run': task[1], 'result': result}) + '\n')
+                log.flush()
 
-            # Train tree with pruning
-            pruned_tree = copy.deepcopy(tree)
-            prune(pruned_tree, validation_data)
-            acc_with_pruning.append(test(pruned_tree, test_data))
+        n_jobs = n_jobs or multiprocessing.cpu_count()
+        if n_jobs == 1 or len(tasks) <= 1:
+            for task in tasks:
+                record(task, run_task(data, *task))
+        else:
+            if 'fork' in multiprocessing.get_all_start_methods():
+                # Forked workers inherit _worker_data from this process's memory
+                _worker_data = data
+                pool = multiprocessing.get_context('fork').Pool(n_jobs)
+            else:
+                pool = multiprocessing.Pool(n_jobs, _init_worker, (data,))
+            with pool:
+                for task, result in pool.imap_unordered(_run_worker, tasks, chunksize=4):
+                    record(task, result)
+    finally:
+        _worker_data = None
+        if log:
+            log.close()
 
-        # Calculate average accuracies for this training size
-        avg_acc_without = np.mean(acc_without_pruning) if acc_without_pruning else 0
-        avg_acc_with = np.mean(acc_with_pruning) if acc_with_pruning else 0
+    accuracies = np.full((2, len(train_sizes), num_runs), np.nan)
+    for i, size in enumerate(train_sizes):
+        for run in range(num_runs):
+            if done.get((size, run)) is not None:
+                accuracies[:, i, run] = done[(size, run)]
 
-        # Store the average accuracies
-        accuracies_without_pruning.append(avg_acc_without)
-        accuracies_with_pruning.append(avg_acc_with)
+    results = {'train_sizes': np.array(train_sizes)}
+    for name, acc in zip(['without_pruning', 'with_pruning'], accuracies):
+        mean, low, high = confidence_interval(acc)
+        results.update({name: acc, name + '_mean': mean, name + '_low': low, name + '_high': high})
+    return results
 
-    # Plot learning curves
+def plot_learning_curve(results, path="./learning_curve.png"):
+    '''
+    Plots the mean accuracies (with their confidence bands) returned by
+    learning_curve and saves the figure to path.
+    '''
+    # matplotlib is only imported when a plot is drawn
+    import matplotlib.pyplot as plt
+    train_sizes = results['train_sizes']
     plt.figure(figsize=(10, 6))
-    plt.plot(train_sizes, accuracies_with_pruning, label='With Pruning', marker='o')
-    plt.plot(train_sizes, accuracies_without_pruning, label='Without Pruning', marker='o')
+    for name, label in [('with_pruning', 'With Pruning'), ('without_pruning', 'Without Pruning')]:
+        plt.plot(train_sizes, results[name + '_mean'], label=label, marker='o')
+        plt.fill_between(train_sizes, results[name + '_low'], results[name + '_high'], alpha=0.2)
     plt.xlabel('Number of Training Examples')
     plt.ylabel('Accuracy on Test Data')
     plt.title('Learning Curve: Accuracy vs. Training Size')
     plt.legend()
     plt.grid(True)
-    plt.savefig("./learning_curve.png")
+    plt.savefig(path)
     plt.close()
 
 if __name__ == "__main__":
-    data = parse.parse("house_votes_84.data")
-    learning_curve(data)
+    data = parse.load("house_votes_84.data", cache=True)
+    results = learning_curve(data, n_jobs=None, checkpoint="learning_curve.checkpoint.jsonl")
+    plot_learning_curve(results)
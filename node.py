@@ -1,14 +1,36 @@
+# Child keys of a node that splits a numeric attribute at its threshold
+AT_MOST = '<='
+ABOVE = '>'
+
 class Node:
+  # No per-instance __dict__: trees can hold millions of nodes
+  __slots__ = ('label', 'children', 'decision_label', 'threshold', 'distribution')
+
   def __init__(self):
     self.label = None
     self.children = {}
     self.decision_label = None
+    # None for a categorical split, which has a child per value; a numeric
+    # split has the children AT_MOST and ABOVE the threshold
+    self.threshold = None
+    # In a tree grown with missing="weighted", the {class: weight} of the
+    # training rows that reached the node; None otherwise
+    self.distribution = None
   
   def add_label(self, label):
     self.label = label
   def add_decision_label(self, label):
     self.decision_label = label
 
+def branch(node, value):
+  '''
+  Returns the key of the child of node that an example with this value of its
+  decision attribute goes to.  A missing value "?" goes AT_MOST a threshold.
+  '''
+  if node.threshold is None:
+    return value
+  return AT_MOST if value == '?' or float(value) <= node.threshold else ABOVE
+
  
     
 
@@ -1,4 +1,9 @@
 import csv
+import hashlib
+import itertools
+import os
+import numpy as np
+import dataset
 
 def parse(filename):
   '''
@@ -8,14 +13,132 @@ def parse(filename):
 
   out = []  
   # note: you may need to add encoding="utf-8" as a parameter
-  csvfile = open(filename,'r')
-  fileToRead = csv.reader(csvfile)
+  with open(filename,'r') as csvfile:
+    fileToRead = csv.reader(csvfile)
 
-  headers = next(fileToRead)
+    headers = next(fileToRead)
 
-  # iterate through rows of actual data
-  for row in fileToRead:
-    out.append(dict(zip(headers, row)))
+    # iterate through rows of actual data
+    for row in fileToRead:
+      out.append(dict(zip(headers, row)))
 
   return out
 
+def _codes(column, lookup, table, convert):
+  '''
+  Maps a column of raw tokens to integer codes, extending lookup (token -> code)
+  and table (code -> value) with tokens not seen before, in order of first appearance.
+  '''
+  tokens, first, inverse = np.unique(column, return_index=True, return_inverse=True)
+  mapping = np.empty(len(tokens), dtype=np.intp)
+  for k in np.argsort(first):
+    token = str(tokens[k])
+    code = lookup.get(token)
+    if code is None:
+      code = lookup[token] = len(table)
+      table.append(token if convert is None or token == dataset.MISSING else convert(token))
+    mapping[k] = code
+  return mapping[inverse.ravel()]
+
+def iter_chunks(filename, chunk_size=65536, convert=None):
+  '''
+  Streams a CSV data file as a sequence of EncodedDatasets of at most chunk_size
+  rows each, without ever holding the whole file.  The category tables are built
+  as the file is read and are shared by every chunk: they only grow, so a code
+  keeps its meaning in later chunks.  convert, if given, is applied once to each
+  distinct token (for example int); "?" is kept as the missing value.
+  '''
+  with open(filename, 'r', newline='') as csvfile:
+    fileToRead = csv.reader(csvfile)
+    headers = next(fileToRead)
+    class_index = headers.index(dataset.CLASS)
+    columns = [i for i in range(len(headers)) if i != class_index]
+    attributes = [headers[i] for i in columns]
+    lookups = [{dataset.MISSING: dataset.MISSING_CODE} for _ in attributes]
+    tables = [[dataset.MISSING] for _ in attributes]
+    class_lookup, classes = {}, []
+
+    while True:
+      rows = [row for row in itertools.islice(fileToRead, chunk_size) if row]
+      if not rows:
+        return
+      block = np.array(rows, dtype=str)
+      matrix = np.empty((len(rows), len(attributes)),
+                        dtype=dataset.code_dtype(max((len(t) for t in tables), default=1) + len(rows)),
+                        order='F')
+      for j, i in enumerate(columns):
+        matrix[:, j] = _codes(block[:, i], lookups[j], tables[j], convert)
+      y = _codes(block[:, class_index], class_lookup, classes, convert)
+      yield dataset.EncodedDataset(matrix, y.astype(dataset.code_dtype(len(classes))),
+                                   attributes, tables, classes)
+
+def cache_path(filename, cache_dir=None):
+  '''
+  Returns where the binary cache of a data file lives: next to it as
+  <filename>.cache, or inside cache_dir under a name derived from its full path.
+  '''
+  if cache_dir is None:
+    return filename + '.cache'
+  source = os.path.abspath(filename)
+  digest = hashlib.sha1(source.encode('utf-8')).hexdigest()[:16]
+  return os.path.join(cache_dir, f"{os.path.basename(source)}.{digest}.cache")
+
+def cache_key(filename, convert=None, numeric=(), bins=None):
+  '''
+  Identifies a data file's current contents and how it was decoded; a cache
+  saved under a different key is stale.
+  '''
+  info = os.stat(filename)
+  return {'source': os.path.abspath(filename), 'mtime_ns': info.st_mtime_ns, 'size': info.st_size,
+          'convert': None if convert is None else getattr(convert, '__qualname__', repr(convert)),
+          'numeric': list(numeric), 'bins': bins}
+
+def load(filename, chunk_size=65536, convert=None, cache=False, cache_dir=None, numeric=(), bins=None):
+  '''
+  Reads a whole CSV data file into one EncodedDataset, streaming it in chunks so
+  only compact code arrays are ever held.  See iter_chunks.  The attributes
+  listed in numeric are then made numeric, optionally in bins quantile buckets;
+  see dataset.as_numeric.
+
+  With cache=True (implied by cache_dir), the encoded data is also saved to a
+  binary cache file (see cache_path), and later loads memory-map that file
+  instead of parsing the CSV again for as long as the file's path, size and
+  modification time are unchanged.
+  '''
+  if cache or cache_dir is not None:
+    path = cache_path(filename, cache_dir)
+    key = cache_key(filename, convert, numeric, bins)
+    data = dataset.open_saved(path, key)
+    if data is None:
+      data = _read(filename, chunk_size, convert, numeric, bins)
+      try:
+        if cache_dir is not None:
+          os.makedirs(cache_dir, exist_ok=True)
+        dataset.save(data, path, key)
+      except OSError:
+        return data  # an unwritable cache location only costs the speedup
+      data = dataset.open_saved(path, key)
+    return data
+  return _read(filename, chunk_size, convert, numeric, bins)
+
+def _read(filename, chunk_size, convert, numeric=(), bins=None):
+  chunks = list(iter_chunks(filename, chunk_size, convert))
+  if not chunks:
+    with open(filename, 'r', newline='') as csvfile:
+      headers = next(csv.reader(csvfile))
+    attributes = [h for h in headers if h != dataset.CLASS]
+    data = dataset.EncodedDataset(np.empty((0, len(attributes)), dtype=np.uint8, order='F'),
+                                  np.empty(0, dtype=np.uint8), attributes,
+                                  [[dataset.MISSING] for _ in attributes], [])
+    return dataset.as_numeric(data, numeric) if numeric else data
+  last = chunks[-1]
+  matrix = np.empty((sum(len(c) for c in chunks), len(last.attributes)),
+                    dtype=dataset.code_dtype(max((len(t) for t in last.tables), default=1)),
+                    order='F')
+  start = 0
+  for c in chunks:
+    matrix[start:start + len(c)] = c.matrix
+    start += len(c)
+  y = np.concatenate([c.y for c in chunks]).astype(dataset.code_dtype(len(last.classes)))
+  data = dataset.EncodedDataset(matrix, y, last.attributes, last.tables, last.classes)
+  return dataset.as_numeric(data, numeric, bins) if numeric else data
@@ -0,0 +1,224 @@
+import json
+import marshal
+import sys
+import time
+import tracemalloc
+
+try:
+  import resource
+except ImportError:
+  # Windows has no getrusage; peak resident memory then reads as 0
+  resource = None
+
+# Where phases appear in cProfile-format output, in place of a source file
+PHASE_FILE = 'training'
+
+
+def _rss_bytes():
+  if resource is None:
+    return 0
+  # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class _Phase:
+  __slots__ = ('stats', 'name', 'start', 'children', 'rss', 'traced', 'traced_peak')
+
+  def __init__(self, stats, name):
+    self.stats = stats
+    self.name = name
+
+  def __enter__(self):
+    self.stats._enter(self)
+    return self
+
+  def __exit__(self, *exc):
+    self.stats._exit(self)
+    return False
+
+
+class TrainingStats:
+  '''
+  Opt-in instrumentation for ID3.ID3, ID3.prune and randomForest.train: pass an
+  instance as their stats argument and it collects
+
+    phases    per named phase of the work, the calls, the wall time including
+              and excluding nested phases, and the memory high-water mark: how
+              far the phase raised the process's peak resident memory (0 where
+              the resource module is missing, as on Windows), and, if
+              tracemalloc is tracing, the peak of memory it allocated
+    counters  event counts, such as nodes, splits and rows scanned
+
+  Phases nest, and a phase that recurses into itself is timed once, from its
+  outermost call, as cProfile does.  The results export as JSON (as_dict,
+  save_json) or in cProfile's format (dump_stats, or pstats.Stats(stats)), each
+  phase standing in for a function.  Without an instance the code paths use
+  NO_STATS, which does nothing.
+  '''
+  def __init__(self):
+    # name: [calls, outermost calls, seconds, own seconds, rss growth, traced peak]
+    self.phases = {}
+    # (caller, name): [calls, outermost calls, seconds, own seconds]
+    self.callers = {}
+    self.counters = {}
+    self.peak_rss = 0
+    self._stack = []
+    self._active = {}
+
+  def phase(self, name):
+    '''
+    Returns a context manager that times the code under it as phase name.
+    '''
+    return _Phase(self, name)
+
+  def count(self, name, n=1):
+    '''
+    Adds n to counter name.
+    '''
+    self.counters[name] = self.counters.get(name, 0) + n
+
+  def _enter(self, frame):
+    frame.children = 0.0
+    frame.rss = _rss_bytes()
+    frame.traced = None
+    if tracemalloc.is_tracing():
+      current, peak = tracemalloc.get_traced_memory()
+      if self._stack and self._stack[-1].traced is not None:
+        parent = self._stack[-1]
+        parent.traced_peak = max(parent.traced_peak, peak)
+      tracemalloc.reset_peak()
+      frame.traced, frame.traced_peak = current, current
+    self._stack.append(frame)
+    self._active[frame.name] = self._active.get(frame.name, 0) + 1
+    frame.start = time.perf_counter()
+
+  def _exit(self, frame):
+    elapsed = time.perf_counter() - frame.start
+    self._stack.pop()
+    self._active[frame.name] -= 1
+    outermost = self._active[frame.name] == 0
+    own = elapsed - frame.children
+    rss = _rss_bytes()
+    self.peak_rss = max(self.peak_rss, rss)
+    traced = 0
+    if frame.traced is not None and tracemalloc.is_tracing():
+      peak = max(tracemalloc.get_traced_memory()[1], frame.traced_peak)
+      tracemalloc.reset_peak()
+      traced = peak - frame.traced
+    entry = self.phases.get(frame.name)
+    if entry is None:
+      entry = self.phases[frame.name] = [0, 0, 0.0, 0.0, 0, 0]
+    entry[0] += 1
+    entry[3] += own
+    entry[4] = max(entry[4], rss - frame.rss)
+    entry[5] = max(entry[5], traced)
+    if outermost:
+      entry[1] += 1
+      entry[2] += elapsed
+    if self._stack:
+      parent = self._stack[-1]
+      parent.children += elapsed
+      if frame.traced is not None and parent.traced is not None:
+        parent.traced_peak = max(parent.traced_peak, frame.traced + traced)
+      edge = self.callers.get((parent.name, frame.name))
+      if edge is None:
+        edge = self.callers[(parent.name, frame.name)] = [0, 0, 0.0, 0.0]
+      edge[0] += 1
+      edge[3] += own
+      if outermost:
+        edge[1] += 1
+        edge[2] += elapsed
+
+  def merge(self, other):
+    '''
+    Adds the phases and counters of other, such as the stats a pool worker
+    collected, into these.  Times add up, so phases that ran in parallel can
+    total more than the wall time; memory marks take the larger.
+    '''
+    for name, (calls, outer, seconds, own, rss, traced) in other.phases.items():
+      entry = self.phases.setdefault(name, [0, 0, 0.0, 0.0, 0, 0])
+      entry[:4] = [entry[0] + calls, entry[1] + outer, entry[2] + seconds, entry[3] + own]
+      entry[4], entry[5] = max(entry[4], rss), max(entry[5], traced)
+    for key, values in other.callers.items():
+      edge = self.callers.setdefault(key, [0, 0, 0.0, 0.0])
+      edge[:] = [a + b for a, b in zip(edge, values)]
+    for name, n in other.counters.items():
+      self.count(name, n)
+    self.peak_rss = max(self.peak_rss, other.peak_rss)
+
+  def __getstate__(self):
+    # Only the results travel between processes, never an open phase
+    return {'phases': self.phases, 'callers': self.callers, 'counters': self.counters,
+            'peak_rss': self.peak_rss}
+
+  def __setstate__(self, state):
+    self.__dict__.update(state, _stack=[], _active={})
+
+  def as_dict(self) -> dict:
+    '''
+    Returns the results as JSON-serializable dictionaries, memory in megabytes.
+    '''
+    mb = 1 << 20
+    return {
+      'phases': {name: {'calls': calls, 'seconds': seconds, 'own_seconds': own,
+                        'rss_growth_mb': rss / mb, 'traced_peak_mb': traced / mb}
+                 for name, (calls, _, seconds, own, rss, traced) in self.phases.items()},
+      'callers': [{'caller': caller, 'phase': name, 'calls': calls, 'seconds': seconds}
+                  for (caller, name), (calls, _, seconds, _) in self.callers.items()],
+      'counters': dict(self.counters),
+      'peak_rss_mb': self.peak_rss / mb,
+    }
+
+  def save_json(self, path):
+    with open(path, 'w') as f:
+      json.dump(self.as_dict(), f, indent=1)
+
+  def create_stats(self):
+    '''
+    Sets self.stats to the phases in the format of cProfile.Profile.stats, which
+    is what lets pstats.Stats take this object directly.
+    '''
+    def key(name):
+      return (PHASE_FILE, 0, name)
+    callers = {}
+    for (caller, name), (calls, outer, seconds, own) in self.callers.items():
+      callers.setdefault(name, {})[key(caller)] = (outer, calls, own, seconds)
+    self.stats = {key(name): (outer, calls, own, seconds, callers.get(name, {}))
+                  for name, (calls, outer, seconds, own, _, _) in self.phases.items()}
+
+  def dump_stats(self, path):
+    '''
+    Writes the phases to path in cProfile's file format, for pstats and the
+    tools that read profiles.
+    '''
+    self.create_stats()
+    with open(path, 'wb') as f:
+      marshal.dump(self.stats, f)
+
+
+class _NoPhase:
+  __slots__ = ()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+
+class _NoStats:
+  '''
+  Stands in for a TrainingStats when none is given; records nothing.
+  '''
+  __slots__ = ()
+  _phase = _NoPhase()
+
+  def phase(self, name):
+    return self._phase
+
+  def count(self, name, n=1):
+    pass
+
+
+NO_STATS = _NoStats()
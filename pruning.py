@@ -0,0 +1,226 @@
+'''
+Cost-complexity pruning paths: the nested sequence of pruned trees is worked
+out once, and any level of it is then a view over the original tree.
+'''
+import heapq
+import numpy as np
+import compiled
+from dataset import EncodedDataset
+
+
+class PruningPath:
+    '''
+    The weakest-link (cost-complexity) pruning sequence of a CompiledTree.
+    Level 0 is the full tree; level k is the tree after the first k cuts, each
+    of which turns the node whose cut costs the fewest errors per decision node
+    removed into a leaf.  The last level is the root alone.
+
+    collapse[i] is the first level at which node i predicts for every example
+    that reaches it, because it or one of its ancestors has been cut; it is
+    len(self) for nodes that are never cut.  alphas[k - 1] is the errors per
+    removed decision node that cut k costs, made non-decreasing.
+
+    A level is applied with tree_at, which copies only one array, and chosen
+    for a validation set with scores or best_level, which route the set through
+    the tree once for every level together.
+    '''
+    def __init__(self, tree, collapse, alphas):
+        self.tree = tree
+        self.collapse = collapse
+        self.alphas = alphas
+
+    def __len__(self):
+        return len(self.alphas) + 1
+
+    def tree_at(self, level: int) -> compiled.CompiledTree:
+        '''
+        Returns the tree pruned to level as a CompiledTree that shares every
+        array but feature with the original, so the original is left as it is.
+        Copy it before modifying it.
+        '''
+        tree = self.tree
+        feature = np.where(self.collapse <= level, -1, tree.feature).astype(compiled.INDEX)
+        return compiled.CompiledTree(feature, tree.offset, tree.child, tree.label, tree.attributes, tree.tables,
+                                     tree.labels, tree.cut, tree.numeric)
+
+    def level_for_alpha(self, alpha: float) -> int:
+        '''
+        Returns the most pruned level whose cuts each cost at most alpha.
+        '''
+        return int(np.searchsorted(self.alphas, alpha, side='right'))
+
+    def scores(self, examples) -> np.ndarray:
+        '''
+        Returns the accuracy of every level on examples (example dictionaries
+        or an EncodedDataset).  Each example is routed through the full tree
+        once; at a given level it stops at the first node on its route that
+        has collapsed by then, so every node on the route is right for a range
+        of levels, and the ranges are added up with one cumulative sum.
+        '''
+        n_levels = len(self)
+        if len(examples) == 0:
+            return np.zeros(n_levels)
+        matrix, y = _targets(self.tree, examples)
+        routes = _routes(self.tree, matrix)
+        on_route = routes >= 0
+        length = on_route.sum(axis=1)
+        rows, position = np.nonzero(on_route)
+        nodes = routes[rows, position]
+        collapse = np.minimum(self.collapse, n_levels)
+        # A node stops an example from the level it collapses at (from level 0
+        # if the example goes no further) until the level its parent does
+        lower = np.where(position == length[rows] - 1, 0, collapse[nodes])
+        upper = np.full(len(nodes), n_levels)
+        below_root = position > 0
+        upper[below_root] = collapse[routes[rows[below_root], position[below_root] - 1]]
+        right = (self.tree.label[nodes] == y[rows]) & (lower < upper)
+        change = np.bincount(lower[right], minlength=n_levels + 1) - np.bincount(upper[right], minlength=n_levels + 1)
+        return np.cumsum(change)[:n_levels] / len(matrix)
+
+    def best_level(self, examples) -> int:
+        '''
+        Returns the level that classifies examples best; ties go to the most
+        pruned, as in ID3.prune.
+        '''
+        scores = self.scores(examples)
+        return len(scores) - 1 - int(np.argmax(scores[::-1]))
+
+
+def _targets(tree, examples):
+    '''
+    Returns the code matrix of examples laid out for tree, and their classes as
+    codes into tree.labels, or len(tree.labels) for a class the tree never
+    predicts.
+    '''
+    codes = {label: code for code, label in enumerate(tree.labels)}
+    if isinstance(examples, EncodedDataset):
+        recode = np.array([codes.get(c, len(codes)) for c in examples.classes], dtype=np.intp)
+        y = recode[examples.y] if len(recode) else np.zeros(0, dtype=np.intp)
+    else:
+        y = np.array([codes.get(e['Class'], len(codes)) for e in examples], dtype=np.intp)
+    return tree.encode(examples), y
+
+
+def _routes(tree, matrix) -> np.ndarray:
+    '''
+    Routes every row of matrix down tree.  Returns a rows x (depth + 1) matrix
+    of the nodes each row passes through from the root, padded with -1.
+    '''
+    node = np.zeros(matrix.shape[0], dtype=np.intp)
+    active = np.arange(matrix.shape[0], dtype=np.intp)
+    routes = [node.copy()]
+    numeric = (tree.cut >= 0).any()
+    while active.size:
+        current = node[active]
+        feature = tree.feature[current]
+        internal = feature >= 0
+        active, current, feature = active[internal], current[internal], feature[internal]
+        slot = matrix[active, feature]
+        if numeric:
+            cut = tree.cut[current]
+            slot = np.where(cut >= 0, slot > cut, slot)
+        nxt = tree.child[tree.offset[current] + slot]
+        moved = nxt >= 0
+        active = active[moved]
+        node[active] = nxt[moved]
+        step = np.full(matrix.shape[0], -1, dtype=np.intp)
+        step[active] = nxt[moved]
+        routes.append(step)
+    return np.stack(routes[:-1], axis=1)
+
+
+def _structure(tree):
+    '''
+    Returns the parent (-1 for the root and for nodes a pruned tree no longer
+    reaches) and depth (-1 if unreached) of every node of tree.
+    '''
+    parent = np.full(len(tree), -1, dtype=np.intp)
+    depth = np.full(len(tree), -1, dtype=np.intp)
+    depth[0] = 0
+    # Children are numbered after their parents
+    for i in range(len(tree)):
+        j = tree.feature[i]
+        if depth[i] < 0 or j < 0:
+            continue
+        width = 2 if tree.cut[i] >= 0 else len(tree.tables[j]) + 1
+        slots = tree.child[tree.offset[i]:tree.offset[i] + width]
+        kids = slots[slots >= 0]
+        parent[kids] = i
+        depth[kids] = depth[i] + 1
+    return parent, depth
+
+
+def pruning_path(tree, examples) -> PruningPath:
+    '''
+    Computes the cost-complexity pruning path of tree (a Node tree, TreeNode
+    root or CompiledTree) with its errors counted on examples, normally the
+    training set: a node cut to a leaf predicts its label for every example
+    that reaches it.  The tree itself is not changed.  Trees grown with
+    missing="weighted" are not supported.
+    '''
+    if not isinstance(tree, compiled.CompiledTree):
+        tree = compiled.compile_tree(tree)
+    if tree.dist is not None:
+        raise ValueError("pruning paths are not computed for trees grown with missing=\"weighted\"")
+    n_nodes, width = len(tree), len(tree.labels) + 1
+    parent, depth = _structure(tree)
+    internal = (tree.feature >= 0) & (depth >= 0)
+    if len(examples):
+        matrix, y = _targets(tree, examples)
+        routes = _routes(tree, matrix)
+        visits = routes >= 0
+        passes = np.broadcast_to(y[:, None], routes.shape)[visits]
+        counts = np.bincount(routes[visits] * width + passes, minlength=n_nodes * width).reshape(n_nodes, width)
+    else:
+        counts = np.zeros((n_nodes, width), dtype=np.intp)
+    nodes = np.arange(n_nodes)
+    # Errors of each node as a leaf, and of the examples that stop at a
+    # decision node for want of a child
+    leaf_errors = (counts.sum(axis=1) - counts[nodes, tree.label]).astype(np.float64)
+    has_parent = parent >= 0
+    passed_down = np.zeros_like(counts)
+    np.add.at(passed_down, parent[has_parent], counts[has_parent])
+    stopped = counts - passed_down
+    errors = np.where(internal, stopped.sum(axis=1) - stopped[nodes, tree.label], leaf_errors).astype(np.float64)
+    inner = internal.astype(np.intp)
+    for d in range(int(depth.max()), 0, -1):
+        at = np.flatnonzero(depth == d)
+        np.add.at(errors, parent[at], errors[at])
+        np.add.at(inner, parent[at], inner[at])
+
+    def alpha(i):
+        return (leaf_errors[i] - errors[i]) / inner[i]
+
+    current = {int(i): alpha(i) for i in np.flatnonzero(internal)}
+    heap = [(a, i) for i, a in current.items()]
+    heapq.heapify(heap)
+    cut = np.zeros(n_nodes, dtype=bool)
+    collapse = np.full(n_nodes, len(current) + 1, dtype=np.intp)
+    alphas = []
+    while heap:
+        a, i = heapq.heappop(heap)
+        if cut[i] or current[i] != a:
+            continue
+        ancestors = []
+        p = parent[i]
+        while p >= 0 and not cut[p]:
+            ancestors.append(p)
+            p = parent[p]
+        if p >= 0:
+            # An ancestor was cut first
+            continue
+        alphas.append(max(a, alphas[-1]) if alphas else a)
+        collapse[i] = len(alphas)
+        cut[i] = True
+        gained, removed = leaf_errors[i] - errors[i], inner[i]
+        errors[i], inner[i] = leaf_errors[i], 0
+        for p in ancestors:
+            errors[p] += gained
+            inner[p] -= removed
+            current[p] = alpha(p)
+            heapq.heappush(heap, (current[p], p))
+    collapse = np.minimum(collapse, len(alphas) + 1)
+    for d in range(1, int(depth.max()) + 1):
+        at = np.flatnonzero(depth == d)
+        collapse[at] = np.minimum(collapse[at], collapse[parent[at]])
+    return PruningPath(tree, collapse, np.array(alphas))
@@ -1,120 +1,297 @@
 import ID3
-import random
+import columnar
+import compiled
+import dataset
+import multiprocessing
+import numpy as np
+import parse
+import profiling
+from profiling import NO_STATS
+
+# The encoded training set seen by pool workers.  It is set before a fork-based
+# pool starts, so workers inherit it without it being pickled once per tree.
+_worker_data = None
+
+def _init_worker(data):
+    global _worker_data
+    _worker_data = data
+
+def _train_worker(args):
+    seed, max_feature, default, limits, instrument = args
+    # A worker collects its own stats, which the parent merges
+    stats = profiling.TrainingStats() if instrument else None
+    return grow_tree(_worker_data, seed, max_feature, default, limits, stats) + (stats,)
+
+def grow_tree(data, seed, max_feature, default, limits=None, stats=None):
+    '''
+    Trains one forest tree on an EncodedDataset.  The rows are a bootstrap sample,
+    and every node splits on the best of a random max_feature of its attributes.
+    Both are drawn from one NumPy generator seeded with seed, so a tree depends
+    only on its seed.  limits are columnar.build's growth limits.  Returns the
+    tree and how many times each row was drawn.  stats, a
+    profiling.TrainingStats, times the phases bootstrap and build.
+    '''
+    stats = stats or NO_STATS
+    rng = np.random.default_rng(seed)
+    n = len(data)
+    with stats.phase('bootstrap'):
+        rows = rng.integers(0, n, size=n)
+        counts = np.bincount(rows, minlength=n).astype(dataset.code_dtype(n + 1))
+    with stats.phase('build'):
+        tree = columnar.build(data, rows, list(range(len(data.attributes))), default,
+                              max_features=max_feature or None, rng=rng, stats=stats, **(limits or {}))
+    return tree, counts
 
 class randomForest:
-    #initiliaze the tree and max numbers
-    def __init__(self, tree_numbers = 10, max_feature = None ):
+    #initiliaze the tree and max numbers; the growth limits and missing are those of ID3.ID3
+    def __init__(self, tree_numbers = 10, max_feature = None, n_jobs = 1, seed = None, verbose = False,
+                 max_depth = None, min_samples_split = 2, min_samples_leaf = 1, min_info_gain = 0.0,
+                 max_leaf_nodes = None, growth = 'depth', missing = 'category'):
         self.tree_numbers = tree_numbers
         self.trees = []
         self.max_feature = max_feature
+        self.n_jobs = n_jobs
+        self.seed = seed
+        self.verbose = verbose
+        self.limits = dict(max_depth = max_depth, min_samples_split = min_samples_split,
+                           min_samples_leaf = min_samples_leaf, min_info_gain = min_info_gain,
+                           max_leaf_nodes = max_leaf_nodes, growth = growth, missing = missing)
+        #encoding of the training data, shared by the compiled trees
+        self.attributes = None
+        self.tables = None
+        self.classes = None
+        self.numeric = None
+        self.labels = []
+        self._compiled = None
+        #training data and bootstrap counts, for the out-of-bag estimates
+        self._train_data = None
+        self.inbag = None
 
 
-    #random samples
-    def randomSample(self, randomExamples, attributes):
-        randomExamples = random.choices(randomExamples, k=len(randomExamples))
-        if self.max_feature:
-            sampledAttribute = random.sample(attributes, self.max_feature)
-        else:
-            sampledAttribute = attributes
-        new = []
-        #build tree with attributes
-        for example in randomExamples:
-            newExample = {}
-            for attribute in sampledAttribute:
-                value = example.get(attribute, 0)
-                newExample[attribute] = value
-
-            newExample['Class'] = example['Class']
-            new.append(newExample)
-
-        return new
     # train with decision tree
-    def train(self, randomExamples, default):
-        firstExample = randomExamples[0]
-        keys = list(firstExample.keys())
-        attributes = keys[:-1]
-        #train the tree with different samples
-        for i in range(self.tree_numbers):
-            print(f"Training: {i + 1}")
-            sample = self.randomSample(randomExamples, attributes) # get the random set
-            if not self.max_feature:
-                sampleAttributes = attributes
-            else:
-                sampleAttributes = random.sample(attributes, self.max_feature)
+    def train(self, randomExamples, default, stats = None):
+        '''
+        Trains tree_numbers trees, each on a bootstrap sample of randomExamples (a
+        list of example dictionaries or an EncodedDataset), replacing any trees
+        trained before.  Every tree gets its own child of a SeedSequence(seed), so
+        the forest is the same for any n_jobs.  With n_jobs > 1 (or None for every
+        core) the trees are trained in a process pool that shares the encoded data
+        with its workers.
+
+        The samples are index arrays into the one encoded dataset, which is kept
+        for the out-of-bag estimates: inbag[t, i] counts how often row i was drawn
+        for tree t.
 
-            trained = self.randomSample(sample, sampleAttributes)
-            #call ID3 to train
-            tree = ID3.ID3(trained, default)
+        stats, a profiling.TrainingStats, times the phases encode, and
+        bootstrap and build for each tree (see ID3.ID3), and counts trees.  Pool
+        workers collect stats of their own, which are merged in, so with n_jobs
+        > 1 the phase times add up the work of every worker; phase pool is the
+        wall time the pool took.
+        '''
+        stats = stats or NO_STATS
+        data = randomExamples
+        if not isinstance(data, dataset.EncodedDataset):
+            with stats.phase('encode'):
+                data = dataset.encode(randomExamples)
+        self.attributes, self.tables, self.classes = data.attributes, data.tables, data.classes
+        self.numeric = data.numeric
+        self.trees = []
+        self._compiled = None
+        self._train_data = data
+        inbag = []
+        seeds = np.random.SeedSequence(self.seed).spawn(self.tree_numbers)
+        tasks = [(s, self.max_feature, default, self.limits) for s in seeds]
+
+        def record(i, grown):
+            if self.verbose:
+                print(f"Training: {i + 1}")
+            tree, counts = grown[:2]
+            stats.count('trees')
             self.trees.append(tree)
+            inbag.append(counts)
+
+        n_jobs = self.n_jobs or multiprocessing.cpu_count()
+        if n_jobs == 1 or self.tree_numbers == 1:
+            for i, task in enumerate(tasks):
+                record(i, grow_tree(data, *task, stats))
+        else:
+            global _worker_data
+            processes = min(n_jobs, self.tree_numbers)
+            if 'fork' in multiprocessing.get_all_start_methods():
+                # Forked workers inherit _worker_data from this process's memory
+                _worker_data = data
+                pool = multiprocessing.get_context('fork').Pool(processes)
+            else:
+                pool = multiprocessing.Pool(processes, _init_worker, (data,))
+            instrument = stats is not NO_STATS
+            try:
+                with pool, stats.phase('pool'):
+                    for i, grown in enumerate(pool.imap(_train_worker, [t + (instrument,) for t in tasks])):
+                        record(i, grown)
+                        if instrument:
+                            stats.merge(grown[2])
+            finally:
+                _worker_data = None
+        self.inbag = np.stack(inbag) if inbag else np.zeros((0, len(data)), dtype=np.uint8)
+
+    #compile every tree onto the training data's encoding
+    def compiled_trees(self):
+        if self._compiled is None or len(self._compiled) != len(self.trees):
+            self._compiled = compiled.compile_forest(self.trees, self.attributes, self.tables, self.classes,
+                                                     self.numeric)
+            self.labels = self._compiled[0].labels if self._compiled else []
+        return self._compiled
+
+    #label codes of every tree for every example, as a trees x examples matrix
+    def votes(self, test_set):
+        trees = self.compiled_trees()
+        matrix = trees[0].encode(test_set)
+        return np.stack([tree.predict_batch(matrix) for tree in trees])
 
-    #predict using the evaluate method in ID3
+    #predict one example by majority vote
     def predict(self,randomExamples):
-            predictions = []
-            #get the all the predictions
-            for tree in self.trees:
-                print(tree)
-                prediction = ID3.evaluate(tree, randomExamples)
-                predictions.append(prediction)
-                
-            counts = {}
-            #find the most common prediction
-            for prediction in predictions:
-                counts[prediction] = counts.get(prediction,0) + 1
-            mostClass = max(counts, key = counts.get)
-
-            print(f"Prediction complete: {predictions}")
-
-            return mostClass
-    
+            return self.predictAll([randomExamples])[0]
+
     #predict method to predict all the test set
     def predictAll(self, test_set):
-        predictions = []
-        for example in test_set:
-            print("testing example: ")
-            print(example)
-            prediction = self.predict(example)
-            predictions.append(prediction)
+        '''
+        Returns the majority vote of the trees for every example in test_set (a
+        list of example dictionaries or an EncodedDataset).  Ties go to the tied
+        class that the earliest tree predicted.
+        '''
+        if len(test_set) == 0:
+            return []
+        votes = self.votes(test_set)
+        winners, _ = compiled.vote(votes, len(self.labels))
+        predictions = [self.labels[c] for c in winners]
+        if self.verbose:
+            for i in range(len(test_set)):
+                example = test_set.example(i) if isinstance(test_set, dataset.EncodedDataset) else test_set[i]
+                print("testing example: ")
+                print(example)
+                print(f"Prediction complete: {[self.labels[c] for c in votes[:, i]]}")
         return predictions
-    
+
+    #fraction of the trees voting for each class; columns follow self.labels
+    def predict_proba(self, test_set):
+        if len(test_set) == 0:
+            return np.zeros((0, len(self.labels)))
+        votes = self.votes(test_set)
+        _, counts = compiled.vote(votes, len(self.labels))
+        return counts / len(self.trees)
+
+    #majority vote of each training example's out-of-bag trees, as label codes
+    def _oob_vote(self, matrix):
+        if self._train_data is None:
+            raise ValueError("out-of-bag estimates need a forest trained in this process")
+        trees = self.compiled_trees()
+        votes = np.stack([tree.predict_batch(matrix) for tree in trees])
+        winners, counts = compiled.vote(votes, len(self.labels), self.inbag == 0)
+        return np.where(counts.sum(axis=1) > 0, winners, -1)
+
+    #accuracy of out-of-bag votes over the examples that have any
+    def _oob_accuracy(self, winners):
+        class_codes = {value: code for code, value in enumerate(self._train_data.classes)}
+        as_class = np.array([class_codes.get(label, -1) for label in self.labels])
+        voted = winners >= 0
+        if not voted.any():
+            return float('nan')
+        return float(np.mean(as_class[winners[voted]] == self._train_data.y[voted]))
+
+    def oob_predictions(self):
+        '''
+        Returns, for every training example, the majority vote of the trees whose
+        bootstrap sample left it out, or None if every tree drew it.
+        '''
+        winners = self._oob_vote(self.compiled_trees()[0].encode(self._train_data))
+        return [self.labels[c] if c >= 0 else None for c in winners]
+
+    def oob_score(self):
+        '''
+        Returns the out-of-bag accuracy: how often the out-of-bag vote of a
+        training example is its class, over the examples that have one.  It
+        estimates test accuracy without holding any data out of training.
+        '''
+        return self._oob_accuracy(self._oob_vote(self.compiled_trees()[0].encode(self._train_data)))
+
+    def permutation_importance(self, n_repeats = 1, seed = None):
+        '''
+        Returns {attribute: importance}, the mean drop in out-of-bag accuracy when
+        the attribute's column of the training data is shuffled, over n_repeats
+        shuffles.  Attributes no tree splits on score 0.
+        '''
+        trees = self.compiled_trees()
+        matrix = trees[0].encode(self._train_data)
+        baseline = self._oob_accuracy(self._oob_vote(matrix))
+        rng = np.random.default_rng(seed)
+        importance = {}
+        for j, attribute in enumerate(trees[0].attributes):
+            if not any((tree.feature == j).any() for tree in trees):
+                importance[attribute] = 0.0
+                continue
+            drops = []
+            for _ in range(n_repeats):
+                shuffled = matrix.copy(order='F')
+                shuffled[:, j] = rng.permutation(matrix[:, j])
+                drops.append(baseline - self._oob_accuracy(self._oob_vote(shuffled)))
+            importance[attribute] = float(np.mean(drops))
+        return importance
+
+    #write the forest to a binary model file
+    def save(self, path):
+        info = {'kind': 'forest', 'tree_numbers': self.tree_numbers, 'max_feature': self.max_feature,
+                'seed': self.seed, 'classes': self.classes, 'limits': self.limits}
+        compiled.save_trees(path, self.compiled_trees(), info)
+
+    #load a forest saved with save; its trees are memory-mapped, read-only
+    @classmethod
+    def load(cls, path, verbose = False):
+        trees, info = compiled.load_trees(path)
+        if info.get('kind') != 'forest':
+            raise ValueError(f"{path} does not hold a forest")
+        forest = cls(info['tree_numbers'], info['max_feature'], seed = info['seed'], verbose = verbose,
+                     **info['limits'])
+        forest._compiled = trees
+        forest.trees = [tree.root() for tree in trees]
+        forest.attributes, forest.tables, forest.numeric = trees[0].attributes, trees[0].tables, trees[0].numeric
+        forest.classes, forest.labels = info['classes'], trees[0].labels
+        return forest
+
 def evaluate(predictions, actual):
     correct = sum([1 for pred, act in zip(predictions, actual) if pred == act])
     return correct / len(actual)
 
-def read_candy_data(file_path):
-    with open(file_path, 'r') as f:
-        # Read the header
-        headers = f.readline().strip().split(',')
-
-        # Read the rest of the lines as data
-        data = []
-        for line in f:
-            values = line.strip().split(',')
-            # Create a dictionary for each row with headers as keys
-            example = {headers[i]: int(values[i]) for i in range(len(headers))}
-            data.append(example)
-
-    return data
-candy_data = read_candy_data('candy.data')
-print(candy_data[0])
-split_index = int(0.8 * len(candy_data))
-train_data = candy_data[:split_index]
-test_data = candy_data[split_index:]
-
-# Initialize and train the Random Forest
-forest = randomForest(tree_numbers=10, max_feature=5)
-forest.train(train_data, default=0)
-# Get predictions for the test set
-forest_predictions = forest.predictAll(test_data)
-print(forest_predictions)
-# Extract the actual labels from the test data
-actual_labels = [example['Class'] for example in test_data]
-
-# Evaluate ID3 single tree accuracy
-id3_tree = ID3.ID3(train_data, 0)
-id3_accuracy = ID3.test(id3_tree, test_data)
-print(f"ID3 Decision Tree Accuracy: {id3_accuracy * 100:.2f}%")
-# Evaluate Random Forest accuracy
-forest_accuracy = evaluate(forest_predictions, actual_labels)
-
-print(f"ID3 Decision Tree Accuracy: {id3_accuracy * 100:.2f}%")
-print(f"Random Forest Accuracy: {forest_accuracy * 100:.2f}%")
\ No newline at end of file
+def main():
+    '''
+    Compares a random forest against a single ID3 tree on the candy data.
+    '''
+    candy_data = parse.load('candy.data', convert=int, cache=True)
+    print(candy_data.example(0))
+    split_index = int(0.8 * len(candy_data))
+    train_data = candy_data[:split_index]
+    test_data = candy_data[split_index:]
+
+    # Initialize and train the Random Forest
+    forest = randomForest(tree_numbers=10, max_feature=5)
+    forest.train(train_data, default=0)
+    # Out-of-bag estimates come from the training data alone
+    print(f"Random Forest Out-of-Bag Accuracy: {forest.oob_score() * 100:.2f}%")
+    print("Permutation importance:", forest.permutation_importance(seed=0))
+    # Get predictions for the test set
+    forest_predictions = forest.predictAll(test_data)
+    print(forest_predictions)
+    # Extract the actual labels from the test data
+    actual_labels = test_data.labels()
+
+    # Evaluate ID3 single tree accuracy
+    id3_tree = ID3.ID3(train_data, 0)
+    id3_accuracy = ID3.test(id3_tree, test_data)
+    print(f"ID3 Decision Tree Accuracy: {id3_accuracy * 100:.2f}%")
+    # Evaluate Random Forest accuracy
+    forest_accuracy = evaluate(forest_predictions, actual_labels)
+
+    print(f"ID3 Decision Tree Accuracy: {id3_accuracy * 100:.2f}%")
+    print(f"Random Forest Accuracy: {forest_accuracy * 100:.2f}%")
+
+if __name__ == "__main__":
+    main()
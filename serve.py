@@ -0,0 +1,403 @@
+'''
+A local prediction service for a saved tree or forest, using only the standard
+library and NumPy.
+
+  python serve.py serve MODEL [--port 8080] [--unix PATH] [--window-ms 2] [--max-batch 1024]
+        loads MODEL (written by compiled.save_tree or randomForest.save) once and
+        answers HTTP requests:
+          POST /predict  {"example": {...}} -> {"prediction": label}
+                         {"examples": [{...}, ...]} -> {"predictions": [...]}
+          GET  /stats    latency percentiles, throughput and batch counters
+          GET  /health
+  python serve.py load URL DATA [--requests 2000] [--concurrency 32] [--batch 1]
+        replays the examples of a .data file against a running server from
+        concurrent keep-alive connections and reports latency and throughput.
+        URL is http://host:port or unix:PATH.
+
+Requests that arrive within the batching window of each other are scored
+together: their examples are encoded into one code matrix and every tree
+predicts it in one vectorized pass.
+'''
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import json
+import sys
+import time
+import numpy as np
+import compiled
+
+# Latencies kept for the percentiles in /stats
+LATENCY_WINDOW = 100000
+
+# Largest request or response body read, so a client cannot make the server
+# allocate whatever its Content-Length says
+MAX_BODY_BYTES = 16 << 20
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+            500: 'Internal Server Error'}
+
+
+class Predictor:
+    '''
+    A model file loaded once: its trees are memory-mapped and share one column
+    layout, so a batch of examples is encoded once for all of them.
+    '''
+    def __init__(self, path):
+        self.trees, self.info = compiled.load_trees(path)
+        self.labels = self.trees[0].labels
+
+    def predict(self, examples: list[dict]) -> list:
+        '''
+        Returns the prediction for every example: the tree's, or the forest's
+        majority vote.
+        '''
+        if not examples:
+            return []
+        matrix = self.trees[0].encode(examples)
+        if len(self.trees) == 1:
+            codes = self.trees[0].predict_batch(matrix)
+        else:
+            codes, _ = compiled.vote(np.stack([tree.predict_batch(matrix) for tree in self.trees]),
+                                     len(self.labels))
+        return [self.labels[c] for c in codes]
+
+
+class ExampleError(ValueError):
+    '''
+    Raised for a request whose own examples cannot be scored.
+    '''
+
+
+class LatencyStats:
+    '''
+    Counters of a server: requests, examples and batches served, and the
+    latency of the last LATENCY_WINDOW requests.
+    '''
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.examples = 0
+        self.batches = 0
+        self.errors = 0
+
+    def record(self, seconds, examples):
+        self.latencies.append(seconds)
+        self.requests += 1
+        self.examples += examples
+
+    def snapshot(self) -> dict:
+        uptime = time.perf_counter() - self.started
+        p50, p99 = np.percentile(self.latencies, [50, 99]) if self.latencies else (0.0, 0.0)
+        return {'requests': self.requests, 'examples': self.examples, 'batches': self.batches,
+                'errors': self.errors, 'mean_batch': self.examples / self.batches if self.batches else 0.0,
+                'p50_ms': float(p50) * 1000, 'p99_ms': float(p99) * 1000,
+                'requests_per_s': self.requests / uptime, 'examples_per_s': self.examples / uptime,
+                'uptime_s': uptime}
+
+
+class PredictionServer:
+    '''
+    Serves a Predictor over HTTP/1.1 with keep-alive.  Requests wait in a queue;
+    the batcher takes the first, keeps collecting for window seconds or until
+    max_batch examples, and scores them all with one call to predict, in a
+    worker thread so that the next batch collects meanwhile.  If that call
+    fails, each request of the batch is scored on its own, so only those whose
+    examples fail get an error (400).  Requests whose client has gone are
+    skipped, and an unexpected error fails its batch (500) but not the next.
+    '''
+    def __init__(self, predictor, window=0.002, max_batch=1024):
+        self.predictor = predictor
+        self.window = window
+        self.max_batch = max_batch
+        self.stats = LatencyStats()
+        self._queue = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(1)
+        self._listener = None
+        # writer of every open connection, by the task serving it
+        self._connections = {}
+
+    async def start(self, host='127.0.0.1', port=8080, unix=None):
+        '''
+        Starts listening on host:port, or on the Unix socket unix, and starts
+        the batcher.  Returns the asyncio server.
+        '''
+        self._queue = asyncio.Queue()
+        self._batcher = asyncio.create_task(self._batch())
+        if unix:
+            self._listener = await asyncio.start_unix_server(self._handle, unix)
+        else:
+            self._listener = await asyncio.start_server(self._handle, host, port)
+        return self._listener
+
+    async def predict(self, examples: list[dict]) -> list:
+        '''
+        Queues examples for the next batch and returns their predictions.
+        '''
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((examples, future))
+        predictions = await future
+        self.stats.record(time.perf_counter() - start, len(examples))
+        return predictions
+
+    async def _batch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + self.window
+            while size < self.max_batch:
+                if self._queue.empty():
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    item = self._queue.get_nowait()
+                batch.append(item)
+                size += len(item[0])
+            try:
+                await self._answer(batch)
+            except Exception as error:
+                # Fail only this batch; the batcher goes on to the next
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+
+    async def _answer(self, batch):
+        # A request whose client went away has a cancelled future, which must not be set
+        batch = [(request, future) for request, future in batch if not future.done()]
+        if not batch:
+            return
+        loop = asyncio.get_running_loop()
+        examples = [e for request, _ in batch for e in request]
+        self.stats.batches += 1
+        try:
+            predictions = await loop.run_in_executor(self._executor, self.predictor.predict, examples)
+        except Exception:
+            for request, future in batch:
+                if future.done():
+                    continue
+                try:
+                    result = await loop.run_in_executor(self._executor, self.predictor.predict, request)
+                except Exception as error:
+                    if not future.done():
+                        future.set_exception(ExampleError(f"bad example: {error}"))
+                else:
+                    if not future.done():
+                        future.set_result(result)
+            return
+        start = 0
+        for request, future in batch:
+            if not future.done():
+                future.set_result(predictions[start:start + len(request)])
+            start += len(request)
+
+    async def _route(self, method, path, body):
+        if path == '/health':
+            return 200, {'status': 'ok'}
+        if path == '/stats':
+            return 200, self.stats.snapshot()
+        if path != '/predict':
+            return 404, {'error': f"no such path: {path}"}
+        if method != 'POST':
+            return 405, {'error': "use POST"}
+        try:
+            request = json.loads(body)
+            single = 'example' in request
+            examples = [request['example']] if single else request['examples']
+            if not all(isinstance(e, dict) for e in examples):
+                raise ValueError("examples must be objects")
+        except (ValueError, KeyError, TypeError) as error:
+            return 400, {'error': f"bad request: {error}"}
+        try:
+            predictions = await self.predict(examples)
+        except ExampleError as error:
+            return 400, {'error': str(error)}
+        return 200, {'prediction': predictions[0]} if single else {'predictions': predictions}
+
+    async def _handle(self, reader, writer):
+        self._connections[asyncio.current_task()] = writer
+        try:
+            while True:
+                try:
+                    method, path, headers, body = await read_message(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except (ValueError, asyncio.LimitOverrunError) as error:
+                    # The stream cannot be trusted past a malformed request
+                    self.stats.errors += 1
+                    write_message(writer, "HTTP/1.1 400 Bad Request", {'error': f"bad request: {error}"},
+                                  ['Connection: close'])
+                    await writer.drain()
+                    break
+                try:
+                    status, payload = await self._route(method, path, body)
+                except Exception as error:
+                    status, payload = 500, {'error': str(error)}
+                if status != 200:
+                    self.stats.errors += 1
+                write_message(writer, f"HTTP/1.1 {status} {_REASONS[status]}", payload)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        finally:
+            del self._connections[asyncio.current_task()]
+            writer.close()
+
+    async def stop(self):
+        '''
+        Stops listening, closes the open connections once their requests are
+        answered, and stops the batcher.
+        '''
+        self._listener.close()
+        for writer in self._connections.values():
+            writer.close()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        self._batcher.cancel()
+        self._executor.shutdown(wait=False)
+
+
+async def read_message(reader, max_body=MAX_BODY_BYTES):
+    '''
+    Reads one HTTP request or response from reader.  Returns (the two first
+    words of its start line, its lower-cased headers and its body).  Raises
+    ValueError for a malformed start line or a Content-Length that is not a
+    number from 0 to max_body.
+    '''
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    words = lines[0].split(' ', 2)
+    if len(words) < 2:
+        raise ValueError(f"malformed start line: {lines[0]!r}")
+    first, second = words[:2]
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    if not 0 <= length <= max_body:
+        raise ValueError(f"Content-Length out of range: {length}")
+    body = await reader.readexactly(length)
+    return first, second, headers, body
+
+
+def write_message(writer, start_line, payload=None, headers=()):
+    '''
+    Writes an HTTP request or response with payload as its JSON body.
+    '''
+    body = b'' if payload is None else json.dumps(payload).encode('utf-8')
+    head = [start_line, *headers, 'Content-Type: application/json', f"Content-Length: {len(body)}"]
+    writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+
+
+async def connect(url):
+    '''
+    Opens a connection to a server at http://host:port or unix:PATH.
+    '''
+    if url.startswith('unix:'):
+        return await asyncio.open_unix_connection(url[len('unix:'):])
+    host, _, port = url.split('://', 1)[-1].rstrip('/').partition(':')
+    return await asyncio.open_connection(host, int(port or 80))
+
+
+async def call(reader, writer, method, path, payload=None):
+    '''
+    Sends one request over an open connection and returns (status, payload).
+    '''
+    write_message(writer, f"{method} {path} HTTP/1.1", payload, ['Host: localhost'])
+    await writer.drain()
+    _, status, _, body = await read_message(reader)
+    return int(status), json.loads(body)
+
+
+async def load(url, examples, requests=2000, concurrency=32, batch=1):
+    '''
+    Sends requests /predict requests of batch examples each (cycling through
+    examples) from concurrency connections at once, then reads /stats.  Returns
+    the client-side latency percentiles and throughput, the errors, and the
+    server's stats.
+    '''
+    latencies = []
+    errors = 0
+    sent = 0
+
+    async def client():
+        nonlocal errors, sent
+        reader, writer = await connect(url)
+        try:
+            while sent < requests:
+                first = sent * batch
+                sent += 1
+                chunk = [examples[(first + k) % len(examples)] for k in range(batch)]
+                start = time.perf_counter()
+                status, _ = await call(reader, writer, 'POST', '/predict', {'examples': chunk})
+                latencies.append(time.perf_counter() - start)
+                errors += status != 200
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    seconds = time.perf_counter() - start
+    reader, writer = await connect(url)
+    _, server = await call(reader, writer, 'GET', '/stats')
+    writer.close()
+    await writer.wait_closed()
+    p50, p99 = np.percentile(latencies, [50, 99])
+    return {'requests': len(latencies), 'errors': errors, 'seconds': seconds,
+            'requests_per_s': len(latencies) / seconds, 'examples_per_s': len(latencies) * batch / seconds,
+            'p50_ms': float(p50) * 1000, 'p99_ms': float(p99) * 1000, 'server': server}
+
+
+async def _serve(args):
+    server = PredictionServer(Predictor(args.model), args.window_ms / 1000, args.max_batch)
+    listener = await server.start(args.host, args.port, args.unix)
+    print(f"serving {args.model} on {args.unix or f'http://{args.host}:{args.port}'}", flush=True)
+    async with listener:
+        await listener.serve_forever()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve')
+    serve.add_argument('model')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8080)
+    serve.add_argument('--unix', help="listen on this Unix socket instead")
+    serve.add_argument('--window-ms', type=float, default=2.0, help="how long a batch collects requests")
+    serve.add_argument('--max-batch', type=int, default=1024, help="most examples per batch")
+    generate = commands.add_parser('load')
+    generate.add_argument('url')
+    generate.add_argument('data', help="a .data file whose examples are sent")
+    generate.add_argument('--requests', type=int, default=2000)
+    generate.add_argument('--concurrency', type=int, default=32)
+    generate.add_argument('--batch', type=int, default=1, help="examples per request")
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        try:
+            asyncio.run(_serve(args))
+        except KeyboardInterrupt:
+            pass
+        return 0
+    import parse
+    examples = parse.parse(args.data)
+    for e in examples:
+        e.pop('Class', None)
+    print(json.dumps(asyncio.run(load(args.url, examples, args.requests, args.concurrency, args.batch)),
+                     indent=1))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
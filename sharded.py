@@ -0,0 +1,385 @@
+'''
+Data-parallel training of one tree over row shards on disk, for data too large
+for one process.
+
+  python sharded.py split DATA DIRECTORY [--shard-rows N] [--numeric A ...] [--bins N]
+        streams the CSV file DATA into binary row shards in DIRECTORY
+  python sharded.py train DIRECTORY MODEL [--workers N] [--max-depth D] ...
+        trains a tree on the shards and saves it with compiled.save_tree
+
+The tree is grown a level at a time (see columnar.grow_levels).  Each worker
+process opens its own shards, memory-mapped, and keeps in memory only the row
+numbers that are still in the tree and the frontier node each has reached.
+For every level the coordinator asks the workers for the attribute x value x
+class counts of the frontier nodes, sums them, chooses every split, and sends
+the splits back for the workers to move their rows on.  The counts of a level
+are a few tables however many rows there are, so only they cross between
+processes.
+
+The rows are sharded but the value tables are not.  The manifest, and every
+worker, holds each attribute's table of distinct values.  A categorical or
+binned attribute usually has few.  A numeric attribute without bins lists
+every distinct value, so its table grows with the data.  Give split --bins for
+numeric columns of high cardinality; the manifest then keeps only the bin edges.
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import traceback
+import numpy as np
+import columnar
+import compiled
+import dataset
+import parse
+from dataset import EncodedDataset, code_dtype
+from node import Node
+from profiling import NO_STATS
+
+# The file in a shard directory that lists its shards and their shared tables
+MANIFEST = 'shards.json'
+MANIFEST_VERSION = 1
+
+
+def _shard_name(index):
+    return f"shard-{index:05d}.data"
+
+
+def _stack(chunks, tables, classes):
+    '''
+    Joins parse.iter_chunks chunks into one dataset of the given tables.
+    '''
+    matrix = np.empty((sum(len(c) for c in chunks), len(tables)),
+                      dtype=code_dtype(max((len(t) for t in tables), default=1)), order='F')
+    y = np.empty(len(matrix), dtype=code_dtype(len(classes)))
+    start = 0
+    for c in chunks:
+        matrix[start:start + len(c)] = c.matrix
+        y[start:start + len(c)] = c.y
+        start += len(c)
+    return EncodedDataset(matrix, y, chunks[0].attributes, tables, classes)
+
+
+def write_shards(filename, directory, shard_rows=1 << 20, chunk_size=65536, convert=None, numeric=(),
+                 bins=None) -> dict:
+    '''
+    Streams a CSV data file into shards of at most shard_rows rows, saved in
+    directory with dataset.save, and writes the manifest that train reads.
+    Returns the manifest.  At most one shard is held in memory at a time.
+
+    Codes are given in order of first appearance across the whole file (see
+    parse.iter_chunks), so the shards read in order are the dataset that
+    parse.load returns, and the manifest keeps the final tables.  The attributes
+    listed in numeric are made numeric, optionally in bins quantile buckets,
+    once the whole file has been seen (see dataset.as_numeric): every shard is
+    then recoded in turn.
+
+    While streaming, the tables of distinct values are kept in memory, as
+    parse.iter_chunks builds them, bins or not.  With bins, the manifest and
+    shards keep only the bin edges.  Without them, a numeric attribute's table
+    lists every distinct value in the file.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    chunk_size = min(chunk_size, shard_rows)
+    shards, pending, counts = [], [], {}
+    first = None
+
+    def flush():
+        data = _stack(pending, first.tables, first.classes)
+        dataset.save(data, os.path.join(directory, _shard_name(len(shards))))
+        shards.append({'file': _shard_name(len(shards)), 'rows': len(data)})
+        pending.clear()
+
+    columns = []
+    for chunk in parse.iter_chunks(filename, chunk_size, convert):
+        if first is None:
+            first = chunk
+            columns = [first.attributes.index(a) for a in numeric]
+        if bins:
+            # Occurrences of each code, for the quantile buckets
+            for j in columns:
+                seen = np.bincount(chunk.matrix[:, j], minlength=len(chunk.tables[j]))
+                total = counts.get(j, np.zeros(0, dtype=np.intp))
+                counts[j] = np.pad(total, (0, len(seen) - len(total))) + seen
+        if pending and sum(len(c) for c in pending) + len(chunk) > shard_rows:
+            flush()
+        pending.append(chunk)
+    if first is None:
+        data = parse.load(filename, convert=convert, numeric=numeric, bins=bins)
+        attributes, tables, classes, is_numeric = data.attributes, data.tables, data.classes, data.numeric
+        class_counts = []
+    else:
+        flush()
+        attributes, tables, classes = first.attributes, list(first.tables), first.classes
+        is_numeric = [False] * len(attributes)
+        recodes = {}
+        for j in columns:
+            if not is_numeric[j]:
+                recodes[j], tables[j] = dataset.numeric_recode(tables[j], counts.get(j), bins)
+                is_numeric[j] = True
+        # Shards written early may have narrower codes than the final tables,
+        # and binned ones wider
+        dtype = code_dtype(max((len(t) for t in tables), default=1))
+        class_counts = np.zeros(len(classes), dtype=np.intp)
+        for shard in shards:
+            path = os.path.join(directory, shard['file'])
+            data = dataset.open_saved(path)
+            class_counts += np.bincount(data.y, minlength=len(classes))
+            if recodes:
+                matrix = np.array(data.matrix, dtype=np.promote_types(data.matrix.dtype, dtype), order='F')
+                for j, recode in recodes.items():
+                    matrix[:, j] = recode[matrix[:, j]]
+                dataset.save(EncodedDataset(matrix.astype(dtype, order='F'), np.array(data.y), attributes, tables,
+                                            classes, is_numeric), path)
+        class_counts = class_counts.tolist()
+
+    manifest = {'version': MANIFEST_VERSION, 'attributes': attributes, 'tables': tables, 'classes': classes,
+                'numeric': is_numeric, 'class_counts': class_counts, 'shards': shards}
+    path = os.path.join(directory, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(path + '.tmp', path)
+    return manifest
+
+
+def read_manifest(directory) -> dict:
+    '''
+    Returns the manifest write_shards left in directory.
+    '''
+    with open(os.path.join(directory, MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError(f"{directory} holds shards of another format version")
+    return manifest
+
+
+def layout(manifest) -> EncodedDataset:
+    '''
+    Returns an EncodedDataset with no rows but the attributes, tables, classes
+    and numeric flags of the shards.
+    '''
+    attributes = manifest['attributes']
+    return EncodedDataset(np.empty((0, len(attributes)), dtype=np.uint8, order='F'), np.empty(0, dtype=np.uint8),
+                          attributes, manifest['tables'], manifest['classes'], manifest['numeric'])
+
+
+def load_shards(directory) -> EncodedDataset:
+    '''
+    Reads every shard in directory back into one EncodedDataset, in order.
+    '''
+    manifest = read_manifest(directory)
+    empty = layout(manifest)
+    parts = [dataset.open_saved(os.path.join(directory, shard['file'])) for shard in manifest['shards']]
+    if not parts:
+        return empty
+    return EncodedDataset(np.concatenate([p.matrix for p in parts]).astype(
+                              code_dtype(max((len(t) for t in empty.tables), default=1)), order='F'),
+                          np.concatenate([p.y for p in parts]), empty.attributes, empty.tables, empty.classes,
+                          empty.numeric)
+
+
+def _combine(command, answers):
+    '''
+    Combines the answers several FrontierRows gave to one call into the answer
+    for all their rows together.
+    '''
+    if command == 'classes':
+        counts, first = answers[0]
+        for more_counts, more_first in answers[1:]:
+            counts = counts + more_counts
+            first = np.minimum(first, more_first)
+        return counts, first
+    if command == 'count':
+        if len(answers) == 1:
+            return answers[0]
+        cells, inverse = np.unique(np.concatenate([cells for _, cells, _ in answers]), return_inverse=True)
+        counts = np.bincount(inverse.ravel(), np.concatenate([counts for _, _, counts in answers]), len(cells))
+        return answers[0][0], cells, counts.astype(np.intp)
+    if command == 'pairs':
+        pairs, inverse = np.unique(np.concatenate([p for p, _ in answers]), return_inverse=True)
+        first = np.full(len(pairs), columnar.NEVER, dtype=np.int64)
+        np.minimum.at(first, inverse.ravel(), np.concatenate([f for _, f in answers]))
+        return pairs, first
+    return None
+
+
+def _work(connection, paths, starts, n_classes):
+    '''
+    The loop of a worker process: holds the shards at paths, whose first rows
+    are numbered starts, and answers the calls of a _Workers on connection
+    until told to stop.
+    '''
+    parts, failure = [], None
+    try:
+        for path, start in zip(paths, starts):
+            data = dataset.open_saved(path)
+            if data is None:
+                raise ValueError(f"{path} is not a shard")
+            rows = np.arange(len(data), dtype=np.int32 if len(data) < 1 << 31 else np.intp)
+            parts.append(columnar.FrontierRows(data, rows, start, n_classes))
+    except Exception:
+        failure = traceback.format_exc()
+    while True:
+        command, args = connection.recv()
+        if command == 'stop':
+            connection.close()
+            return
+        if failure is not None:
+            connection.send((False, failure))
+            continue
+        try:
+            connection.send((True, _combine(command, [getattr(part, command)(*args) for part in parts])))
+        except Exception:
+            connection.send((False, traceback.format_exc()))
+
+
+class _Workers:
+    '''
+    Worker processes that together answer for the rows of every shard as a
+    columnar.FrontierRows answers for its rows, so columnar.grow_levels can grow
+    a tree from them.  groups lists the (paths, starts) of each worker's shards.
+    Every call goes to all the workers at once; each combines the answers of
+    its shards, and their answers are combined in turn.
+    '''
+    def __init__(self, groups, n_classes):
+        self.connections, self.processes = [], []
+        try:
+            for paths, starts in groups:
+                ours, theirs = multiprocessing.Pipe()
+                process = multiprocessing.Process(target=_work, args=(theirs, paths, starts, n_classes), daemon=True)
+                process.start()
+                theirs.close()
+                self.connections.append(ours)
+                self.processes.append(process)
+        except BaseException:
+            self.close()
+            raise
+
+    def _ask(self, command, *args):
+        '''
+        Sends a call to every worker and returns their answers.
+        '''
+        for connection in self.connections:
+            connection.send((command, args))
+        answers, failures = [], []
+        for connection in self.connections:
+            try:
+                ok, answer = connection.recv()
+            except EOFError:
+                ok, answer = False, "the worker exited"
+            (answers if ok else failures).append(answer)
+        if failures:
+            raise RuntimeError(f"a shard worker failed:\n{failures[0]}")
+        return answers
+
+    def classes(self, n_nodes):
+        return _combine('classes', self._ask('classes', n_nodes))
+
+    def count(self, position, start, stop, columns, cards):
+        table = None
+        # Only the counts that are not zero are sent: deep levels have few
+        # rows for the cells of wide numeric attributes
+        for shape, cells, counts in self._ask('count', position, start, stop, columns, cards, True):
+            if table is None:
+                table = np.zeros(shape, dtype=np.intp)
+            table.reshape(-1)[cells] += counts
+        return table
+
+    def pairs(self, column_of, cut_of, width):
+        return _combine('pairs', self._ask('pairs', column_of, cut_of, width))
+
+    def assign(self, pairs, children):
+        self._ask('assign', pairs, children)
+
+    def close(self):
+        for connection in self.connections:
+            try:
+                connection.send(('stop', ()))
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self.processes:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+        for connection in self.connections:
+            connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def train(directory, default=None, n_workers=None, max_depth=None, min_samples_split=2, min_samples_leaf=1,
+          min_info_gain=0.0, stats=None) -> Node:
+    '''
+    Trains a tree on the shards write_shards left in directory and returns its
+    root.  It is the tree ID3.ID3 grows from the whole file, node for node,
+    with the same growth limits: those a node decides on alone, max_depth,
+    min_samples_split, min_samples_leaf and min_info_gain.  default, the label
+    when there are no rows, is the most common class if not given.
+
+    The shards are dealt out in runs of consecutive shards to n_workers
+    processes (one per core if None, and never more than there are shards).
+    stats, a profiling.TrainingStats, gets the phases and counters of
+    columnar.grow_levels, timed in the coordinator.
+    '''
+    if stats is None:
+        stats = NO_STATS
+    manifest = read_manifest(directory)
+    empty = layout(manifest)
+    if default is None:
+        default = empty.classes[int(np.argmax(manifest['class_counts']))] if empty.classes else None
+    shards = manifest['shards']
+    if not shards:
+        stats.count('nodes')
+        stats.count('leaves')
+        root = Node()
+        root.add_label(default)
+        return root
+    paths = [os.path.join(directory, shard['file']) for shard in shards]
+    starts = np.concatenate(([0], np.cumsum([shard['rows'] for shard in shards])[:-1])).tolist()
+    n_workers = min(n_workers or multiprocessing.cpu_count(), len(shards))
+    groups = [([paths[i] for i in run], [starts[i] for i in run])
+              for run in np.array_split(np.arange(len(shards)), n_workers)]
+    with _Workers(groups, empty.n_classes) as workers:
+        return columnar.grow_levels(workers, empty, range(len(empty.attributes)), default, max_depth,
+                                    min_samples_split, min_samples_leaf, min_info_gain, stats)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    split = commands.add_parser('split')
+    split.add_argument('data')
+    split.add_argument('directory')
+    split.add_argument('--shard-rows', type=int, default=1 << 20, help="most rows per shard")
+    split.add_argument('--numeric', nargs='*', default=[], help="attributes to split at thresholds")
+    split.add_argument('--bins', type=int, help="quantile buckets for numeric attributes")
+    grow = commands.add_parser('train')
+    grow.add_argument('directory')
+    grow.add_argument('model', help="where to save the tree")
+    grow.add_argument('--workers', type=int, help="worker processes (default: one per core)")
+    grow.add_argument('--default', help="label when there are no rows (default: the most common class)")
+    grow.add_argument('--max-depth', type=int)
+    grow.add_argument('--min-samples-split', type=int, default=2)
+    grow.add_argument('--min-samples-leaf', type=int, default=1)
+    grow.add_argument('--min-info-gain', type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    if args.command == 'split':
+        manifest = write_shards(args.data, args.directory, args.shard_rows, numeric=args.numeric, bins=args.bins)
+        print(f"{sum(s['rows'] for s in manifest['shards'])} rows in {len(manifest['shards'])} shards")
+        return 0
+    root = train(args.directory, args.default, args.workers, args.max_depth, args.min_samples_split,
+                 args.min_samples_leaf, args.min_info_gain)
+    empty = layout(read_manifest(args.directory))
+    compiled.save_tree(args.model, compiled.compile_tree(root, empty.attributes, empty.tables, empty.classes,
+                                                         empty.numeric))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
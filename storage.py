@@ -0,0 +1,81 @@
+import json
+import os
+import struct
+import numpy as np
+
+# File layout: 8-byte magic, little-endian uint64 header length, a UTF-8 JSON
+# header, then the raw bytes of each array starting on an ALIGNMENT boundary.
+# The header records every array's dtype, shape, order and offset, so the
+# arrays can be memory-mapped in place instead of read.
+ALIGNMENT = 64
+_LENGTH = struct.Struct('<Q')
+
+
+def _aligned(n):
+  return -(-n // ALIGNMENT) * ALIGNMENT
+
+
+def write(path, magic: bytes, header: dict, arrays: dict):
+  '''
+  Writes header (a JSON-serializable dict) and the named numpy arrays to path.
+  The file is written next to path and renamed into place, so readers never see
+  a partial file.
+  '''
+  layout = {}
+  offset = 0
+  for name, array in arrays.items():
+    layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape),
+                    'order': 'F' if array.ndim > 1 and array.flags.f_contiguous and not array.flags.c_contiguous else 'C',
+                    'offset': offset}
+    offset = _aligned(offset + array.nbytes)
+  blob = json.dumps(dict(header, arrays=layout)).encode('utf-8')
+  start = _aligned(len(magic) + _LENGTH.size + len(blob))
+
+  tmp = f"{path}.{os.getpid()}.tmp"
+  with open(tmp, 'wb') as f:
+    f.write(magic)
+    f.write(_LENGTH.pack(len(blob)))
+    f.write(blob)
+    for name, array in arrays.items():
+      f.seek(start + layout[name]['offset'])
+      f.write(np.asarray(array).tobytes(order=layout[name]['order']))
+    f.truncate(start + offset)
+  os.replace(tmp, path)
+
+
+def read_header(path, magic: bytes) -> dict:
+  '''
+  Returns the JSON header of a file written by write, or None if path does not
+  exist or does not start with magic.
+  '''
+  try:
+    with open(path, 'rb') as f:
+      if f.read(len(magic)) != magic:
+        return None
+      (length,) = _LENGTH.unpack(f.read(_LENGTH.size))
+      header = json.loads(f.read(length).decode('utf-8'))
+  except (OSError, ValueError, struct.error):
+    return None
+  header['data_offset'] = _aligned(len(magic) + _LENGTH.size + length)
+  return header
+
+
+def read(path, magic: bytes, header: dict = None):
+  '''
+  Returns (header, arrays) for a file written by write.  The arrays are read-only
+  memory maps of the file, so nothing is copied and processes opening the same
+  file share its page cache.  Returns (None, None) if the file is missing or not
+  of this kind.
+  '''
+  header = header or read_header(path, magic)
+  if header is None:
+    return None, None
+  arrays = {}
+  for name, spec in header['arrays'].items():
+    shape = tuple(spec['shape'])
+    if 0 in shape:
+      arrays[name] = np.empty(shape, dtype=spec['dtype'], order=spec['order'])
+    else:
+      arrays[name] = np.memmap(path, dtype=spec['dtype'], mode='r', shape=shape, order=spec['order'],
+                               offset=header['data_offset'] + spec['offset'])
+  return header, arrays
@@ -0,0 +1,220 @@
+import compiled
+import columnar
+import itertools
+import multiprocessing
+import time
+import numpy as np
+import parse
+import randomForest
+from ID3 import as_dataset, prune, GROW_FULLY
+from pruning import pruning_path
+
+# Options of an "id3" config besides the growth limits
+ID3_OPTIONS = ['max_features', 'missing', 'prune']
+# Options of a "forest" config besides the growth limits
+FOREST_OPTIONS = ['tree_numbers', 'max_feature', 'missing']
+
+# The encoded dataset, splits and configs seen by pool workers.  They are set
+# before a fork-based pool starts, so workers inherit them instead of
+# receiving a copy with every task.
+_worker_state = None
+
+def _init_worker(state):
+    global _worker_state
+    _worker_state = state
+
+def _run_worker(task):
+    return task, run_task(*_worker_state, *task)
+
+def kfold(n, k=5, repeats=1, seed=0):
+    '''
+    Returns k-fold cross-validation splits of n rows as (train, test) pairs of
+    row index arrays: each of repeats seeded shuffles is cut into k folds, and
+    every fold is the test set of one split.
+    '''
+    splits = []
+    for repeat in range(repeats):
+        order = np.random.default_rng([seed, repeat]).permutation(n)
+        folds = np.array_split(order, k)
+        for i in range(k):
+            splits.append((np.sort(np.concatenate(folds[:i] + folds[i + 1:])), np.sort(folds[i])))
+    return splits
+
+def holdout(n, test_ratio=0.2, repeats=10, seed=0):
+    '''
+    Returns repeats random holdout splits of n rows as (train, test) pairs of
+    row index arrays, with test_ratio of the rows in each test set.
+    '''
+    test_size = int(round(test_ratio * n))
+    splits = []
+    for repeat in range(repeats):
+        order = np.random.default_rng([seed, repeat]).permutation(n)
+        splits.append((np.sort(order[test_size:]), np.sort(order[:test_size])))
+    return splits
+
+def grid(**options):
+    '''
+    Returns every combination of the listed values of each option as a list of
+    config dicts: grid(model=['id3'], max_depth=[2, None], prune=[False, True])
+    gives four configs.
+    '''
+    names = list(options)
+    return [dict(zip(names, values)) for values in itertools.product(*options.values())]
+
+def _split_seed(seed, split):
+    # Every config sees the same random draws on a split, so their scores differ
+    # by the config alone
+    return [seed, split]
+
+def _carve(train, validation_ratio, seed):
+    '''
+    Splits training rows into the rows a pruned tree is grown from and the
+    validation rows it is pruned on.
+    '''
+    order = np.random.default_rng(seed).permutation(train)
+    size = int(validation_ratio * len(train))
+    return np.sort(order[size:]), np.sort(order[:size])
+
+def _accuracy(data, predictions, rows, labels):
+    class_codes = {value: code for code, value in enumerate(data.classes)}
+    as_class = np.array([class_codes.get(label, -1) for label in labels])
+    return float(np.mean(as_class[predictions] == data.y[rows])) if len(rows) else 0.0
+
+def run_task(data, splits, configs, default, seed, validation_ratio, split, indices):
+    '''
+    Scores the configs listed in indices on one split.  Returns a list of
+    (test accuracy, training seconds) in the same order.
+
+    The root count table of each set of training rows (all of them, or those
+    left after the validation rows of pruned configs) is counted once and
+    handed to every ID3 config grown from them.
+    '''
+    train, test = splits[split]
+    pruned_train, tables = None, {}
+    matrix = data.matrix[test]
+    results = []
+    for index in indices:
+        config = dict(configs[index])
+        model = config.pop('model', 'id3')
+        start = time.perf_counter()
+        if model == 'forest':
+            forest = randomForest.randomForest(config.pop('tree_numbers', 10), config.pop('max_feature', None),
+                                               seed=_split_seed(seed, split), **config)
+            forest.train(data[train], default)
+            trees = forest.compiled_trees()
+            codes, _ = compiled.vote(np.stack([tree.predict_batch(trees[0].encode(data[test]))
+                                               for tree in trees]), len(forest.labels))
+            results.append((_accuracy(data, codes, test, forest.labels), time.perf_counter() - start))
+            continue
+        if model != 'id3':
+            raise ValueError(f"unknown model: {model!r}")
+
+        pruning = config.pop('prune', False)
+        unknown = set(config) - set(GROW_FULLY) - set(ID3_OPTIONS)
+        if unknown:
+            raise ValueError(f"unknown ID3 options: {sorted(unknown)}")
+        if pruning and pruned_train is None:
+            pruned_train = _carve(train, validation_ratio, _split_seed(seed, split))
+        rows = pruned_train[0] if pruning else train
+        table = None
+        if config.get('missing', 'category') == 'category':
+            if bool(pruning) not in tables:
+                tables[bool(pruning)] = columnar.root_table(data, rows)
+            table = tables[bool(pruning)]
+        if 'max_features' in config:
+            config['rng'] = _split_seed(seed, split)
+        tree = compiled.compile_tree(columnar.build(data, rows, list(range(len(data.attributes))), default,
+                                                    table=table, **config),
+                                     data.attributes, data.tables, data.classes, data.numeric)
+        if pruning == 'path':
+            path = pruning_path(tree, data[rows])
+            tree = path.tree_at(path.best_level(data[pruned_train[1]]))
+        elif pruning:
+            prune(tree.root(), data[pruned_train[1]])
+        results.append((_accuracy(data, tree.predict_batch(matrix), test, tree.labels),
+                        time.perf_counter() - start))
+    return results
+
+def search(data, configs, splits, default=None, seed=0, n_jobs=1, validation_ratio=0.1):
+    '''
+    Scores every config on every split of data (a list of example dictionaries
+    or an EncodedDataset, which is encoded once) and returns one result per
+    config, in order: the config, the mean and standard deviation of its test
+    accuracies, the accuracies per split and its total training seconds.
+
+    A config is a dict with model "id3" (the default) or "forest".  An id3
+    config takes ID3.ID3's growth limits, max_features and missing, and prune:
+    a pruned tree is grown from all but a seeded validation_ratio of the
+    training rows and pruned on the rest, with ID3.prune if prune is True, or
+    if it is "path" by taking the level of its cost-complexity pruning path
+    (see pruning.py) that does best on them.  A forest config takes tree_numbers,
+    max_feature, missing and the growth limits of randomForest.  Numeric
+    attributes are set on data beforehand (see dataset.as_numeric).
+
+    Splits are (train, test) pairs of row index arrays, such as kfold and
+    holdout return.  Each split and group of configs is one task, seeded from
+    (seed, split) alone; with n_jobs > 1 (or None for every core) the tasks run
+    in a process pool.  Configs on the same split share root count tables; see
+    run_task.
+    '''
+    global _worker_state
+    data = as_dataset(data)
+    configs = list(configs)
+    if default is None:
+        default = data.classes[columnar.majority(data.y, data.n_classes)]
+    n_jobs = n_jobs or multiprocessing.cpu_count()
+    # Configs are spread over enough groups to keep every process busy
+    groups = max(1, min(len(configs), -(-n_jobs // len(splits))))
+    tasks = [(split, tuple(chunk.tolist())) for split in range(len(splits))
+             for chunk in np.array_split(np.arange(len(configs)), groups) if len(chunk)]
+    state = (data, splits, configs, default, seed, validation_ratio)
+
+    scores = np.full((len(configs), len(splits)), np.nan)
+    seconds = np.zeros(len(configs))
+    def record(task, results):
+        split, indices = task
+        for index, (accuracy, elapsed) in zip(indices, results):
+            scores[index, split] = accuracy
+            seconds[index] += elapsed
+
+    if n_jobs == 1 or len(tasks) <= 1:
+        for task in tasks:
+            record(task, run_task(*state, *task))
+    else:
+        if 'fork' in multiprocessing.get_all_start_methods():
+            # Forked workers inherit _worker_state from this process's memory
+            _worker_state = state
+            pool = multiprocessing.get_context('fork').Pool(min(n_jobs, len(tasks)))
+        else:
+            pool = multiprocessing.Pool(min(n_jobs, len(tasks)), _init_worker, (state,))
+        try:
+            with pool:
+                for task, results in pool.imap_unordered(_run_worker, tasks):
+                    record(task, results)
+        finally:
+            _worker_state = None
+
+    return [{'config': config, 'mean': float(np.mean(row)), 'std': float(np.std(row)),
+             'scores': row.tolist(), 'seconds': float(elapsed)}
+            for config, row, elapsed in zip(configs, scores, seconds)]
+
+def cross_validate(data, config, k=5, repeats=1, seed=0, n_jobs=1, **options):
+    '''
+    Returns search's result for one config over k-fold cross-validation.
+    '''
+    data = as_dataset(data)
+    return search(data, [config], kfold(len(data), k, repeats, seed), seed=seed, n_jobs=n_jobs, **options)[0]
+
+def best(results):
+    '''
+    Returns the result with the highest mean accuracy; ties go to the first.
+    '''
+    return max(results, key=lambda result: result['mean'])
+
+if __name__ == "__main__":
+    data = parse.load("house_votes_84.data", cache=True)
+    configs = grid(model=['id3'], max_depth=[None, 2, 4], min_samples_leaf=[1, 5], prune=[False, True]) + \
+        grid(model=['forest'], tree_numbers=[10, 30], max_feature=[2, 4, 8])
+    results = search(data, configs, kfold(len(data), 5, repeats=2), n_jobs=None)
+    for result in sorted(results, key=lambda result: -result['mean']):
+        print(f"{result['mean']:.4f} +- {result['std']:.4f}  {result['seconds']:7.2f}s  {result['config']}")
@@ -1,4 +1,5 @@
-import ID3, parse, random, importlib
+import ID3, benchmark, columnar, compiled, incremental, learn_curve, parse, pruning, profiling, pstats, random, randomForest, serve, sharded, tuning, asyncio, importlib.util, json, os, sys, tempfile
+import numpy as np
 
 def testID3AndEvaluate():
   data = [dict(a=1, b=0, Class=1), dict(a=1, b=1, Class=1)]
@@ -29,6 +30,23 @@ def testPruning():
     print("pruning test failed -- no tree returned.")
 
 
+def testPruningNeverLowersValidationAccuracy():
+  data = parse.parse('house_votes_84.data')
+  lowered = 0
+  for seed in range(40):
+    random.Random(seed).shuffle(data)
+    # Small training sets leave values the validation rows have and the tree never saw
+    train, valid = data[:40], data[40:120]
+    tree = ID3.ID3(train, 'democrat')
+    before = ID3.test(tree, valid)
+    ID3.prune(tree, valid)
+    lowered += ID3.test(tree, valid) < before
+  if lowered:
+    print("pruning validation accuracy test failed on", lowered, "splits.")
+  else:
+    print("pruning validation accuracy test succeeded.")
+
+
 def testID3AndTest():
   trainData = [dict(a=1, b=0, c=0, Class=1), dict(a=1, b=1, c=0, Class=1), 
   dict(a=0, b=0, c=0, Class=0), dict(a=0, b=1, c=0, Class=1)]
@@ -56,6 +74,499 @@ def testID3AndTest():
   else:
     print("testID3andTest failed -- no tree returned.")	
 
+def sameTree(a, b):
+  if a.label != b.label or a.decision_label != b.decision_label or a.threshold != b.threshold:
+    return False
+  if list(a.children) != list(b.children):
+    return False
+  return all(sameTree(a.children[v], b.children[v]) for v in a.children)
+
+def testColumnarMatchesDict():
+  fails = 0
+  for inFile in ['cars_train.data', 'house_votes_84.data', 'tennis.data']:
+    data = parse.parse(inFile)
+    if not sameTree(ID3.ID3(data, 0, engine='dict'), ID3.ID3(data, 0, engine='columnar')):
+      print("columnar engine test failed on", inFile)
+      fails = fails + 1
+  if fails == 0:
+    print("columnar engine test succeeded.")
+
+def testColumnarLargeNodePaths():
+  # Over 2048 rows, the root and its largest children are counted column by column and
+  # derive a child's table by subtraction
+  rng = random.Random(0)
+  rows = []
+  for _ in range(3000):
+    row = dict(('a%d' % i, rng.choice('pqrs')) for i in range(6))
+    row['x'] = rng.randint(0, 99)
+    row['Class'] = int((row['a0'] in 'pq') != (row['x'] > 60) or rng.random() < 0.1)
+    rows.append(row)
+  categorical = [dict(row, x=row['x'] // 10) for row in rows]
+  same = sameTree(ID3.ID3(categorical, 0, engine='dict'), ID3.ID3(categorical, 0, engine='columnar'))
+  expected = ID3.ID3(rows[:300], 0, numeric=['x'])
+  # With the thresholds lowered, every node of the small data sets takes those paths
+  saved = columnar.SUBTRACTION_MIN_ROWS, columnar.COLUMN_COUNT_MIN_ROWS
+  columnar.SUBTRACTION_MIN_ROWS = columnar.COLUMN_COUNT_MIN_ROWS = 0
+  try:
+    for inFile in ['cars_train.data', 'house_votes_84.data', 'tennis.data']:
+      data = parse.parse(inFile)
+      same = same and sameTree(ID3.ID3(data, 0, engine='dict'), ID3.ID3(data, 0, engine='columnar'))
+    same = same and sameTree(expected, ID3.ID3(rows[:300], 0, numeric=['x']))
+  finally:
+    columnar.SUBTRACTION_MIN_ROWS, columnar.COLUMN_COUNT_MIN_ROWS = saved
+  if same:
+    print("columnar large node test succeeded.")
+  else:
+    print("columnar large node test failed.")
+
+def testCompiledMatchesEvaluate():
+  data = parse.parse('house_votes_84.data')
+  tree = ID3.ID3(data[:200], 'democrat')
+  predictions = compiled.compile_tree(tree).predict(data[200:])
+  if predictions != [ID3.evaluate(tree, e) for e in data[200:]]:
+    print("compiled tree test failed.")
+  else:
+    print("compiled tree test succeeded.")
+
+def testLoadMatchesParse():
+  examples = parse.parse('house_votes_84.data')
+  data = parse.load('house_votes_84.data', chunk_size=50)
+  if [data.example(i) for i in range(len(data))] != examples:
+    print("loader test failed -- rows differ.")
+  elif not sameTree(ID3.ID3(examples, 'democrat'), ID3.ID3(data, 'democrat')):
+    print("loader test failed -- trees differ.")
+  else:
+    print("loader test succeeded.")
+
+def testCacheRoundTrip():
+  with tempfile.TemporaryDirectory() as cacheDir:
+    parsed = parse.load('house_votes_84.data')
+    parse.load('house_votes_84.data', cache_dir=cacheDir)
+    cached = parse.load('house_votes_84.data', cache_dir=cacheDir)
+    if (cached.matrix != parsed.matrix).any() or cached.tables != parsed.tables or cached.classes != parsed.classes:
+      print("cache test failed.")
+    else:
+      print("cache test succeeded.")
+
+def testNumericThresholds():
+  data = [dict(x=x, Class=int(x > 2.5)) for x in [0.5, 1, 1.5, 2, 3, 3.5, 4, 10]]
+  tree = ID3.ID3(data, 0, numeric=['x'])
+  binned = ID3.ID3(data, 0, numeric=['x'], bins=2)
+  unseen = [dict(x=1.8, Class=0), dict(x=7, Class=1), dict(x=-1, Class=0)]
+  if tree.decision_label != 'x' or tree.threshold != 2 or ID3.test(tree, unseen) != 1.0 \
+     or not sameTree(tree, binned):
+    print("numeric threshold test failed.")
+  else:
+    print("numeric threshold test succeeded.")
+
+def depthAndLeaves(node):
+  if not node.children:
+    return 0, 1
+  below = [depthAndLeaves(child) for child in node.children.values()]
+  return 1 + max(d for d, _ in below), sum(l for _, l in below)
+
+def testLevelWiseMatchesDepthFirst():
+  matches = True
+  for inFile in ['house_votes_84.data', 'cars_train.data', 'candy.data']:
+    data = parse.load(inFile)
+    for limits in [{}, dict(max_depth=2), dict(min_samples_leaf=3, min_info_gain=0.05)]:
+      matches &= sameTree(ID3.ID3(data, data.classes[0], **limits),
+                          ID3.ID3(data, data.classes[0], growth='level', **limits))
+  rng = random.Random(0)
+  points = [dict(x=rng.randint(0, 40) / 4, y=rng.randint(0, 400), kind=rng.choice('abc')) for _ in range(500)]
+  for p in points:
+    p['Class'] = int(p['x'] * 40 > p['y']) if rng.random() > 0.1 else rng.randint(0, 1)
+  for bins in [None, 8]:
+    matches &= sameTree(ID3.ID3(points, 0, numeric=['x', 'y'], bins=bins),
+                        ID3.ID3(points, 0, numeric=['x', 'y'], bins=bins, growth='level'))
+  if matches:
+    print("level-wise builder test succeeded.")
+  else:
+    print("level-wise builder test failed.")
+
+def testShardedTraining():
+  matches = True
+  with tempfile.TemporaryDirectory() as directory:
+    for inFile in ['house_votes_84.data', 'candy.data']:
+      shards = os.path.join(directory, inFile)
+      sharded.write_shards(inFile, shards, shard_rows=40, chunk_size=16)
+      data = parse.load(inFile)
+      matches &= (sharded.load_shards(shards).matrix == data.matrix).all()
+      for limits in [{}, dict(max_depth=2, min_samples_leaf=3)]:
+        matches &= sameTree(sharded.train(shards, data.classes[0], n_workers=2, **limits),
+                            ID3.ID3(data, data.classes[0], **limits))
+    rng = random.Random(0)
+    inFile = os.path.join(directory, 'points.data')
+    with open(inFile, 'w') as f:
+      f.write('x,y,Class\n')
+      for _ in range(500):
+        x, y = rng.randint(0, 40) / 4, rng.randint(0, 400)
+        f.write(f"{x},{y},{int(x * 40 > y) if rng.random() > 0.1 else rng.randint(0, 1)}\n")
+    for bins in [None, 8]:
+      shards = os.path.join(directory, f'points-{bins}')
+      sharded.write_shards(inFile, shards, shard_rows=64, numeric=['x', 'y'], bins=bins)
+      matches &= sameTree(sharded.train(shards, '0', n_workers=3),
+                          ID3.ID3(parse.load(inFile, numeric=['x', 'y'], bins=bins), '0'))
+  if matches:
+    print("sharded training test succeeded.")
+  else:
+    print("sharded training test failed.")
+
+def testGrowthLimits():
+  data = parse.load('house_votes_84.data')
+  shallow = depthAndLeaves(ID3.ID3(data, 'democrat', max_depth=2))
+  budget = depthAndLeaves(ID3.ID3(data, 'democrat', max_leaf_nodes=8, growth='best'))
+  full = ID3.ID3(data, 'democrat')
+  if shallow[0] > 2 or budget[1] > 8 or not sameTree(full, ID3.ID3(data, 'democrat', growth='best')):
+    print("growth limit test failed.")
+  else:
+    print("growth limit test succeeded.")
+
+def testOutOfBag():
+  data = parse.load('house_votes_84.data')
+  forest = randomForest.randomForest(20, seed=0)
+  forest.train(data, 'democrat')
+  if (forest.inbag.sum(axis=1) != len(data)).any() or len(forest.oob_predictions()) != len(data) \
+     or not 0.8 < forest.oob_score() <= 1:
+    print("out-of-bag test failed.")
+  else:
+    print("out-of-bag test succeeded.")
+
+def testForestProbabilities():
+  data = parse.load('cars_train.data')
+  forest = randomForest.randomForest(8, max_feature=3, seed=0)
+  forest.train(data, 'unacc')
+  proba = forest.predict_proba(data)
+  predictions = forest.predictAll(data)
+  codes = [forest.labels.index(label) for label in predictions]
+  # Ties make argmax ambiguous, so the vote must only be one of the most probable labels
+  voted = proba[np.arange(len(codes)), codes]
+  if np.allclose(proba.sum(axis=1), 1) and (voted == proba.max(axis=1)).all() \
+     and (proba.argmax(axis=1) == codes)[proba.max(axis=1) > 0.5].all():
+    print("forest probability test succeeded.")
+  else:
+    print("forest probability test failed.")
+
+def testOutOfBagMatchesBruteForce():
+  data = parse.load('house_votes_84.data')
+  forest = randomForest.randomForest(6, max_feature=4, seed=3)
+  forest.train(data, 'democrat')
+  expected, right, voted = [], 0, 0
+  for i in range(len(data)):
+    example = data.example(i)
+    votes = [ID3.evaluate(tree, example) for t, tree in enumerate(forest.trees) if forest.inbag[t, i] == 0]
+    counts = {label: votes.count(label) for label in votes}
+    # Ties go to the tied label that the earliest out-of-bag tree voted for
+    winner = next((label for label in votes if counts[label] == max(counts.values())), None)
+    expected.append(winner)
+    if winner is not None:
+      voted += 1
+      right += winner == example['Class']
+  if forest.oob_predictions() == expected and abs(forest.oob_score() - right / voted) < 1e-12 \
+     and 0 < voted < len(data):
+    print("out-of-bag brute force test succeeded.")
+  else:
+    print("out-of-bag brute force test failed.")
+
+def testForestIsDeterministic():
+  data = parse.load('house_votes_84.data')
+  forests = []
+  for n_jobs, seed in [(1, 7), (2, 7), (3, 7), (1, 8)]:
+    forest = randomForest.randomForest(6, max_feature=4, n_jobs=n_jobs, seed=seed)
+    forest.train(data, 'democrat')
+    forests.append(forest)
+  first = forests[0]
+  same = [all(sameTree(a, b) for a, b in zip(first.trees, forest.trees))
+          and (first.inbag == forest.inbag).all()
+          and first.predictAll(data) == forest.predictAll(data) for forest in forests[1:]]
+  # Another seed draws other samples, so the check above is not vacuous
+  if same == [True, True, False]:
+    print("forest determinism test succeeded.")
+  else:
+    print("forest determinism test failed.")
+
+def testMissingValueWeights():
+  data = parse.load('house_votes_84.data')
+  train, test = data[:300], data[300:]
+  tree = ID3.ID3(train, 'democrat', missing='weighted')
+  examples = [test.example(i) for i in range(len(test))]
+  predictions = [ID3.evaluate(tree, e) for e in examples]
+  pruned = compiled.compile_tree(tree).copy()
+  ID3.prune(pruned.root(), train[200:])
+  if None not in predictions and predictions == compiled.compile_tree(tree).predict(examples) \
+     and ID3.test(tree, test) > 0.9 and ID3.test(pruned.root(), test) > 0.9:
+    print("missing value weights test succeeded.")
+  else:
+    print("missing value weights test failed.")
+
+def testMissingNumericColumnBelowSplit():
+  rng = random.Random(0)
+  examples = []
+  for _ in range(200):
+    kind, x = rng.choice('ab'), rng.randint(0, 50)
+    # x is known only where kind is "a", so it is missing at every row below kind = "b"
+    examples.append(dict(kind=kind, x=str(x) if kind == 'a' else '?',
+                         Class=int(x > 25) if kind == 'a' else rng.randint(0, 1)))
+  try:
+    tree = ID3.ID3(examples, 0, numeric=['x'], missing='weighted')
+    predictions = [ID3.evaluate(tree, e) for e in examples]
+  except (IndexError, ValueError):
+    tree, predictions = None, []
+  if tree is not None and predictions == compiled.compile_tree(tree).predict(examples) \
+     and ID3.test(tree, examples) > 0.7:
+    print("all-missing numeric test succeeded.")
+  else:
+    print("all-missing numeric test failed.")
+
+def testWeightedTiesAgree():
+  # Both branches of "a" = x leave q and r each with half of the weight when b is missing
+  examples = [dict(a='x', b='v', Class='r'), dict(a='y', b='?', Class='q'),
+              dict(a='y', b='?', Class='q'), dict(a='y', b='?', Class='p'),
+              dict(a='y', b='?', Class='p'), dict(a='x', b='u', Class='q')]
+  tree = ID3.ID3(examples, 'p', missing='weighted')
+  model = compiled.compile_tree(tree)
+  tie = dict(a='x', b='?')
+  shares = ID3.class_distribution(tree, tie)
+  first = min(('q', 'r'), key=model.labels.index)
+  agree = True
+  for seed in range(100):
+    rng = random.Random(seed)
+    data = [dict(a=rng.choice('xy?'), b=rng.choice('uv?'), Class=rng.choice('pqr'))
+            for _ in range(rng.randint(4, 10))]
+    grown = ID3.ID3(data, 'p', missing='weighted')
+    queries = [dict(a=a, b=b) for a in 'xy?' for b in 'uv?']
+    agree &= [ID3.evaluate(grown, e) for e in queries] == compiled.compile_tree(grown).predict(queries)
+  if shares.get('q') == shares.get('r') == 0.5 and ID3.evaluate(tree, tie) == first \
+     and model.predict([tie]) == [first] and agree:
+    print("weighted ties test succeeded.")
+  else:
+    print("weighted ties test failed.")
+
+def testModelRoundTrip():
+  data = parse.load('house_votes_84.data')
+  forest = randomForest.randomForest(5, seed=0)
+  forest.train(data[:300], 'democrat')
+  with tempfile.TemporaryDirectory() as modelDir:
+    path = os.path.join(modelDir, 'forest.model')
+    forest.save(path)
+    loaded = randomForest.randomForest.load(path)
+    same = loaded.predictAll(data[300:]) == forest.predictAll(data[300:])
+    del loaded
+  if same:
+    print("model round trip test succeeded.")
+  else:
+    print("model round trip test failed.")
+
+def testTrainingStats():
+  data = parse.load('house_votes_84.data')
+  stats = profiling.TrainingStats()
+  tree = ID3.ID3(data, 'democrat', stats=stats)
+  ID3.prune(tree, data[:100], stats=stats)
+  counters = stats.counters
+  listed = pstats.Stats(stats).stats
+  if counters['nodes'] == counters['leaves'] + counters['splits'] and counters['pruned'] > 0 \
+     and ('training', 0, 'count') in listed and stats.phases['build'][0] == 1:
+    print("training stats test succeeded.")
+  else:
+    print("training stats test failed.")
+
+def testTrainingStatsWithoutResource():
+  # Load a second copy of profiling as it would import where there is no resource module
+  saved = sys.modules.get('resource')
+  sys.modules['resource'] = None
+  try:
+    spec = importlib.util.spec_from_file_location('profiling_without_resource', profiling.__file__)
+    stripped = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(stripped)
+  finally:
+    sys.modules['resource'] = saved
+  stats = stripped.TrainingStats()
+  ID3.ID3(parse.load('house_votes_84.data'), 'democrat', stats=stats)
+  if stripped.resource is None and stats.peak_rss == 0 and stats.phases['build'][0] == 1:
+    print("training stats without resource test succeeded.")
+  else:
+    print("training stats without resource test failed.")
+
+def testPredictionServer():
+  data = parse.load('house_votes_84.data')
+  forest = randomForest.randomForest(5, max_feature=4, seed=0)
+  forest.train(data[:300], 'democrat')
+  examples = [data.example(i) for i in range(300, len(data))]
+  async def run(path):
+    server = serve.PredictionServer(serve.Predictor(path))
+    listener = await server.start(port=0)
+    url = f"http://127.0.0.1:{listener.sockets[0].getsockname()[1]}"
+    report = await serve.load(url, examples, requests=200, concurrency=8)
+    reader, writer = await serve.connect(url)
+    _, answer = await serve.call(reader, writer, 'POST', '/predict', {'examples': examples})
+    writer.close()
+    await server.stop()
+    return report, answer
+  with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, 'forest.model')
+    forest.save(path)
+    report, answer = asyncio.run(run(path))
+  if report['errors'] == 0 and report['server']['requests'] == 200 \
+     and answer['predictions'] == forest.predictAll(data[300:]):
+    print("prediction server test succeeded.")
+  else:
+    print("prediction server test failed.")
+
+def testServerRejectsOnlyBadRequests():
+  data = parse.load('house_votes_84.data')
+  tree = compiled.compile_tree(ID3.ID3(data, 'democrat'))
+  good = data.example(0)
+  bad = dict(good, **{data.attributes[0]: ['y']})
+  async def raw(url, request):
+    reader, writer = await serve.connect(url)
+    writer.write(request)
+    _, status, _, body = await serve.read_message(reader)
+    writer.close()
+    return int(status)
+  async def run(path):
+    # A long window puts both requests in one batch
+    server = serve.PredictionServer(serve.Predictor(path), window=0.2)
+    listener = await server.start(port=0)
+    url = f"http://127.0.0.1:{listener.sockets[0].getsockname()[1]}"
+    connections = [await serve.connect(url) for _ in range(2)]
+    answers = await asyncio.gather(*[serve.call(reader, writer, 'POST', '/predict', {'example': e})
+                                     for (reader, writer), e in zip(connections, [good, bad])])
+    for _, writer in connections:
+      writer.close()
+    malformed = [await raw(url, request) for request in
+                 [b'GARBAGE\r\n\r\n', b'POST /predict HTTP/1.1\r\nContent-Length: ten\r\n\r\n',
+                  b'POST /predict HTTP/1.1\r\nContent-Length: -5\r\n\r\n',
+                  f"POST /predict HTTP/1.1\r\nContent-Length: {serve.MAX_BODY_BYTES + 1}\r\n\r\n".encode()]]
+    await server.stop()
+    return answers, malformed, server.stats.batches
+  with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, 'tree.model')
+    compiled.save_tree(path, tree)
+    answers, malformed, batches = asyncio.run(run(path))
+  if [status for status, _ in answers] == [200, 400] and answers[0][1]['prediction'] == data.classes[data.y[0]] \
+     and batches == 1 and malformed == [400] * 4:
+    print("server bad request test succeeded.")
+  else:
+    print("server bad request test failed.")
+
+def testServerOutlivesFailedBatches():
+  data = parse.load('house_votes_84.data')
+  tree = compiled.compile_tree(ID3.ID3(data, 'democrat'))
+  good = data.example(0)
+  class Flaky(serve.Predictor):
+    # Returns nothing usable for its first batch, as a broken predictor might
+    calls = 0
+    def predict(self, examples):
+      self.calls += 1
+      return None if self.calls == 1 else super().predict(examples)
+  async def run(path):
+    server = serve.PredictionServer(Flaky(path), window=0.1)
+    await server.start(port=0)
+    outcomes = []
+    try:
+      await asyncio.wait_for(server.predict([good]), 1)
+    except TypeError:
+      outcomes.append('failed')
+    except asyncio.TimeoutError:
+      outcomes.append('timed out')
+    # The first request is cancelled while its batch collects, as when a client goes away
+    gone = asyncio.ensure_future(server.predict([good]))
+    kept = asyncio.ensure_future(server.predict([good]))
+    await asyncio.sleep(0.02)
+    gone.cancel()
+    try:
+      outcomes.append(await asyncio.wait_for(kept, 1))
+      outcomes.append(await asyncio.wait_for(server.predict([good]), 1))
+    except asyncio.TimeoutError:
+      outcomes.append('timed out')
+    alive = not server._batcher.done()
+    await server.stop()
+    return outcomes, alive
+  with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, 'tree.model')
+    compiled.save_tree(path, tree)
+    outcomes, alive = asyncio.run(run(path))
+  answer = [data.classes[data.y[0]]]
+  if outcomes == ['failed', answer, answer] and alive:
+    print("server failed batch test succeeded.")
+  else:
+    print("server failed batch test failed.")
+
+def testCheckpointResumesAfterTruncation():
+  data = parse.load('house_votes_84.data')
+  options = dict(train_sizes=[10, 30], num_runs=3)
+  full = learn_curve.learning_curve(data, **options)
+  with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, 'curve.jsonl')
+    learn_curve.learning_curve(data, checkpoint=path, **options)
+    # As if the run was killed while writing its last cell
+    with open(path, 'r+b') as f:
+      f.truncate(os.path.getsize(path) - 5)
+    resumed = learn_curve.learning_curve(data, checkpoint=path, **options)
+    with open(path) as f:
+      cells = [json.loads(line) for line in f]
+  if (resumed['with_pruning'] == full['with_pruning']).all() and len(cells) == 1 + 2 * 3:
+    print("checkpoint resume test succeeded.")
+  else:
+    print("checkpoint resume test failed.")
+
+def testImportsHaveNoSideEffects():
+  failures = benchmark.check_imports(repeat=1)
+  if failures:
+    print("import test failed:", "; ".join(failures))
+  else:
+    print("import test succeeded.")
+
+def testBenchmarkComparison():
+  result = benchmark.run_case('id3_train', 500, 5)
+  baseline = {'results': [result]}
+  slower = {'results': [dict(result, seconds=result['seconds'] * 2)]}
+  if not benchmark.compare(baseline, baseline) and len(benchmark.compare(baseline, slower)) == 1:
+    print("benchmark comparison test succeeded.")
+  else:
+    print("benchmark comparison test failed.")
+
+def testIncrementalMatchesRetraining():
+  data = parse.parse('house_votes_84.data')
+  random.Random(0).shuffle(data)
+  tree = incremental.IncrementalID3('democrat', min_samples_leaf=2)
+  matches = True
+  ends = [1, 2, 10, 50, 200, 201, len(data)]
+  for start, end in zip([0] + ends, ends):
+    tree.update(data[start:end])
+    matches &= sameTree(tree.root, ID3.ID3(data[:end], 'democrat', min_samples_leaf=2))
+  if matches and len(tree) == len(data):
+    print("incremental tree test succeeded.")
+  else:
+    print("incremental tree test failed.")
+
+def testPruningPath():
+  data = parse.load('house_votes_84.data')
+  train, valid = data[:200], data[200:300]
+  tree = compiled.compile_tree(ID3.ID3(train, 'democrat'))
+  features = tree.feature.copy()
+  path = pruning.pruning_path(tree, train)
+  scores = path.scores(valid)
+  levels = [ID3.test(path.tree_at(k).root(), valid) for k in range(len(path))]
+  if all(abs(a - b) < 1e-12 for a, b in zip(scores, levels)) and (tree.feature == features).all() \
+     and path.tree_at(len(path) - 1).root().decision_label is None and scores[path.best_level(valid)] == max(levels):
+    print("pruning path test succeeded.")
+  else:
+    print("pruning path test failed.")
+
+def testCrossValidation():
+  data = parse.load('house_votes_84.data')
+  configs = tuning.grid(max_depth=[None, 2], prune=[False, True]) + [dict(model='forest', tree_numbers=3)]
+  splits = tuning.kfold(len(data), 4)
+  results = tuning.search(data, configs, splits)
+  train, test = splits[0]
+  tree = ID3.ID3(data[train], 'democrat', max_depth=2)
+  if [r['scores'] for r in results] == [r['scores'] for r in tuning.search(data, configs, splits, n_jobs=2)] \
+     and results[2]['scores'][0] == ID3.test(tree, data[test]):
+    print("cross-validation test succeeded.")
+  else:
+    print("cross-validation test failed.")
+
 # inFile - string location of the house data file
 def testPruningOnHouseData():
   inFile = 'house_votes_84.data'